@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+History-driven protein batch sizing for define_jobs.py.
+
+Per-protein generation times are recovered from the job.out files of a
+previous run: the generation time of each job (the sum of its timing lines,
+without model initialisation) is split across its proteins in proportion to
+the amount of text generated for each of them. The times can be saved to a
+small stats CSV and reused. Proteins without history are estimated from their
+prompt and the average completion length in tokens.
+
+To build a stats file from a previous run:
+    python3 batch_planner.py --output-path /path/to/data/vLLMBashAppOutput --stats-file protein_times.csv
+"""
+
+import argparse
+import csv
+import os
+import re
+from collections import defaultdict
+
+TIMING_PATTERNS = [
+    re.compile(r'Iteration: \d+, Time: ([\d.]+) sec'),  # Polaris vllm_batch.py
+    re.compile(r'Inference latency: ([\d.]+) sec'),  # Sunspot run_generation_with_deepspeed.py
+]
+SECTION_PATTERN = re.compile(r'\*\* START (\S+) \*\*(.*?)\*\* END \1 \*\*', re.DOTALL)
+CHARS_PER_TOKEN = 4
+DEFAULT_SECONDS_PER_TOKEN = 0.02  # used when there is no history at all
+DEFAULT_COMPLETION_TOKENS = 1024
+
+
+def parse_job_history(output_path):
+    """
+    Estimate per-protein generation seconds and generated characters from the job.out files under output_path.
+    Returns two dicts keyed by protein: seconds and generated characters, averaged over the jobs of the protein.
+    """
+    seconds = defaultdict(float)
+    chars = defaultdict(int)
+    runs = defaultdict(int)
+    job_outputs = [os.path.join(dirpath, filename)
+                   for dirpath, dirnames, filenames in os.walk(output_path)
+                   for filename in filenames
+                   # job.out.N are the outputs of the runs before a restart
+                   if filename == 'job.out' or filename.startswith('job.out.')]
+    for job_output in job_outputs:
+        with open(job_output, 'r', encoding='utf8', errors='ignore') as f:
+            content = f.read()
+        job_seconds = sum(float(match.group(1)) for pattern in TIMING_PATTERNS for match in pattern.finditer(content))
+        job_chars = defaultdict(int)
+        for match in SECTION_PATTERN.finditer(content):
+            job_chars[match.group(1)] += len(match.group(2))
+        total_chars = sum(job_chars.values())
+        if not job_seconds or not total_chars:
+            continue
+        for protein, protein_chars in job_chars.items():
+            seconds[protein] += job_seconds * protein_chars / total_chars
+            chars[protein] += protein_chars
+            runs[protein] += 1
+    # Average over the jobs that generated each protein
+    return ({protein: seconds[protein] / runs[protein] for protein in seconds},
+            {protein: chars[protein] // runs[protein] for protein in chars})
+
+
+def save_stats(stats_file, seconds, chars):
+    with open(stats_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['protein', 'seconds', 'chars'])
+        for protein in sorted(seconds):
+            writer.writerow([protein, f'{seconds[protein]:.3f}', chars.get(protein, 0)])
+
+
+def load_stats(stats_file):
+    seconds = {}
+    chars = {}
+    with open(stats_file, 'r') as f:
+        for row in csv.DictReader(f):
+            seconds[row['protein']] = float(row['seconds'])
+            chars[row['protein']] = int(row['chars'])
+    return seconds, chars
+
+
+class ProteinCostModel:
+    """
+    Estimated generation seconds per protein, from history when available and
+    from the prompt and average completion length in tokens otherwise.
+    """
+
+    def __init__(self, seconds=None, chars=None, prompt=''):
+        self.seconds = seconds or {}
+        self.prompt_tokens = len(prompt) / CHARS_PER_TOKEN
+        total_chars = sum((chars or {}).values())
+        if self.seconds and total_chars:
+            total_tokens = total_chars / CHARS_PER_TOKEN
+            self.completion_tokens = total_tokens / len(self.seconds)
+            self.seconds_per_token = sum(self.seconds.values()) / total_tokens
+        else:
+            self.completion_tokens = DEFAULT_COMPLETION_TOKENS
+            self.seconds_per_token = DEFAULT_SECONDS_PER_TOKEN
+
+    @classmethod
+    def from_history(cls, history_path, prompt=''):
+        """Build the model from a stats CSV or from a directory of previous job outputs."""
+        if history_path is None:
+            return cls(prompt=prompt)
+        if os.path.isdir(history_path):
+            return cls(*parse_job_history(history_path), prompt=prompt)
+        return cls(*load_stats(history_path), prompt=prompt)
+
+    def estimate(self, protein):
+        if protein in self.seconds:
+            return self.seconds[protein]
+        tokens = self.prompt_tokens + len(protein) / CHARS_PER_TOKEN + self.completion_tokens
+        return tokens * self.seconds_per_token
+
+    def estimate_batch(self, proteins, overhead_seconds=0):
+        return overhead_seconds + sum(self.estimate(protein) for protein in proteins)
+
+
+def plan_batches(proteins, cost_model, target_seconds, overhead_seconds=0, max_batch_size=None):
+    """
+    Cut the proteins, in order, into batches whose estimated generation time fits
+    target_seconds once the per-job overhead (e.g. model initialisation) is paid.
+    Yields (batch, estimated_seconds) with at least one protein per batch.
+    """
+    budget = target_seconds - overhead_seconds
+    batch = []
+    batch_seconds = 0
+    for protein in proteins:
+        cost = cost_model.estimate(protein)
+        full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (batch_seconds + cost > budget or full):
+            yield batch, overhead_seconds + batch_seconds
+            batch = []
+            batch_seconds = 0
+        batch.append(protein)
+        batch_seconds += cost
+    if batch:
+        yield batch, overhead_seconds + batch_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect per-protein generation times from previous job outputs')
+    parser.add_argument('--output-path', required=True, help='Directory holding the job directories of a previous run')
+    parser.add_argument('--stats-file', default='protein_times.csv', help='Output stats CSV (default: protein_times.csv)')
+    args = parser.parse_args()
+
+    seconds, chars = parse_job_history(args.output_path)
+    save_stats(args.stats_file, seconds, chars)
+    print(f"Wrote generation times of {len(seconds)} proteins to {args.stats_file}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -92,6 +92,32 @@ class vLLMBashApp(ApplicationDefinition):
     def shell_preamble(self):
         return f'module load conda && conda activate balsam-vllm-polaris-conda-env'
 
-    command_template = "python3 /grand/datascience/vllm_batch.py --protein-list {{protein_list}} --prompt {{prompt}} --num-iter {{num_iter}}"
+    command_template = "python3 /grand/datascience/vllm_batch.py --protein-list {{protein_list}} --prompt {{prompt}} --num-iter {{num_iter}} --results-file results.jsonl --resume --samples-per-call 5"
+
+
+class vLLMQueueApp(ApplicationDefinition):
+    """
+    One job per node slot; every job pulls proteins from the shared protein_queue.py queue until it is drained.
+    """
+    site = site_name
+
+    def shell_preamble(self):
+        return f'module load conda && conda activate balsam-vllm-polaris-conda-env'
+
+    command_template = "python3 /grand/datascience/vllm_batch.py --queue-dir {{queue_dir}} --prompt {{prompt}} --num-iter {{num_iter}} --results-file results.jsonl --resume"
+
+
+class vLLMWorkerApp(ApplicationDefinition):
+    """
+    Long-lived worker: loads the model once and serves the protein batches requested in serve_dir until it stays idle.
+    """
+    site = site_name
+
+    def shell_preamble(self):
+        return f'module load conda && conda activate balsam-vllm-polaris-conda-env'
+
+    command_template = "python3 /grand/datascience/vllm_batch.py --serve-dir {{serve_dir}} --results-dir {{results_dir}} --prompt {{prompt}} --num-iter {{num_iter}} --results-file results.jsonl"
 
 vLLMBashApp.sync()
+vLLMQueueApp.sync()
+vLLMWorkerApp.sync()
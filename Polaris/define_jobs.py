@@ -3,19 +3,33 @@ from balsam.api import Job, Site, BatchJob
 import os
 import pandas as pd
 import time
+from batch_planner import ProteinCostModel, plan_batches
+from job_scheduler import new_schedule_id, schedule_lpt, schedule_tags
+from protein_queue import ProteinQueue
+from job_submitter import StreamingSubmitter
 
 total_app_start = time.time()
 
 site_name = "polaris-site"
 app_path = os.getcwd()
 proteins_file_path = os.path.join(app_path,"proteins.csv")
+HISTORY_PATH = None # stats CSV or job output directory of a previous run; None keeps fixed batches of 100 proteins
+TARGET_JOB_SECONDS = 60*60 # estimated time each planned job should take
+MODEL_INIT_SECONDS = 10*60 # model initialisation paid once by every job
+NUM_NODES = 10 #CHANGE THIS to the num_nodes of the BatchJob below
+NODE_PACKING_COUNT = 1
+QUEUE_DIR = None #CHANGE THIS to a directory shared by the compute nodes to pull proteins from a work-stealing queue
+QUEUE_UNIT_SIZE = 10 # proteins claimed at a time from the queue
+SERVE_DIR = None #CHANGE THIS to a directory shared by the compute nodes to serve all batches from one long-lived worker per node
+SUBMIT_WINDOW = None # maximum jobs in flight, the next batches are submitted as jobs finish; None creates every job up front
+CURSOR_FILE = os.path.join(app_path,"submit_cursor.json") # a streaming submission resumes from here
 
 class JobDefine():
     def __init__(self) -> None:
         self.prompt = f"You are playing the role of a helpful assistant. We are interested in protein interactions.  Based on the documents you have been trained with, can you provide any information on which proteins might interact with"
     
 
-    def get_word_batches(self, df, batch_size=5):
+    def get_word_batches(self, df, batch_size=5, cost_model=None):
         """
         Yield batches of words from the dataframe as comma-separated strings along with cyclic permutations of CCL_WORKER_AFFINITY and cpu-bind values.
 
@@ -23,10 +37,16 @@ class JobDefine():
         - df: DataFrame containing the words.
         - column_name: Name of the column containing the words.
         - batch_size: Size of each batch (default: 5).
+        - cost_model: Optional ProteinCostModel; when given, batches are sized to TARGET_JOB_SECONDS instead of batch_size.
 
         Returns:
         - Iterator yielding the batch index, comma-separated word batches, CCL_WORKER_AFFINITY, and cpu-bind values.
         """
+        if cost_model is not None:
+            batches = plan_batches(df['search_words'].tolist(), cost_model, TARGET_JOB_SECONDS, MODEL_INIT_SECONDS)
+            for index, (batch, estimated_seconds) in enumerate(batches):
+                yield index, ','.join(batch)
+            return
         total_rows = df.shape[0]
 
         for index, start in enumerate(range(0, total_rows, batch_size)):
@@ -34,34 +54,99 @@ class JobDefine():
             batch = df.iloc[start:end]['search_words'].tolist()            
             yield index, ','.join(batch)
 
+    def define_queue_jobs(self, df):
+        """
+        Queue all the proteins and create one job per node slot; each job claims small
+        units from the queue until it is drained, so the load balances itself across nodes.
+        """
+        num_units = ProteinQueue(QUEUE_DIR).create(df['search_words'].tolist(), QUEUE_UNIT_SIZE)
+        print(f"Queued {df.shape[0]} proteins in {num_units} units in {QUEUE_DIR}")
+        jobs = [Job(app_id="vLLMQueueApp",
+            site_name=site_name,
+            workdir=f'vLLMBashAppOutput/queue_{n}',
+            parameters={"prompt": f"'{self.prompt}'", "queue_dir":QUEUE_DIR, "num_iter":10},
+            num_nodes=1,
+            ranks_per_node=1,
+            gpus_per_rank=4,
+            tags={"queue":QUEUE_DIR},
+            node_packing_count = NODE_PACKING_COUNT
+        )for n in range(NUM_NODES*NODE_PACKING_COUNT)]
+        return Job.objects.bulk_create(jobs)
+
+    def define_worker_jobs(self, scheduled):
+        """
+        Request every batch from the serve directory and create one long-lived worker job per node;
+        the model is loaded once per node instead of once per batch.
+        Each batch is written to vLLMBashAppOutput/batch_<n>/job.out of the site.
+        """
+        results_dir = os.path.join(Site.objects.get(site_name).path, "data", "vLLMBashAppOutput")
+        serve_queue = ProteinQueue(SERVE_DIR)
+        for n, (batch, est_sec, slot) in enumerate(scheduled):
+            serve_queue.add(batch.split(','), f'batch_{n}')
+        print(f"Requested {len(scheduled)} batches from {SERVE_DIR}")
+        jobs = [Job(app_id="vLLMWorkerApp",
+            site_name=site_name,
+            workdir=f'vLLMWorkerAppOutput/{n}',
+            parameters={"prompt": f"'{self.prompt}'", "serve_dir":SERVE_DIR, "results_dir":results_dir, "num_iter":10},
+            num_nodes=1,
+            ranks_per_node=1,
+            gpus_per_rank=4,
+            tags={"serve":SERVE_DIR},
+            node_packing_count = 1
+        )for n in range(NUM_NODES)]
+        return Job.objects.bulk_create(jobs)
+
     def define_job(self):
         df = pd.read_csv(proteins_file_path)
         #df = df.iloc[0:99] #change this to run all
-        jobs = [Job(app_id="vLLMBashApp",
+        if QUEUE_DIR:
+            return self.define_queue_jobs(df)
+        cost_model = ProteinCostModel.from_history(HISTORY_PATH, self.prompt)
+        batches = [(batch, cost_model.estimate_batch(batch.split(','), MODEL_INIT_SECONDS))
+                   for n, batch in self.get_word_batches(df,100,cost_model if HISTORY_PATH else None)]
+        # Longest jobs first, so the slowest batches do not start last
+        scheduled, predicted_makespan = schedule_lpt(batches, NUM_NODES*NODE_PACKING_COUNT)
+        if SERVE_DIR:
+            return self.define_worker_jobs(scheduled)
+        self.schedule_id = new_schedule_id()
+        if SUBMIT_WINDOW:
+            submitter = StreamingSubmitter(self.make_job, scheduled, SUBMIT_WINDOW, CURSOR_FILE)
+            # A resumed submission keeps the schedule id of its plan
+            self.schedule_id = submitter.plan_digest[:12]
+        print(f"Schedule {self.schedule_id}: {len(scheduled)} jobs, predicted makespan {predicted_makespan/60:.1f} min")
+        print(f"Compare with the achieved makespan later: python3 job_scheduler.py --site {site_name} --schedule {self.schedule_id}")
+        if SUBMIT_WINDOW:
+            return submitter.run()
+        jobs = [self.make_job(n, item) for n, item in enumerate(scheduled)]
+        jobs = Job.objects.bulk_create(jobs)
+        return jobs
+
+    def make_job(self, n, item):
+        batch, est_sec, slot = item
+        return Job(app_id="vLLMBashApp",
             site_name=site_name,
             workdir=f'vLLMBashAppOutput/{n}',
             parameters={"prompt": f"'{self.prompt}'", "protein_list":batch, "num_iter":10},
             num_nodes=1,
             ranks_per_node=1,
             gpus_per_rank=4,
-            tags={"target":batch},
-            node_packing_count = 1 
-        )for n, batch in self.get_word_batches(df,100)]
-        jobs = Job.objects.bulk_create(jobs)
-        return jobs
+            tags={"target":batch, **schedule_tags(self.schedule_id, est_sec, slot)},
+            node_packing_count = NODE_PACKING_COUNT
+        )
 
 
 jobdefine = JobDefine()
-jobs = jobdefine.define_job()
 site = Site.objects.get(site_name)
+# The BatchJob is requested first, so a streaming submission has nodes to run its window on
 #CHANGE THESE TO YOUR PROJECT/QUEUE
 BatchJob.objects.create(
     site_id=site.id,
-    num_nodes=10,
+    num_nodes=NUM_NODES,
     wall_time_min=180,
     job_mode="mpi",
     project="datascience",
     queue="prod",
 )
+jobs = jobdefine.define_job()
     
 
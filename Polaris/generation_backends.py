@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Generation backends of vllm_batch.py.
+
+A backend loads the model once and generates `num_samples` completions of each
+prompt in a single call, so the prompts are prefilled once and the scheduler
+sees every sample of the batch at the same time. Completions are returned per
+prompt, in the order of the prompts, as lists of Completion.
+
+- VLLMBackend runs Llama-2-70b with vLLM and ray, imported on first use.
+- FakeBackend runs on a CPU without any model, to test the job scripts: its
+  completions are seeded word salads, optionally paced per token.
+"""
+
+import random
+import time
+from collections import namedtuple
+
+Completion = namedtuple('Completion', ['text', 'num_tokens', 'prompt_tokens'])
+
+DEFAULT_SEED = 123321213
+
+
+class VLLMBackend:
+    model = "meta-llama/Llama-2-70b-chat-hf"
+
+    def __init__(self, max_tokens=1024, seed=DEFAULT_SEED):
+        import ray
+        from vllm import LLM, SamplingParams
+        ray.init(_temp_dir='/tmp')
+        self.SamplingParams = SamplingParams
+        self.max_tokens = max_tokens
+        self.llm = LLM(model=self.model,tokenizer='hf-internal-testing/llama-tokenizer',tensor_parallel_size=4,download_dir='/grand/datascience/',seed=seed) #change dir
+
+    def sampling_params(self, num_samples, seed):
+        try:
+            return self.SamplingParams(n=num_samples, max_tokens=self.max_tokens, seed=seed)
+        except TypeError:
+            # vLLM before 0.3 has no per-request seed, the samples follow the seed of the LLM
+            return self.SamplingParams(n=num_samples, max_tokens=self.max_tokens)
+
+    def generate(self, prompts, num_samples, seed=None):
+        outputs = self.llm.generate(prompts, self.sampling_params(num_samples, seed))
+        return [[Completion(sample.text, len(sample.token_ids), len(output.prompt_token_ids)) for sample in output.outputs]
+                for output in outputs]
+
+
+class FakeBackend:
+    model = 'fake'
+    WORDS = ['BRCA1', 'BRCA2', 'TP53', 'RAD52', 'XRCC3', 'PALB2', 'ATM', 'interacts', 'with', 'and',
+             'the', 'protein', 'repair', 'DNA', 'binds', 'complex', 'may', 'also']
+
+    def __init__(self, max_tokens=64, seed=DEFAULT_SEED, seconds_per_token=0.0):
+        self.max_tokens = max_tokens
+        self.seed = seed
+        self.seconds_per_token = seconds_per_token
+
+    def generate(self, prompts, num_samples, seed=None):
+        results = []
+        for prompt in prompts:
+            samples = []
+            for sample in range(num_samples):
+                rng = random.Random(f"{self.seed}:{seed}:{prompt}:{sample}")
+                words = rng.choices(self.WORDS, k=rng.randint(1, self.max_tokens))
+                samples.append(Completion(' ' + ' '.join(words), len(words), len(prompt.split())))
+            results.append(samples)
+        time.sleep(self.seconds_per_token * max([completion.num_tokens for samples in results for completion in samples], default=0))
+        return results
+
+
+BACKENDS = {'vllm': VLLMBackend, 'fake': FakeBackend}
+
+
+def load_backend(name, **kwargs):
+    return BACKENDS[name](**kwargs)
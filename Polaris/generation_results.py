@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Structured results of vllm_batch.py: one JSON record per (protein, iteration).
+
+    {"protein": "RAD51", "iteration": 0, "text": "...", "prompt_tokens": 41,
+     "completion_tokens": 312, "seconds": 12.5, "time": 1700000000.0,
+     "seed": 123321213, "sample": 0}
+
+`seconds` is the share of the generation call of the iteration, as in the
+`Iteration: N, Time:` lines, and `time` when the record was written. `seed` and
+`sample` locate the completion in the seeded call that generated it, so a
+resumed job regenerates the missing iterations as they would have been.
+
+Records are written through a large buffer and flushed after every generation
+call, so a reader only misses the call in progress, at most with its last line
+half written.
+"""
+
+import json
+import os
+
+BUFFER_SIZE = 1 << 20
+
+
+class ResultsWriter:
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.file = open(path, mode, buffering=BUFFER_SIZE)
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_results(path):
+    """Yield the records of a results file, skipping a line still being written."""
+    with open(path, 'r', encoding='utf8', errors='ignore') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def resume_results(path):
+    """
+    Prepare a results file to be appended to by a restarted job. Drops a line left half
+    written by the previous run and returns the (protein, iteration) pairs already completed.
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'rb+') as f:
+        content = f.read()
+        f.truncate(content.rfind(b'\n') + 1)
+    return set((record['protein'], record['iteration']) for record in read_results(path))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Makespan-aware ordering of the Balsam jobs created by define_jobs.py.
+
+The launcher of a BatchJob starts ready jobs in creation order whenever a slot
+(one of num_nodes x node_packing_count) frees up. Jobs are therefore created
+longest-processing-time first, which keeps the slowest batches from starting
+last and stretching the BatchJob past its wall time. Each job is tagged with its
+estimated seconds, the slot it is expected to run on and a schedule id, so the
+predicted makespan can be compared with the one achieved once the jobs are done:
+    python3 job_scheduler.py --site polaris-site --schedule <schedule id>
+"""
+
+import argparse
+import heapq
+import time
+from balsam.api import Job, Site, EventLog
+
+
+def schedule_lpt(batches, num_slots):
+    """
+    Order (batch, estimated_seconds) pairs longest first and assign each to the slot that frees up first.
+    Returns the (batch, estimated_seconds, slot) triples in submission order and the predicted makespan.
+    """
+    slots = [(0.0, slot) for slot in range(max(num_slots, 1))]
+    scheduled = []
+    for batch, estimated_seconds in sorted(batches, key=lambda item: item[1], reverse=True):
+        finish, slot = heapq.heappop(slots)
+        scheduled.append((batch, estimated_seconds, slot))
+        heapq.heappush(slots, (finish + estimated_seconds, slot))
+    return scheduled, max(finish for finish, slot in slots)
+
+
+def schedule_tags(schedule_id, estimated_seconds, slot):
+    return {"schedule": schedule_id, "est_sec": str(round(estimated_seconds)), "slot": str(slot)}
+
+
+def new_schedule_id():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def makespan_report(site_name, schedule_id):
+    """
+    Compare the makespan predicted from the est_sec/slot tags of a schedule with
+    the one achieved, from the first RUNNING to the last RUN_DONE event of its jobs.
+    """
+    site = Site.objects.get(site_name)
+    jobs = list(Job.objects.filter(site_id=site.id, tags={"schedule": schedule_id}))
+    if not jobs:
+        print(f"No jobs found for schedule {schedule_id} on {site_name}")
+        return None
+    slot_seconds = {}
+    for job in jobs:
+        slot_seconds[job.tags["slot"]] = slot_seconds.get(job.tags["slot"], 0) + float(job.tags["est_sec"])
+    predicted = max(slot_seconds.values())
+
+    job_ids = [job.id for job in jobs]
+    started = [event.timestamp for event in EventLog.objects.filter(job_id=job_ids, to_state="RUNNING")]
+    done_events = EventLog.objects.filter(job_id=job_ids, to_state="RUN_DONE")
+    finished = [event.timestamp for event in done_events]
+    done = len(set(event.job_id for event in done_events))
+    print(f"Schedule {schedule_id}: {len(jobs)} jobs on {len(slot_seconds)} slots, {done} done")
+    print(f"Predicted makespan: {predicted:.0f} secs")
+    if not started or not finished:
+        print("Achieved makespan: no job has finished yet")
+        return predicted, None
+    achieved = (max(finished) - min(started)).total_seconds()
+    print(f"Achieved makespan: {achieved:.0f} secs ({achieved / predicted:.2f}x predicted)"
+          + ("" if done == len(jobs) else " so far"))
+    return predicted, achieved
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the predicted vs achieved makespan of a job schedule')
+    parser.add_argument('--site', required=True, help='Balsam site name')
+    parser.add_argument('--schedule', required=True, help='Schedule id printed by define_jobs.py')
+    args = parser.parse_args()
+    makespan_report(args.site, args.schedule)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Streaming submission of Balsam jobs with a bounded window of jobs in flight.
+
+Instead of creating every job up front, define_jobs.py can hand its planned
+batches to a StreamingSubmitter. It keeps at most `window` jobs of the campaign
+in flight on the site and creates the next batches as earlier jobs finish. The
+position in the plan and the ids in flight are persisted to a cursor file after
+every submission. Stopping the submitter (Ctrl+C, or creating the pause file
+next to the cursor) leaves the jobs in flight running. Running define_jobs.py
+again resumes from the cursor with whatever job parameters it now defines.
+"""
+
+import hashlib
+import json
+import os
+import time
+from balsam.api import Job
+
+FINAL_STATES = ["JOB_FINISHED", "FAILED"]
+
+
+class StreamingSubmitter:
+    def __init__(self, make_job, items, window, cursor_file, poll_interval=30):
+        """
+        - make_job: callable building the unsaved Job of the n-th item, make_job(n, item).
+        - items: the planned items in submission order; their repr identifies the plan in the cursor.
+        - window: maximum number of jobs in flight.
+        - cursor_file: JSON file persisting the next item and the job ids in flight.
+        """
+        self.make_job = make_job
+        self.items = list(items)
+        self.window = window
+        self.cursor_file = cursor_file
+        self.pause_file = cursor_file + '.pause'
+        self.poll_interval = poll_interval
+        self.plan_digest = hashlib.sha1(repr(self.items).encode()).hexdigest()
+        self.next_item = 0
+        self.in_flight = []
+        if os.path.exists(cursor_file):
+            with open(cursor_file, 'r') as f:
+                cursor = json.load(f)
+            if cursor['plan'] != self.plan_digest:
+                raise RuntimeError(f"{cursor_file} belongs to a different plan of batches; remove it to start over")
+            self.next_item = cursor['next']
+            self.in_flight = cursor['in_flight']
+            print(f"Resuming at batch {self.next_item} of {len(self.items)} with {len(self.in_flight)} jobs in flight")
+
+    def save_cursor(self):
+        tmp_file = self.cursor_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({'plan': self.plan_digest, 'next': self.next_item, 'in_flight': self.in_flight}, f)
+        os.replace(tmp_file, self.cursor_file)
+
+    def refresh_in_flight(self):
+        """Drop the jobs that finished, failed or were deleted. Returns the number dropped."""
+        if not self.in_flight:
+            return 0
+        states = {job.id: job.state for job in Job.objects.filter(id=self.in_flight)}
+        still_in_flight = [job_id for job_id in self.in_flight if states.get(job_id) not in FINAL_STATES + [None]]
+        done = len(self.in_flight) - len(still_in_flight)
+        self.in_flight = still_in_flight
+        return done
+
+    def fill_window(self):
+        """Create jobs for the next items until the window is full. Returns the created jobs."""
+        count = min(self.window - len(self.in_flight), len(self.items) - self.next_item)
+        if count <= 0:
+            return []
+        jobs = [self.make_job(n, self.items[n]) for n in range(self.next_item, self.next_item + count)]
+        jobs = Job.objects.bulk_create(jobs)
+        self.next_item += count
+        self.in_flight.extend(job.id for job in jobs)
+        self.save_cursor()
+        return jobs
+
+    def paused(self):
+        return os.path.exists(self.pause_file)
+
+    def run(self):
+        """
+        Submit all the items, waiting for room in the window. Returns the jobs created by this run,
+        which stops early when paused; the jobs in flight keep running.
+        """
+        created = []
+        try:
+            while self.next_item < len(self.items):
+                if self.paused():
+                    print(f"Paused at batch {self.next_item} of {len(self.items)}; remove {self.pause_file} and rerun to resume")
+                    break
+                done = self.refresh_in_flight()
+                jobs = self.fill_window()
+                created.extend(jobs)
+                if done or jobs:
+                    print(f"{done} jobs done, {len(jobs)} submitted, {len(self.in_flight)} in flight, "
+                          f"{len(self.items) - self.next_item} batches left")
+                if self.next_item < len(self.items):
+                    time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print(f"Stopped at batch {self.next_item} of {len(self.items)}; rerun to resume")
+        self.save_cursor()
+        return created
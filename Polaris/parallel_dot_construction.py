@@ -1,4 +1,5 @@
 import csv
+import json
 import os
 import re
 import multiprocessing
@@ -48,6 +49,26 @@ def search_patterns_in_file(filepath, words):
     return interactions, matched_words
 
 
+def search_records_in_file(filepath, words):
+    """
+    Same as search_patterns_in_file, from the results.jsonl records written by vllm_batch.py --results-file
+    """
+    interactions = []
+    matched_words = set()
+    with open(filepath, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # line still being written
+            word = record['protein']
+            if word not in words:
+                continue
+            matched_words.add(word)
+            for other_word in words:
+                if re.search(r'\b' + re.escape(other_word) + r'\b', record['text']) and other_word != word:
+                    interactions.append((word, other_word))
+    return interactions, matched_words
 
 
 def validate_and_generate_dot(interaction):
@@ -116,6 +137,10 @@ def parallel_validate(interactions):
 pool = multiprocessing.Pool()
 results = []
 for folder in folders:
+    filepath = os.path.join(folder, 'results.jsonl')
+    if os.path.exists(filepath):
+        results.append(pool.apply_async(search_records_in_file, args=(filepath, words)))
+        continue
     filepath = os.path.join(folder, 'job.out')
     if os.path.exists(filepath):
         results.append(pool.apply_async(search_patterns_in_file, args=(filepath, words)))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+File-based work-stealing queue of proteins shared by all the ranks of a BatchJob.
+
+The proteins are split into small work units, one file per unit. A rank claims a
+unit by renaming it out of pending/, which only one rank can win, and holds a
+lease on it while generating: the lease is the modification time of the claimed
+file and is renewed periodically. A unit whose lease expired (its rank died or
+was killed at the end of the wall time) is put back in pending/ for another rank.
+Every rank keeps claiming units until the queue is drained, so a node that
+finishes early takes over work instead of sitting idle.
+
+Queue directory layout (it must be on a filesystem shared by the compute nodes):
+    pending/unit_00000.txt          - one protein per line
+    claimed/unit_00000.txt@<owner>  - claimed unit, mtime is the lease start
+    done/unit_00000.txt             - completed unit
+
+To create a queue from proteins.csv and follow it:
+    python3 protein_queue.py create --queue-dir /path/to/queue --proteins-csv proteins.csv --unit-size 10
+    python3 protein_queue.py status --queue-dir /path/to/queue
+"""
+
+import argparse
+import csv
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_LEASE_SECONDS = 30*60
+OWNER_SEPARATOR = '@'
+
+
+def default_owner():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ProteinQueue:
+    def __init__(self, queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.pending_dir = os.path.join(queue_dir, 'pending')
+        self.claimed_dir = os.path.join(queue_dir, 'claimed')
+        self.done_dir = os.path.join(queue_dir, 'done')
+
+    def make_dirs(self):
+        for directory in (self.pending_dir, self.claimed_dir, self.done_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def create(self, proteins, unit_size=10):
+        """Split the proteins into pending work units. Returns the number of units."""
+        self.make_dirs()
+        if os.listdir(self.pending_dir) or os.listdir(self.claimed_dir) or os.listdir(self.done_dir):
+            raise RuntimeError(f"Queue {self.queue_dir} already holds work units")
+        num_units = 0
+        for num_units, start in enumerate(range(0, len(proteins), unit_size), 1):
+            self.add(proteins[start:start + unit_size], f'unit_{num_units - 1:05d}')
+        return num_units
+
+    def add(self, proteins, name=None):
+        """Add one pending unit, to a new or running queue. Returns the unit."""
+        self.make_dirs()
+        unit = f'{name or f"batch_{time.time_ns()}_{os.getpid()}"}.txt'
+        tmp_path = os.path.join(self.queue_dir, unit + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(''.join(protein + '\n' for protein in proteins))
+        # Units only appear in pending/ once complete
+        os.rename(tmp_path, os.path.join(self.pending_dir, unit))
+        return unit
+
+    def claimed_path(self, unit, owner):
+        return os.path.join(self.claimed_dir, unit + OWNER_SEPARATOR + owner)
+
+    def read_unit(self, path):
+        with open(path, 'r') as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def claim(self, owner):
+        """
+        Claim a pending unit, or else one whose lease expired.
+        Returns (unit, proteins), or None when no unit is available right now.
+        """
+        for unit in sorted(os.listdir(self.pending_dir)):
+            pending_path = os.path.join(self.pending_dir, unit)
+            claimed_path = self.claimed_path(unit, owner)
+            try:
+                # The lease starts before the rename, so a claimed unit never looks expired
+                os.utime(pending_path)
+                os.rename(pending_path, claimed_path)
+            except FileNotFoundError:
+                continue  # another rank won this unit
+            return unit, self.read_unit(claimed_path)
+        if self.requeue_expired():
+            return self.claim(owner)
+        return None
+
+    def requeue_expired(self):
+        """Put the units whose lease expired back in pending/. Returns the number of units requeued."""
+        requeued = 0
+        now = time.time()
+        for name in os.listdir(self.claimed_dir):
+            path = os.path.join(self.claimed_dir, name)
+            try:
+                expired = now - os.path.getmtime(path) > self.lease_seconds
+                if expired:
+                    os.rename(path, os.path.join(self.pending_dir, name.split(OWNER_SEPARATOR)[0]))
+                    requeued += 1
+            except FileNotFoundError:
+                continue  # completed or requeued by another rank meanwhile
+        return requeued
+
+    def renew(self, unit, owner):
+        """Renew the lease on a unit. Returns False if the unit was requeued after its lease expired."""
+        try:
+            os.utime(self.claimed_path(unit, owner))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, unit, owner):
+        """Mark a unit done. Returns False if it was requeued meanwhile; its proteins may then be generated twice."""
+        try:
+            os.rename(self.claimed_path(unit, owner), os.path.join(self.done_dir, unit))
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def leased(self, unit, owner):
+        """Renew the lease on a unit in the background while the block runs."""
+        stop = threading.Event()
+
+        def renew_lease():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew(unit, owner)
+
+        renewer = threading.Thread(target=renew_lease, daemon=True)
+        renewer.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            renewer.join()
+
+    def drained(self):
+        return not os.listdir(self.pending_dir) and not os.listdir(self.claimed_dir)
+
+    def units(self, owner, poll_interval=30):
+        """
+        Yield (unit, proteins) claimed for the owner until the queue is drained.
+        While other ranks hold the last units, keep polling in case their leases expire.
+        The caller completes each unit once its proteins are generated.
+        """
+        while True:
+            claimed = self.claim(owner)
+            if claimed is not None:
+                yield claimed
+            elif self.drained():
+                return
+            else:
+                time.sleep(poll_interval)
+
+    def status(self):
+        return {'pending': len(os.listdir(self.pending_dir)),
+                'claimed': len(os.listdir(self.claimed_dir)),
+                'done': len(os.listdir(self.done_dir))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create or inspect a work-stealing protein queue')
+    parser.add_argument('action', choices=['create', 'status'])
+    parser.add_argument('--queue-dir', required=True, help='Queue directory on a filesystem shared by the compute nodes')
+    parser.add_argument('--proteins-csv', default='proteins.csv', help='Proteins CSV file (create)')
+    parser.add_argument('--unit-size', type=int, default=10, help='Proteins per work unit (create, default: 10)')
+    args = parser.parse_args()
+
+    queue = ProteinQueue(args.queue_dir)
+    if args.action == 'create':
+        with open(args.proteins_csv, 'r') as f:
+            proteins = [row['search_words'].strip() for row in csv.DictReader(f) if row['search_words'].strip()]
+        num_units = queue.create(proteins, args.unit_size)
+        print(f"Queued {len(proteins)} proteins in {num_units} units of up to {args.unit_size}")
+    else:
+        print(', '.join(f"{state}: {count}" for state, count in queue.status().items()))
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
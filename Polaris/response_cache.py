@@ -0,0 +1 @@
+../Sophia/response_cache.py
\ No newline at end of file
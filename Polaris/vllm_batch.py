@@ -1,21 +1,176 @@
-from vllm import LLM, SamplingParams
-import ray
 from argparse import ArgumentParser
 import time
+import os
+from contextlib import redirect_stdout
+from protein_queue import ProteinQueue, default_owner
+from generation_backends import BACKENDS, DEFAULT_SEED, Completion, load_backend
+from generation_results import ResultsWriter, resume_results
+from response_cache import DEFAULT_MAX_BYTES, ResponseCache, cache_key
 
 #CHANGE os.environ["HF_HOME"] = "/lus/eagle/projects/CVD-Mol-AI/braceal/cache/huggingface"
 
 
+def cached_generate(backend, prompts, iterations, seed, cache):
+    """
+    backend.generate() of the iterations of the prompts, except for the prompts with all
+    their iterations in the response cache, and store the new completions in it.
+    A prompt is looked up until its first missing iteration. The whole call is then
+    generated again for it, the cached iterations before that miss are kept and only
+    the later ones are taken from the new samples and stored.
+    """
+    def key(prompt, i):
+        return cache_key(backend.model, prompt, backend.max_tokens, seed, i)
+
+    completions = {}
+    partial_hits = {}
+    for prompt in prompts:
+        hits = []
+        for i in iterations:
+            hit = cache.get(key(prompt, i))
+            if hit is None:
+                break
+            hits.append(Completion(**hit))
+        if len(hits) == len(iterations):
+            completions[prompt] = hits
+        else:
+            partial_hits[prompt] = hits
+    missing = list(partial_hits)
+    if missing:
+        for prompt, samples in zip(missing, backend.generate(missing, len(iterations), seed)):
+            hits = partial_hits[prompt]
+            completions[prompt] = hits + list(samples[len(hits):])
+            for i, sample in zip(iterations[len(hits):], samples[len(hits):]):
+                cache.put(key(prompt, i), sample._asdict())
+    return [completions[prompt] for prompt in prompts]
+
+
+def generate(backend, list_prompts, num_iter, return_out, seed=None, writer=None, completed=frozenset(), samples_per_call=None, cache=None):
+    """
+    Generate num_iter completions of every prompt, printing each between START/END markers,
+    and with a ResultsWriter, writing each as a record too. The (protein, iteration) pairs
+    in completed are skipped. With a ResponseCache, completions generated before are reused.
+    """
+    # The iterations are sampled samples_per_call at a time, the prompts are prefilled once per call
+    samples_per_call = samples_per_call or num_iter
+    for first in range(0, num_iter, samples_per_call):
+        iterations = range(first, min(first + samples_per_call, num_iter))
+        prompts = [prompt for prompt in list_prompts if any((prompt.split()[-1], i) not in completed for i in iterations)]
+        if not prompts:
+            continue
+        # Iteration i is always sample i - first of the call seeded with seed + first, whatever was already completed
+        call_seed = None if seed is None else seed + first
+        generation_start_time = time.time()
+        if cache:
+            completions = cached_generate(backend, prompts, iterations, call_seed, cache)
+        else:
+            completions = backend.generate(prompts, len(iterations), call_seed)
+        iteration_time = (time.time() - generation_start_time) / len(iterations)
+        for i in iterations:
+            # Print the outputs.
+            for prompt, samples in zip(prompts, completions):
+                protein = prompt.split()[-1]
+                if (protein, i) in completed:
+                    continue
+                generated_text = samples[i - first].text
+                print(f"** START {protein} **")
+                print(f"Prompt: {prompt!r}") 
+                print(f"Generated text: {generated_text!r}")
+                print(f"** END {protein} **")
+                return_out.append(generated_text)
+                if writer:
+                    writer.write({"protein": protein, "iteration": i, "text": generated_text,
+                                  "prompt_tokens": samples[i - first].prompt_tokens, "completion_tokens": samples[i - first].num_tokens,
+                                  "seconds": iteration_time, "time": time.time(), "seed": call_seed, "sample": i - first})
+            # The timing scripts expect a line per iteration, each gets an equal share of the call
+            print("Iteration: %d, Time: %.6f sec" % (i, iteration_time))
+        # Checkpoint the iterations of the call
+        if writer:
+            writer.flush()
+
+
+def result_file(results_dir, unit):
+    """Results of a served batch, as the job.out of a directory named after it, where the dot builders look"""
+    return os.path.join(results_dir, os.path.splitext(unit)[0], 'job.out')
+
+
+def serve(backend, args, cache=None):
+    """
+    Keep the loaded model serving the protein batches added to the request directory, writing the
+    output of each batch to its own file, until the directory holds a STOP file or stays idle.
+    """
+    queue = ProteinQueue(args.serve_dir)
+    queue.make_dirs()
+    owner = args.queue_owner or default_owner()
+    results_dir = args.results_dir or os.path.join(args.serve_dir, 'results')
+    idle_start_time = time.time()
+    while not os.path.exists(os.path.join(args.serve_dir, 'STOP')):
+        claimed = queue.claim(owner)
+        if claimed is None:
+            if time.time() - idle_start_time > args.idle_timeout:
+                print("No batch requested for %d sec, stopping" % args.idle_timeout)
+                break
+            time.sleep(1)
+            continue
+        unit, proteins = claimed
+        batch_start_time = time.time()
+        output_file = result_file(results_dir, unit)
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        with queue.leased(unit, owner):
+            writer = None
+            if args.results_file:
+                writer = ResultsWriter(os.path.join(os.path.dirname(output_file), os.path.basename(args.results_file)))
+            with open(output_file + '.tmp', 'w') as f, redirect_stdout(f):
+                generate(backend, [args.prompt + " " + protein for protein in proteins], args.num_iter, [], args.seed, writer, samples_per_call=args.samples_per_call, cache=cache)
+            if writer:
+                writer.close()
+            os.replace(output_file + '.tmp', output_file)
+        queue.complete(unit, owner)
+        print("Served %s with %d proteins, Time: %.6f sec" % (unit, len(proteins), time.time() - batch_start_time))
+        idle_start_time = time.time()
+
+
+def submit(args):
+    """
+    Add a protein batch to the request directory of a serving worker and, with --wait, print its output once served
+    """
+    queue = ProteinQueue(args.submit_dir)
+    unit = queue.add([protein.strip() for protein in args.protein_list.split(",") if protein.strip()])
+    print(f"Requested {unit}")
+    if args.wait:
+        output_file = result_file(args.results_dir or os.path.join(args.submit_dir, 'results'), unit)
+        while not os.path.exists(output_file):
+            time.sleep(5)
+        with open(output_file, 'r') as f:
+            print(f.read(), end='')
+    return unit
+
+
 def main():
     total_start_time = time.time()
     parser = ArgumentParser()
     parser.add_argument('--protein-list', default='RAD51', type=str)
     parser.add_argument('--num-iter', default=10, type=int)
     parser.add_argument('--prompt', default='You are a helpful assistant. We are interested in protein interactions.  Based on the documents you have been trained with, can you provide any information on which proteins might interact with', type=str)
+    parser.add_argument('--queue-dir', default=None, type=str, help='Pull proteins from this protein_queue.py queue until it is drained, instead of --protein-list')
+    parser.add_argument('--queue-owner', default=None, type=str, help='Name of this rank in the queue (default: host and pid)')
+    parser.add_argument('--serve-dir', default=None, type=str, help='Load the model once and serve the protein batches requested in this directory')
+    parser.add_argument('--idle-timeout', default=600, type=int, help='Seconds without requests before a serving worker stops (default: 600)')
+    parser.add_argument('--results-dir', default=None, type=str, help='Where served batches are written, one <batch>/job.out each (default: <serve dir>/results)')
+    parser.add_argument('--submit-dir', default=None, type=str, help='Request --protein-list from the worker serving this directory, without loading the model')
+    parser.add_argument('--wait', action='store_true', help='With --submit-dir, wait for the batch and print its output')
+    parser.add_argument('--backend', default='vllm', choices=sorted(BACKENDS), help='Generation backend, fake runs on a CPU without a model (default: vllm)')
+    parser.add_argument('--seed', default=DEFAULT_SEED, type=int, help=f'Seed of the model and of the sampled completions (default: {DEFAULT_SEED})')
+    parser.add_argument('--results-file', default=None, type=str, help='Also write a JSON record per protein and iteration to this file (served batches: this name in the batch directory)')
+    parser.add_argument('--resume', action='store_true', help='Keep the records already in --results-file and only generate the missing protein iterations')
+    parser.add_argument('--samples-per-call', default=None, type=int, help='Iterations sampled per generation call, each call is a checkpoint (default: --num-iter)')
+    parser.add_argument('--max-tokens', default=None, type=int, help='Maximum tokens of a completion (default: 1024 with vllm)')
+    parser.add_argument('--cache-dir', default=None, type=str, help='Response cache shared with the Sophia scripts, completions found in it are not generated again')
+    parser.add_argument('--cache-max-gb', default=DEFAULT_MAX_BYTES / (1 << 30), type=float, help='Size of the response cache before the least recently used entries are evicted')
     args = parser.parse_args()
-    ray.init(_temp_dir='/tmp')
+    if args.submit_dir:
+        return submit(args)
     list_prompts = []
-    if args.protein_list:
+    if args.protein_list and not args.queue_dir and not args.serve_dir:
         protein_list = args.protein_list
         protein_list = protein_list.split(",")
         for protein in protein_list:
@@ -24,26 +179,41 @@ def main():
             list_prompts.append(prompt)
     print("List of prompts>>", list_prompts)
     model_start_time = time.time()
-    sampling_params = SamplingParams(max_tokens=1024)
-    llm = LLM(model="meta-llama/Llama-2-70b-chat-hf",tokenizer='hf-internal-testing/llama-tokenizer',tensor_parallel_size=4,download_dir='/grand/datascience/',seed=123321213) #change dir
+    backend_args = {'seed': args.seed}
+    if args.max_tokens:
+        backend_args['max_tokens'] = args.max_tokens
+    backend = load_backend(args.backend, **backend_args)
     print("Time for model initialisation: Time: %.6f sec" % (time.time() - model_start_time))
     print("Starting to generate")
     return_out = []
-    for i in range(args.num_iter):
-        iteration_start_time = time.time()
-        outputs = llm.generate(list_prompts, sampling_params)
-        # Print the outputs.
-        for output in outputs:
-            prompt = output.prompt
-            generated_text = output.outputs[0].text
-            protein = output.prompt.split()[-1]
-            print(f"** START {protein} **")
-            print(f"Prompt: {prompt!r}") 
-            print(f"Generated text: {generated_text!r}")
-            print(f"** END {protein} **")
-            return_out.append(generated_text)
-        print("Iteration: %d, Time: %.6f sec" % (i, time.time() - iteration_start_time))
-        # get the end time
+    writer = None
+    completed = set()
+    # A restarted queue job always resumes, the units it already marked done are not claimed again
+    resume = args.resume or bool(args.queue_dir)
+    if args.results_file and not args.serve_dir:
+        if resume:
+            completed = resume_results(args.results_file)
+            print(f"Resuming with {len(completed)} protein iterations already completed")
+        writer = ResultsWriter(args.results_file, 'a' if resume else 'w')
+    cache = ResponseCache(args.cache_dir, int(args.cache_max_gb * (1 << 30))) if args.cache_dir else None
+    if args.serve_dir:
+        serve(backend, args, cache)
+    elif args.queue_dir:
+        # The model is loaded once; work units are claimed until every rank has drained the queue
+        queue = ProteinQueue(args.queue_dir)
+        owner = args.queue_owner or default_owner()
+        for unit, proteins in queue.units(owner):
+            print(f"Claimed {unit} with {len(proteins)} proteins")
+            with queue.leased(unit, owner):
+                generate(backend, [args.prompt + " " + protein for protein in proteins], args.num_iter, return_out, args.seed, writer, completed, args.samples_per_call, cache)
+            if not queue.complete(unit, owner):
+                print(f"Lease on {unit} expired before it completed; it was requeued")
+    else:
+        generate(backend, list_prompts, args.num_iter, return_out, args.seed, writer, completed, args.samples_per_call, cache)
+    if writer:
+        writer.close()
+    if cache:
+        print(cache.summary())
     # get the execution time
     print("Time for full app Time: %.6f sec" % (time.time() - total_start_time))
 
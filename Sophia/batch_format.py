@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Records of the vLLM batch output JSONL, as written by `vllm run-batch` and read
+by the parsers. Every line answers one request of the prompts JSONL:
+
+    {"id": "vllm-<hex>", "custom_id": "protein-TP53-iter-1-req-1",
+     "response": {"status_code": 200, "request_id": "vllm-batch-<hex>", "body": {<chat completion>}},
+     "error": null}
+
+A request that failed has "response": null and "error" set.
+
+A request sampled n times on the server ("n" in its body) has n choices. Its
+custom_id names the iteration of the first choice, the others follow:
+"protein-TP53-iter-1-n-3-req-1" holds iterations 1 to 3 of TP53.
+
+A packed request asks about several proteins at once, its custom_id lists them:
+"proteins-TP53+ATM+EGFR-iter-1-req-1". The answer has a section per protein,
+each starting with a "### PROTEIN" heading line.
+"""
+
+import json
+import os
+import re
+import time
+import uuid
+
+from response_cache import cache_key
+
+PACKED_SEPARATOR = '+'
+SECTION_PATTERN = re.compile(r'^[ \t]*#+[ \t]*\**[ \t]*([A-Za-z0-9_.-]+)[ \t]*\**[ \t]*:?[ \t]*$', re.MULTILINE)
+
+
+def output_record(custom_id, body, status_code=200):
+    """Batch output line for the chat completion `body` answering `custom_id`."""
+    return {
+        "id": f"vllm-{uuid.uuid4().hex}",
+        "custom_id": custom_id,
+        "response": {
+            "status_code": status_code,
+            "request_id": f"vllm-batch-{uuid.uuid4().hex}",
+            "body": body
+        },
+        "error": None
+    }
+
+
+def error_record(custom_id, message, status_code=None):
+    """Batch output line for a request that failed."""
+    return {
+        "id": f"vllm-{uuid.uuid4().hex}",
+        "custom_id": custom_id,
+        "response": None,
+        "error": {"code": status_code, "message": message}
+    }
+
+
+def parse_custom_id(custom_id):
+    """
+    Query proteins and iteration of a custom_id such as protein-TP53-iter-1-req-1,
+    or proteins-TP53+ATM-iter-1-req-1 for a packed request. Returns ([], None) for other ids.
+    """
+    # Parse custom_id: "protein-PROTEINNAME-iter-X-req-Y"
+    parts = custom_id.split('-')
+    if len(parts) < 4 or parts[0] not in ('protein', 'proteins'):
+        return [], None
+    iteration = int(parts[3]) if parts[2] == 'iter' and parts[3].isdigit() else None
+    if parts[0] == 'proteins':
+        return [protein.upper() for protein in parts[1].split(PACKED_SEPARATOR)], iteration
+    return [parts[1].upper()], iteration
+
+
+def split_sections(content, proteins):
+    """
+    Split the answer of a packed request into {protein: section} at its "### PROTEIN"
+    headings. Headings of other proteins stay in the section they appear in.
+    """
+    wanted = set(proteins)
+    headings = [match for match in SECTION_PATTERN.finditer(content) if match.group(1).upper() in wanted]
+    sections = {}
+    for heading, next_heading in zip(headings, headings[1:] + [None]):
+        end = next_heading.start() if next_heading else len(content)
+        protein = heading.group(1).upper()
+        sections[protein] = sections.get(protein, '') + content[heading.end():end]
+    return sections
+
+
+def response_body(record):
+    """Chat completion of a batch output record, None for a failed request."""
+    response = record.get('response')
+    if not response:
+        return None
+    # Real vLLM format has a 'body' layer, the test data may not
+    return response['body'] if 'body' in response and 'choices' in response['body'] else response
+
+
+def response_choices(record):
+    """
+    Yield (iteration, content) of every choice of a batch output record with content.
+    The iteration is None when the custom_id does not name one.
+    """
+    body = response_body(record)
+    if body is None:
+        return
+    first_iteration = parse_custom_id(record.get('custom_id', ''))[1]
+    for position, choice in enumerate(body.get('choices') or []):
+        content = (choice.get('message') or {}).get('content')
+        if content:
+            index = choice.get('index', position)
+            yield (None if first_iteration is None else first_iteration + index), content
+
+
+def response_sections(record):
+    """
+    Yield (query protein, iteration, content) of every answer in a batch output record.
+    Every choice is an iteration, so a request sampled n times yields several, and the
+    choices of a packed request are split into a section per query protein. The query
+    proteins and first iteration come from the custom_id, the query protein is None
+    when the custom_id does not name one.
+    """
+    proteins, _ = parse_custom_id(record.get('custom_id', ''))
+    for iteration, content in response_choices(record):
+        if len(proteins) <= 1:
+            yield (proteins[0] if proteins else None), iteration, content
+            continue
+        for protein, section in split_sections(content, proteins).items():
+            yield protein, iteration, section
+
+
+RECORD_STATUSES = ('failed', 'empty', 'truncated', 'ok')  # from worst to best
+
+
+def record_status(record):
+    """
+    Status of a batch output record: 'failed' when the request errored, 'empty' when a
+    choice has no content, 'truncated' when a choice stopped at max_tokens, else 'ok'.
+    """
+    body = response_body(record)
+    if record.get('error') or body is None or record['response'].get('status_code', 200) != 200:
+        return 'failed'
+    choices = body.get('choices') or []
+    if not choices or any(not (choice.get('message') or {}).get('content') for choice in choices):
+        return 'empty'
+    if any(choice.get('finish_reason') == 'length' for choice in choices):
+        return 'truncated'
+    return 'ok'
+
+
+def request_cache_key(request):
+    """Key of the response to a batch request in a ResponseCache."""
+    body = request["body"]
+    _, iteration = parse_custom_id(request.get("custom_id", ""))
+    return cache_key(body.get("model"), body.get("messages"), body.get("max_tokens"), body.get("seed"), iteration, body.get("n"))
+
+
+def read_custom_ids(output_file):
+    """custom_ids answered in an existing batch output file, without the failed requests."""
+    answered = set()
+    if not os.path.exists(output_file):
+        return answered
+    with open(output_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # line still being written
+            if not record.get('error'):
+                answered.add(record.get('custom_id'))
+    return answered
+
+
+def follow_lines(path, poll_interval=1.0, idle_timeout=300):
+    """
+    Follow a batch output file while it is written, as `tail -f` would.
+    Yields the list of complete lines appended since the previous poll, possibly
+    empty, every poll_interval seconds. Stops once nothing was appended for
+    idle_timeout seconds. A file that does not exist yet is waited for, and a
+    file truncated by a new run is read again from its start.
+    """
+    offset = 0
+    last_data_time = time.time()
+    while time.time() - last_data_time < idle_timeout:
+        lines = []
+        try:
+            if os.path.getsize(path) < offset:
+                offset = 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                content = f.read()
+            # Only consume up to the last complete line, the writer may be halfway through one
+            consumed = content.rfind(b'\n') + 1
+            if consumed:
+                lines = content[:consumed].decode('utf-8', errors='replace').splitlines()
+                offset += consumed
+                last_data_time = time.time()
+        except FileNotFoundError:
+            pass
+        yield lines
+        if not lines:
+            time.sleep(poll_interval)
+
+
+def publish_atomically(path, write_fn):
+    """
+    Replace the file at path at once with what write_fn(tmp_path) writes, so that
+    a reader following it, e.g. a visualization polling a DOT snapshot, never
+    sees a half-written file.
+    """
+    tmp_path = path + '.tmp'
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
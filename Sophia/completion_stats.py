@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Completion lengths of previous batch outputs, fitted into per-protein max_tokens
+for generate_batch_prompts.py --max-tokens-file.
+
+Every request of a batch reserves max_tokens of KV cache on the vLLM server,
+while most answers are much shorter than --max-tokens. This script reads
+usage.completion_tokens of the batch output records and writes, for every
+protein with at least --min-samples answers, a percentile of its completion
+lengths times a safety margin, and the same estimate over all proteins for the
+others:
+
+    {"percentile": 95, "margin": 1.25, "global": 420, "proteins": {"TP53": 610, ...},
+     "truncated": ["EGFR", ...]}
+
+The completion tokens of a packed request are split evenly between its
+proteins, and those of a request sampled n times between its choices. The
+proteins with an answer truncated at max_tokens are listed apart and keep the
+full --max-tokens, their split lengths understate what they need.
+"""
+
+import argparse
+import json
+import math
+import os
+from collections import defaultdict
+
+from batch_format import parse_custom_id, record_status, response_body
+
+
+def read_completion_lengths(output_files):
+    """
+    Completion tokens of every answer in the batch output files.
+    Returns ({protein: [tokens, ...]}, number of truncated responses, proteins with a truncated answer).
+    """
+    lengths = defaultdict(list)
+    truncated = 0
+    truncated_proteins = set()
+    for output_file in output_files:
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                status = record_status(record)
+                if status == 'failed':
+                    continue
+                proteins, _ = parse_custom_id(record.get('custom_id', ''))
+                body = response_body(record)
+                completion_tokens = (body.get('usage') or {}).get('completion_tokens')
+                if not proteins or completion_tokens is None:
+                    continue
+                answers = max(len(body.get('choices') or []), 1)
+                if status == 'truncated':
+                    truncated += 1
+                    truncated_proteins.update(proteins)
+                for protein in proteins:
+                    lengths[protein].extend([completion_tokens / (answers * len(proteins))] * answers)
+    return lengths, truncated, truncated_proteins
+
+
+def percentile(values, q):
+    """Nearest-rank percentile q (0-100) of a list of values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def fit_max_tokens(lengths, q=95, margin=1.25, min_samples=3, min_tokens=64, truncated_proteins=()):
+    """
+    Fit the max_tokens of every protein: the q-th percentile of its completion lengths
+    times margin, at least min_tokens. Proteins with fewer than min_samples answers
+    are left to the global estimate over all answers. The truncated_proteins are
+    not fitted but listed, to keep the cap.
+    """
+    def fit(values):
+        return max(int(math.ceil(percentile(values, q) * margin)), min_tokens)
+
+    all_lengths = [length for values in lengths.values() for length in values]
+    if not all_lengths:
+        raise ValueError("No completion lengths found in the batch outputs")
+    return {
+        "percentile": q,
+        "margin": margin,
+        "global": fit(all_lengths),
+        "proteins": {protein: fit(values) for protein, values in sorted(lengths.items())
+                     if len(values) >= min_samples and protein not in truncated_proteins},
+        "truncated": sorted(truncated_proteins)
+    }
+
+
+def load_max_tokens(path):
+    """Read a max_tokens file written by this script."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class AdaptiveMaxTokens:
+    """
+    max_tokens of the requests from a fitted max_tokens file, capped at max_tokens.
+    The proteins truncated before get max_tokens. Keeps count of the completion tokens requested, and of those a fixed max_tokens would have.
+    """
+    def __init__(self, fitted, max_tokens):
+        self.proteins = fitted["proteins"]
+        self.default = fitted["global"]
+        self.truncated = set(fitted.get("truncated", ()))
+        self.max_tokens = max_tokens
+        self.requested = 0
+        self.fixed = 0
+
+    def __call__(self, proteins, samples=1):
+        """max_tokens of a request about the proteins, the sum of their estimates for a packed one."""
+        budget = sum(self.max_tokens if protein.upper() in self.truncated
+                     else min(self.proteins.get(protein.upper(), self.default), self.max_tokens) for protein in proteins)
+        self.requested += budget * samples
+        self.fixed += self.max_tokens * len(proteins) * samples
+        return budget
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit per-protein max_tokens from the completion lengths of previous batch outputs"
+    )
+    parser.add_argument(
+        "--output-files",
+        nargs="+",
+        default=["protein_interaction_batch_output.jsonl"],
+        help="Batch output JSONL files of previous runs (default: protein_interaction_batch_output.jsonl)"
+    )
+    parser.add_argument(
+        "--stats-file",
+        default="max_tokens.json",
+        help="Fitted max_tokens JSON file path (default: max_tokens.json)"
+    )
+    parser.add_argument(
+        "--percentile",
+        type=float,
+        default=95,
+        help="Percentile of the completion lengths of a protein to fit (default: 95)"
+    )
+    parser.add_argument(
+        "--margin",
+        type=float,
+        default=1.25,
+        help="Safety factor applied to the percentile (default: 1.25)"
+    )
+    parser.add_argument(
+        "--min-samples",
+        type=int,
+        default=3,
+        help="Answers needed for a per-protein estimate, fewer use the global one (default: 3)"
+    )
+    parser.add_argument(
+        "--min-tokens",
+        type=int,
+        default=64,
+        help="Lower bound of a fitted max_tokens (default: 64)"
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=1000,
+        help="Fixed max_tokens to compare the savings with (default: 1000)"
+    )
+
+    args = parser.parse_args()
+
+    for path in args.output_files:
+        if not os.path.exists(path):
+            print(f"Error: Input file '{path}' not found.")
+            return 1
+
+    lengths, truncated, truncated_proteins = read_completion_lengths(args.output_files)
+    try:
+        fitted = fit_max_tokens(lengths, args.percentile, args.margin, args.min_samples, args.min_tokens, truncated_proteins)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    with open(args.stats_file, 'w', encoding='utf-8') as f:
+        json.dump(fitted, f, indent=1)
+
+    all_lengths = [length for values in lengths.values() for length in values]
+    print(f"Read {len(all_lengths):,} answers of {len(lengths):,} proteins ({truncated:,} truncated responses)")
+    print(f"Completion tokens: mean {sum(all_lengths) / len(all_lengths):.0f}, median {percentile(all_lengths, 50):.0f}, "
+          f"p{args.percentile:g} {percentile(all_lengths, args.percentile):.0f}, max {max(all_lengths):.0f}")
+    print(f"Fitted max_tokens: global {fitted['global']}, {len(fitted['proteins']):,} proteins with their own estimate, "
+          f"{len(fitted['truncated']):,} truncated proteins kept at --max-tokens")
+
+    # Expected savings when the same proteins are queried again
+    adaptive = AdaptiveMaxTokens(fitted, args.max_tokens)
+    for protein, values in lengths.items():
+        adaptive([protein], len(values))
+    print(f"Reserved completion tokens: {adaptive.requested:,} instead of {adaptive.fixed:,} with max_tokens {args.max_tokens} "
+          f"({1 - adaptive.requested / adaptive.fixed:.1%} less)")
+    print(f"Max tokens written to: {args.stats_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
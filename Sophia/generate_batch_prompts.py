@@ -6,11 +6,21 @@ for vLLM batch API processing.
 """
 
 import argparse
+import heapq
 import json
 import pandas as pd
 import os
 from pathlib import Path
 
+from batch_format import output_record, request_cache_key
+from completion_stats import AdaptiveMaxTokens, load_max_tokens
+from response_cache import DEFAULT_MAX_BYTES, ResponseCache
+
+CUSTOM_ID_MARKER = "__CUSTOM_ID__"
+USER_PROMPT_MARKER = "__USER_PROMPT__"
+MAX_TOKENS_MARKER = "__MAX_TOKENS__"
+WRITE_BUFFER_SIZE = 1 << 20
+
 
 def create_system_prompt():
     """
@@ -42,7 +52,30 @@ def create_user_prompt(protein_name):
     return base_prompt.format(protein=protein_name)
 
 
-def generate_batch_request(custom_id, protein_name, model_name="meta-llama/Meta-Llama-3.1-8B-Instruct", max_tokens=1000):
+def create_packed_user_prompt(protein_names):
+    """
+    Create the user prompt asking about several proteins at once.
+    
+    Args:
+        protein_names (list): The names of the proteins to query about
+        
+    Returns:
+        str: The formatted user prompt, asking for a "### PROTEIN" section per protein
+    """
+    base_prompt = (
+        "For each of the following proteins, list proteins that might interact with it: {proteins}. "
+        "Please provide a simple list of protein names (gene symbols/names) "
+        "that could potentially interact with each of them, along with a brief "
+        "reason for each interaction (e.g., forms complex, enzymatic substrate, "
+        "signaling pathway, binding partner). "
+        "Focus on well-known, documented interactions. "
+        "Start the section of each protein with a line containing only ### and its name (e.g. ### {first}), "
+        "then format its list as: PROTEIN_NAME - brief description of interaction type."
+    )
+    return base_prompt.format(proteins=", ".join(protein_names), first=protein_names[0])
+
+
+def generate_batch_request(custom_id, protein_name, model_name="meta-llama/Meta-Llama-3.1-8B-Instruct", max_tokens=1000, n=None, seed=None):
     """
     Generate a single batch request in the required format.
     
@@ -51,11 +84,13 @@ def generate_batch_request(custom_id, protein_name, model_name="meta-llama/Meta-
         protein_name (str): The protein to query about
         model_name (str): The model to use for the request
         max_tokens (int): Maximum tokens to generate
+        n (int): Completions sampled by the server for this request (default: one)
+        seed (int): Sampling seed of the request (default: unseeded)
         
     Returns:
         dict: The batch request object
     """
-    return {
+    request = {
         "custom_id": custom_id,
         "method": "POST",
         "url": "/v1/chat/completions",
@@ -74,6 +109,154 @@ def generate_batch_request(custom_id, protein_name, model_name="meta-llama/Meta-
             "max_tokens": max_tokens
         }
     }
+    if n is not None:
+        request["body"]["n"] = n
+    if seed is not None:
+        request["body"]["seed"] = seed
+    return request
+
+
+def estimate_tokens(text):
+    """Rough token count of a text, as used by the fake outputs generator."""
+    return int(len(text.split()) * 1.3)
+
+
+class RequestLineTemplate:
+    """
+    The JSON line of a batch request, serialized once with placeholders for the
+    custom_id, the user prompt and max_tokens, the only parts that change between
+    requests. A line is the template joined with the JSON of them, which is the
+    same as json.dumps() of generate_batch_request().
+    """
+    def __init__(self, model_name, max_tokens, n=None, seed=None):
+        request = generate_batch_request(CUSTOM_ID_MARKER, "", model_name, MAX_TOKENS_MARKER, n, seed)
+        request["body"]["messages"][1]["content"] = USER_PROMPT_MARKER
+        line = json.dumps(request)
+        self.prefix, rest = line.split(json.dumps(CUSTOM_ID_MARKER))
+        self.middle, rest = rest.split(json.dumps(USER_PROMPT_MARKER))
+        self.tokens_prefix, self.suffix = rest.split(json.dumps(MAX_TOKENS_MARKER))
+        self.suffix += '\n'
+        self.system_tokens = estimate_tokens(create_system_prompt())
+        self.max_tokens = max_tokens
+        self.samples = n or 1
+
+    def line(self, custom_id, user_prompt_json, max_tokens=None):
+        return (self.prefix + json.dumps(custom_id) + self.middle + user_prompt_json + self.tokens_prefix
+                + str(self.max_tokens if max_tokens is None else max_tokens) + self.suffix)
+
+
+def request_templates(model_name, max_tokens, iterations, n_sampling=False, seed=None):
+    """
+    Templates of the requests of a protein. With n_sampling, a single request asks the
+    server for all the iterations, so the prompt is prefilled once. Otherwise there is
+    one request per iteration, seeded with seed + iteration when a seed is given.
+    """
+    if n_sampling:
+        return [RequestLineTemplate(model_name, max_tokens, n=iterations, seed=seed)]
+    return [RequestLineTemplate(model_name, max_tokens, seed=None if seed is None else seed + iteration)
+            for iteration in range(iterations)]
+
+
+def iter_packs(proteins, pack):
+    """Group the proteins pack at a time, the last group may be smaller."""
+    group = []
+    for protein_name in proteins:
+        group.append(protein_name)
+        if len(group) == pack:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def iter_request_lines(proteins, templates, pack=1, max_tokens_for=None, first_iteration=1):
+    """
+    Yield the request lines of each protein, or group of pack proteins, one per template,
+    with their estimated prompt+completion tokens. The user prompt is built and serialized
+    once for all the requests of a protein. The max_tokens of a template is per protein,
+    a group gets it times its number of proteins. max_tokens_for(group, samples), e.g. an
+    AdaptiveMaxTokens, gives the max_tokens of the requests instead of the templates.
+    A last group left with a single protein is asked as an unpacked request.
+    The iterations are numbered from first_iteration.
+    """
+    request_counter = 1
+    for group in iter_packs(proteins, pack):
+        if len(group) == 1:
+            id_prefix = f"protein-{group[0]}"
+            user_prompt = create_user_prompt(group[0])
+        else:
+            id_prefix = f"proteins-{'+'.join(group)}"
+            user_prompt = create_packed_user_prompt(group)
+        user_prompt_json = json.dumps(user_prompt)
+        user_tokens = estimate_tokens(user_prompt)
+        lines = []
+        tokens = 0
+        for iteration, template in enumerate(templates):
+            if template.samples > 1:
+                # The choices of the response are the n iterations from first_iteration
+                custom_id = f"{id_prefix}-iter-{first_iteration}-n-{template.samples}-req-{request_counter}"
+            else:
+                custom_id = f"{id_prefix}-iter-{first_iteration + iteration}-req-{request_counter}"
+            max_tokens = template.max_tokens * len(group) if max_tokens_for is None else max_tokens_for(group, template.samples)
+            lines.append(template.line(custom_id, user_prompt_json, max_tokens))
+            tokens += template.system_tokens + user_tokens + max_tokens * template.samples
+            request_counter += 1
+        yield lines, tokens
+
+
+def skip_cached(lines, tokens, cache, cached_output):
+    """
+    Write the cached responses of request lines to cached_output, as batch output records.
+    Returns the lines left to send and their share of the estimated tokens.
+    """
+    missing = []
+    for line in lines:
+        request = json.loads(line)
+        body = cache.get(request_cache_key(request))
+        if body is None:
+            missing.append(line)
+        else:
+            cached_output.write(json.dumps(output_record(request["custom_id"], body)) + '\n')
+    return missing, tokens * len(missing) // max(len(lines), 1)
+
+
+def shard_paths(output_file, num_shards):
+    """Output file of each shard: prompts.jsonl -> prompts.shard00.jsonl, ..."""
+    if num_shards == 1:
+        return [output_file]
+    path = Path(output_file)
+    return [str(path.with_name(f"{path.stem}.shard{i:02d}{path.suffix}")) for i in range(num_shards)]
+
+
+class ShardedWriter:
+    """
+    Stream request lines to num_shards files, the requests of each protein to the
+    shard with the fewest estimated tokens so far, so the shards take about as long
+    to run and the server of a shard can reuse the cached prefill of a protein.
+    """
+    def __init__(self, output_file, num_shards=1):
+        self.paths = shard_paths(output_file, num_shards)
+        self.files = [open(path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) for path in self.paths]
+        self.requests = [0] * num_shards
+        self.tokens = [0] * num_shards
+        self.loads = [(0, shard) for shard in range(num_shards)]
+
+    def write(self, lines, tokens):
+        load, shard = heapq.heappop(self.loads)
+        self.files[shard].writelines(lines)
+        self.requests[shard] += len(lines)
+        self.tokens[shard] += tokens
+        heapq.heappush(self.loads, (load + tokens, shard))
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 
 def main():
@@ -112,6 +295,47 @@ def main():
         default=1000,
         help="Maximum tokens per response (default: 1000)"
     )
+    parser.add_argument(
+        "--max-tokens-file",
+        help="Per-protein max_tokens fitted by completion_stats.py from previous outputs, capped at --max-tokens"
+    )
+    parser.add_argument(
+        "--n-sampling",
+        action="store_true",
+        help="Emit one request per protein sampling all the iterations on the server (\"n\": iterations) instead of one request per iteration"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="Seed the requests, with --n-sampling this seed, otherwise seed + iteration (default: unseeded)"
+    )
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=1,
+        help="Ask about this many proteins per request, each answered in its own section; --max-tokens is per protein (default: 1)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Response cache of run_batch_async.py: cached requests are written as responses to --cached-output-file instead of prompts"
+    )
+    parser.add_argument(
+        "--cached-output-file",
+        default="protein_interaction_batch_cached_output.jsonl",
+        help="Batch output JSONL of the cached responses (default: protein_interaction_batch_cached_output.jsonl)"
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1 << 30),
+        help=f"Size of the response cache before the least recently used entries are evicted (default: {DEFAULT_MAX_BYTES / (1 << 30):g})"
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the requests into this many files balanced by estimated tokens, e.g. one per vLLM instance (default: 1)"
+    )
     
     args = parser.parse_args()
     
@@ -139,41 +363,59 @@ def main():
         df = df.head(args.max_proteins)
         print(f"Limited to first {args.max_proteins} proteins")
     
-    # Generate batch requests
-    batch_requests = []
-    request_counter = 1
+    if args.shards < 1 or args.pack < 1:
+        print("Error: --shards and --pack must be at least 1")
+        return 1
     
-    for index, row in df.iterrows():
-        protein_name = row['search_words'].strip()
-        
-        # Skip empty protein names
-        if not protein_name:
-            continue
-            
-        # Generate multiple iterations for each protein
-        for iteration in range(args.iterations):
-            custom_id = f"protein-{protein_name}-iter-{iteration+1}-req-{request_counter}"
-            
-            batch_request = generate_batch_request(
-                custom_id=custom_id,
-                protein_name=protein_name,
-                model_name=args.model,
-                max_tokens=args.max_tokens
-            )
-            
-            batch_requests.append(batch_request)
-            request_counter += 1
+    adaptive = None
+    if args.max_tokens_file:
+        try:
+            adaptive = AdaptiveMaxTokens(load_max_tokens(args.max_tokens_file), args.max_tokens)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading max tokens file '{args.max_tokens_file}': {e}")
+            return 1
+    
+    # Packed proteins are listed in the custom_id and must not contain its separators
+    if args.pack > 1:
+        bad_names = [name for name in df['search_words'].dropna().astype(str) if '-' in name or '+' in name]
+        if bad_names:
+            print(f"Error: --pack cannot be used with protein names containing '-' or '+', e.g. {bad_names[0]}")
+            return 1
+    
+    # Skip empty protein names
+    proteins = (protein_name for protein_name in df['search_words'].dropna().astype(str).str.strip() if protein_name)
+    templates = request_templates(args.model, args.max_tokens, args.iterations, args.n_sampling, args.seed)
+    
+    cache = ResponseCache(args.cache_dir, int(args.cache_max_gb * (1 << 30))) if args.cache_dir else None
     
-    # Write to JSONL file
+    # Stream the requests to the shards as they are generated
     try:
-        with open(args.output_file, 'w', encoding='utf-8') as f:
-            for request in batch_requests:
-                f.write(json.dumps(request) + '\n')
+        with ShardedWriter(args.output_file, args.shards) as writer:
+            cached_output = open(args.cached_output_file, 'w', encoding='utf-8') if cache else None
+            for lines, tokens in iter_request_lines(proteins, templates, args.pack, adaptive):
+                if cache:
+                    lines, tokens = skip_cached(lines, tokens, cache, cached_output)
+                if lines:
+                    writer.write(lines, tokens)
+            if cached_output:
+                cached_output.close()
         
-        print(f"Successfully generated {len(batch_requests)} batch requests")
-        print(f"Output written to: {args.output_file}")
+        print(f"Successfully generated {sum(writer.requests)} batch requests")
+        if args.shards == 1:
+            print(f"Output written to: {args.output_file}")
+        else:
+            for path, requests, tokens in zip(writer.paths, writer.requests, writer.tokens):
+                print(f"Output written to: {path} ({requests} requests, ~{tokens:,} tokens)")
         print(f"Total proteins processed: {len(df)}")
-        print(f"Iterations per protein: {args.iterations}")
+        print(f"Iterations per protein: {args.iterations}" + (" (sampled by the server)" if args.n_sampling else ""))
+        if args.pack > 1:
+            print(f"Proteins per request: {args.pack}")
+        if cache:
+            print(f"Cached responses written to: {args.cached_output_file} ({cache.stats['hits']} requests not generated)")
+            print(cache.summary())
+        if adaptive is not None and adaptive.fixed:
+            print(f"Reserved completion tokens: {adaptive.requested:,} instead of {adaptive.fixed:,} with --max-tokens {args.max_tokens} "
+                  f"({1 - adaptive.requested / adaptive.fixed:.1%} less)")
         
     except Exception as e:
         print(f"Error writing output file: {e}")
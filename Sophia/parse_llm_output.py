@@ -14,6 +14,8 @@ from pathlib import Path
 import time
 from collections import defaultdict
 
+from batch_format import follow_lines, publish_atomically, response_sections
+
 
 class ProteinInteractionParser:
     def __init__(self, proteins_csv_path, big_table_csv_path, string_csv_path):
@@ -137,35 +139,10 @@ class ProteinInteractionParser:
                 try:
                     response = json.loads(line.strip())
                     
-                    # Extract query protein from custom_id
-                    custom_id = response.get('custom_id', '')
-                    if not custom_id.startswith('protein-'):
-                        continue
-                        
-                    # Parse custom_id: "protein-PROTEINNAME-iter-X-req-Y"
-                    parts = custom_id.split('-')
-                    if len(parts) < 4:
-                        continue
-                    query_protein = parts[1].upper()
-                    
-                    # Extract response content
-                    content = None
-                    if 'response' in response:
-                        resp = response['response']
+                    for query_protein, iteration, content in response_sections(response):
+                        if query_protein is None:
+                            continue
                         
-                        # Handle real vLLM format with 'body' layer
-                        if 'body' in resp and 'choices' in resp['body']:
-                            choices = resp['body']['choices']
-                            if choices and 'message' in choices[0]:
-                                content = choices[0]['message'].get('content', '')
-                        
-                        # Fallback to direct format (for test data)
-                        elif 'choices' in resp:
-                            choices = resp['choices']
-                            if choices and 'message' in choices[0]:
-                                content = choices[0]['message'].get('content', '')
-                    
-                    if content:
                         # Extract interacting proteins from the content
                         interacting_proteins = self.extract_proteins_from_text(content)
                         
@@ -344,6 +321,53 @@ def load_proteins(proteins_csv):
         return set()
 
 
+def extract_line_interactions(line, proteins_set):
+    """
+    Extract the interactions of one batch output line.
+    Returns the set of interactions, or None when the line has no content.
+    """
+    data = json.loads(line.strip())
+    
+    contents = [content for query_protein, iteration, content in response_sections(data)]
+    if not contents:
+        return None
+    
+    # Extract mentioned proteins using word boundaries
+    interactions = set()
+    for content in contents:
+        mentioned_proteins = set()
+        for protein in proteins_set:
+            if re.search(r'\b' + re.escape(protein) + r'\b', content, re.IGNORECASE):
+                mentioned_proteins.add(protein)
+        
+        # Create pairwise interactions
+        proteins_list = list(mentioned_proteins)
+        for i in range(len(proteins_list)):
+            for j in range(i+1, len(proteins_list)):
+                interactions.add((proteins_list[i], proteins_list[j]))
+    return interactions
+
+
+def parse_lines(lines, proteins_set, interactions, first_line_num=1):
+    """Add the interactions of batch output lines to interactions. Returns the number of responses processed."""
+    processed_responses = 0
+    for line_num, line in enumerate(lines, first_line_num):
+        try:
+            line_interactions = extract_line_interactions(line, proteins_set)
+            if line_interactions is None:
+                print(f"Warning: No content found at line {line_num}")
+                continue
+            interactions.update(line_interactions)
+            processed_responses += 1
+        except json.JSONDecodeError:
+            print(f"Warning: Invalid JSON at line {line_num}")
+            continue
+        except Exception as e:
+            print(f"Warning: Error processing line {line_num}: {e}")
+            continue
+    return processed_responses
+
+
 def parse_batch_output(batch_file, proteins_set):
     """Parse vLLM batch output and extract protein interactions."""
     interactions = set()
@@ -351,58 +375,42 @@ def parse_batch_output(batch_file, proteins_set):
     
     with open(batch_file, 'r') as f:
         for line_num, line in enumerate(f, 1):
-            try:
-                data = json.loads(line.strip())
-                
-                # Extract content from vLLM batch response format
-                # Real vLLM format has: response.body.choices[0].message.content
-                content = None
-                if 'response' in data:
-                    response = data['response']
-                    
-                    # Handle real vLLM format with 'body' layer
-                    if 'body' in response and 'choices' in response['body']:
-                        choices = response['body']['choices']
-                        if choices and 'message' in choices[0]:
-                            content = choices[0]['message'].get('content', '')
-                    
-                    # Fallback to direct format (for test data)
-                    elif 'choices' in response:
-                        choices = response['choices']
-                        if choices and 'message' in choices[0]:
-                            content = choices[0]['message'].get('content', '')
-                
-                if not content:
-                    print(f"Warning: No content found at line {line_num}")
-                    continue
-                
-                # Extract mentioned proteins using word boundaries
-                mentioned_proteins = set()
-                for protein in proteins_set:
-                    if re.search(r'\b' + re.escape(protein) + r'\b', content, re.IGNORECASE):
-                        mentioned_proteins.add(protein)
-                
-                # Create pairwise interactions
-                proteins_list = list(mentioned_proteins)
-                for i in range(len(proteins_list)):
-                    for j in range(i+1, len(proteins_list)):
-                        interactions.add((proteins_list[i], proteins_list[j]))
-                
-                processed_responses += 1
-                
-                if processed_responses % 100 == 0:
-                    print(f"Processed {processed_responses:,} responses, found {len(interactions):,} unique interactions")
-                    
-            except json.JSONDecodeError:
-                print(f"Warning: Invalid JSON at line {line_num}")
-                continue
-            except Exception as e:
-                print(f"Warning: Error processing line {line_num}: {e}")
+            if not parse_lines([line], proteins_set, interactions, line_num):
                 continue
+            processed_responses += 1
+            
+            if processed_responses % 100 == 0:
+                print(f"Processed {processed_responses:,} responses, found {len(interactions):,} unique interactions")
     
     return interactions, processed_responses
 
 
+def follow_batch_output(batch_file, proteins_set, big_table_dict, string_dict, output_file,
+                        snapshot_interval=30, poll_interval=1.0, idle_timeout=300):
+    """
+    Parse a batch output file while the batch is still writing it, publishing an
+    updated DOT file every snapshot_interval seconds and once the file stops growing.
+    """
+    interactions = set()
+    processed_responses = 0
+    line_num = 1
+    published_count = -1
+    last_snapshot_time = time.time()
+    try:
+        for lines in follow_lines(batch_file, poll_interval, idle_timeout):
+            processed_responses += parse_lines(lines, proteins_set, interactions, line_num)
+            line_num += len(lines)
+            if time.time() - last_snapshot_time >= snapshot_interval and len(interactions) != published_count:
+                publish_atomically(output_file, lambda path: generate_dot_file(interactions, big_table_dict, string_dict, path))
+                print(f"Snapshot: {processed_responses:,} responses, {len(interactions):,} unique interactions")
+                published_count = len(interactions)
+                last_snapshot_time = time.time()
+        print(f"No new responses for {idle_timeout}s, stopped following {batch_file}")
+    except KeyboardInterrupt:
+        print(f"Stopped following {batch_file}")
+    return interactions, processed_responses
+
+
 def validate_interaction(protein1, protein2, big_table_dict, string_dict):
     """Validate interaction and determine edge color."""
     # Check both directions in the databases
@@ -469,6 +477,23 @@ def main():
         default="llm_protein_interactions.dot",
         help="Output DOT file path (default: llm_protein_interactions.dot)"
     )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help="Parse the batch output while it is being written, publishing DOT snapshots"
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=30,
+        help="Seconds between DOT snapshots with --follow (default: 30)"
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=300,
+        help="Stop following once the batch output stops growing for this many seconds (default: 300)"
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -498,7 +523,13 @@ def main():
     # Parse batch output
     print(f"\n🔍 Parsing batch output: {args.batch_output}")
     parse_start = time.time()
-    interactions, processed_responses = parse_batch_output(args.batch_output, proteins_set)
+    if args.follow:
+        interactions, processed_responses = follow_batch_output(
+            args.batch_output, proteins_set, big_table_dict, string_dict, args.output_dot,
+            snapshot_interval=args.snapshot_interval, idle_timeout=args.idle_timeout
+        )
+    else:
+        interactions, processed_responses = parse_batch_output(args.batch_output, proteins_set)
     parse_time = time.time() - parse_start
     
     print(f"   Processed responses: {processed_responses:,}")
@@ -13,6 +13,9 @@ from pathlib import Path
 from multiprocessing import Pool, cpu_count
 from functools import partial
 import time
+from collections import defaultdict
+
+from batch_format import follow_lines, publish_atomically, response_sections
 
 
 def process_batch_lines(lines_batch, proteins_set):
@@ -24,7 +27,7 @@ def process_batch_lines(lines_batch, proteins_set):
         proteins_set: Set of valid protein names
         
     Returns:
-        List of (query_protein, interacting_proteins) tuples
+        List of (query_protein, iteration, interacting_proteins) tuples
     """
     batch_interactions = []
     
@@ -32,43 +35,18 @@ def process_batch_lines(lines_batch, proteins_set):
         try:
             response = json.loads(line.strip())
             
-            # Extract query protein from custom_id
-            custom_id = response.get('custom_id', '')
-            if not custom_id.startswith('protein-'):
-                continue
-                
-            # Parse custom_id: "protein-PROTEINNAME-iter-X-req-Y"
-            parts = custom_id.split('-')
-            if len(parts) < 4:
-                continue
-            query_protein = parts[1].upper()
-            
-            # Extract response content
-            content = None
-            if 'response' in response:
-                resp = response['response']
-                
-                # Handle real vLLM format with 'body' layer
-                if 'body' in resp and 'choices' in resp['body']:
-                    choices = resp['body']['choices']
-                    if choices and 'message' in choices[0]:
-                        content = choices[0]['message'].get('content', '')
+            for query_protein, iteration, content in response_sections(response):
+                if query_protein is None:
+                    continue
                 
-                # Fallback to direct format (for test data)
-                elif 'choices' in resp:
-                    choices = resp['choices']
-                    if choices and 'message' in choices[0]:
-                        content = choices[0]['message'].get('content', '')
-            
-            if content:
                 # Extract interacting proteins from the content
                 interacting_proteins = extract_proteins_from_text(content, proteins_set)
                 
                 # Filter out self-interactions
                 valid_interactions = [p for p in interacting_proteins if p != query_protein]
                 
-                if valid_interactions:
-                    batch_interactions.append((query_protein, valid_interactions))
+                # Kept when empty, the iteration still answered
+                batch_interactions.append((query_protein, iteration, valid_interactions))
                         
         except json.JSONDecodeError:
             print(f"Warning: Could not parse line {line_num}")
@@ -146,6 +124,8 @@ class ProteinInteractionParserParallel:
         self.st_dict, self.st_proteins = self.load_string_dict(string_csv_path) if os.path.exists(string_csv_path) else ({}, set())
         
         self.interactions = set()
+        # Partners found by each iteration of a protein, keyed by (protein, iteration)
+        self.iteration_partners = defaultdict(set)
         
     def load_proteins(self, proteins_csv_path):
         """Load protein names from proteins.csv into a set for fast lookup."""
@@ -175,6 +155,12 @@ class ProteinInteractionParserParallel:
                 st_proteins.add(row['col2'])
         return st_dict, st_proteins
 
+    def add_interactions(self, query_protein, iteration, interacting_proteins):
+        """Record the partners found by one iteration of a query protein."""
+        for interacting_protein in interacting_proteins:
+            self.interactions.add((query_protein, interacting_protein))
+        self.iteration_partners[(query_protein, iteration)].update(interacting_proteins)
+
     def parse_batch_output_parallel(self, batch_output_file, num_workers=None, batch_size=1000):
         """
         Parse the batch output JSONL file using parallel processing.
@@ -221,9 +207,8 @@ class ProteinInteractionParserParallel:
                     print(f"Processed {processed_batches}/{len(batches)} batches...")
         
         # Merge results into interactions set
-        for query_protein, interacting_proteins in all_batch_results:
-            for interacting_protein in interacting_proteins:
-                self.interactions.add((query_protein, interacting_protein))
+        for query_protein, iteration, interacting_proteins in all_batch_results:
+            self.add_interactions(query_protein, iteration, interacting_proteins)
         
         elapsed_time = time.time() - start_time
         print(f"Parallel parsing complete! Found {len(self.interactions):,} unique interactions")
@@ -255,43 +240,17 @@ class ProteinInteractionParserParallel:
                 try:
                     response = json.loads(line.strip())
                     
-                    # Extract query protein from custom_id
-                    custom_id = response.get('custom_id', '')
-                    if not custom_id.startswith('protein-'):
-                        continue
-                        
-                    # Parse custom_id: "protein-PROTEINNAME-iter-X-req-Y"
-                    parts = custom_id.split('-')
-                    if len(parts) < 4:
-                        continue
-                    query_protein = parts[1].upper()
-                    
-                    # Extract response content
-                    content = None
-                    if 'response' in response:
-                        resp = response['response']
+                    for query_protein, iteration, content in response_sections(response):
+                        if query_protein is None:
+                            continue
                         
-                        # Handle real vLLM format with 'body' layer
-                        if 'body' in resp and 'choices' in resp['body']:
-                            choices = resp['body']['choices']
-                            if choices and 'message' in choices[0]:
-                                content = choices[0]['message'].get('content', '')
-                        
-                        # Fallback to direct format (for test data)
-                        elif 'choices' in resp:
-                            choices = resp['choices']
-                            if choices and 'message' in choices[0]:
-                                content = choices[0]['message'].get('content', '')
-                    
-                    if content:
                         # Extract interacting proteins from the content
                         interacting_proteins = extract_proteins_from_text(content, self.proteins_set)
                         
                         # Add interactions (excluding self-interactions)
                         initial_count = len(self.interactions)
-                        for interacting_protein in interacting_proteins:
-                            if interacting_protein != query_protein:
-                                self.interactions.add((query_protein, interacting_protein))
+                        self.add_interactions(query_protein, iteration,
+                                              [p for p in interacting_proteins if p != query_protein])
                         
                         # Track new interactions found
                         interactions_found += len(self.interactions) - initial_count
@@ -307,6 +266,38 @@ class ProteinInteractionParserParallel:
         print(f"Serial parsing complete! Found {len(self.interactions):,} unique interactions")
         print(f"Processing time: {elapsed_time:.2f} seconds ({total_lines/elapsed_time:.0f} lines/sec)")
 
+    def parse_batch_output_follow(self, batch_output_file, output_file, snapshot_interval=30, poll_interval=1.0, idle_timeout=300):
+        """
+        Parse the batch output JSONL file while the batch is still writing it,
+        publishing an updated DOT file every snapshot_interval seconds.
+        """
+        print(f"Following batch output {batch_output_file}...")
+        
+        start_time = time.time()
+        total_lines = 0
+        published_count = -1
+        last_snapshot_time = time.time()
+        
+        try:
+            for lines in follow_lines(batch_output_file, poll_interval, idle_timeout):
+                # Only the new complete lines are parsed, each poll
+                for query_protein, iteration, interacting_proteins in process_batch_lines(
+                        list(enumerate(lines, total_lines + 1)), self.proteins_set):
+                    self.add_interactions(query_protein, iteration, interacting_proteins)
+                total_lines += len(lines)
+                
+                if time.time() - last_snapshot_time >= snapshot_interval and len(self.interactions) != published_count:
+                    publish_atomically(output_file, self.generate_dot_file)
+                    print(f"Snapshot: {total_lines:,} lines, {len(self.interactions):,} unique interactions")
+                    published_count = len(self.interactions)
+                    last_snapshot_time = time.time()
+            print(f"No new responses for {idle_timeout}s, stopped following {batch_output_file}")
+        except KeyboardInterrupt:
+            print(f"Stopped following {batch_output_file}")
+        
+        elapsed_time = time.time() - start_time
+        print(f"Follow parsing complete! Found {len(self.interactions):,} unique interactions in {total_lines:,} lines ({elapsed_time:.2f} seconds)")
+
     def validate_and_generate_dot_content(self, protein1, protein2):
         """Generate DOT file content for an interaction using the color scheme."""
         edge = f"{protein1} -> {protein2}"
@@ -420,12 +411,16 @@ def main():
     parser.add_argument('--parallel', action='store_true', help='Enable parallel processing')
     parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: CPU count, max 8)')
     parser.add_argument('--chunk-size', type=int, default=1000, help='Lines per chunk for parallel processing')
+    parser.add_argument('--follow', action='store_true', help='Parse the batch output while it is being written, publishing DOT snapshots')
+    parser.add_argument('--snapshot-interval', type=float, default=30, help='Seconds between DOT snapshots with --follow (default: 30)')
+    parser.add_argument('--idle-timeout', type=float, default=300, help='Stop following once the batch output stops growing for this many seconds (default: 300)')
     parser.add_argument('--verbose', action='store_true', help='Print detailed statistics')
     
     args = parser.parse_args()
     
-    # Check if required files exist
-    for file_path, name in [(args.batch_output, "batch output"), (args.proteins_csv, "proteins CSV")]:
+    # Check if required files exist, the batch output may not be written yet when following it
+    required_files = [(args.proteins_csv, "proteins CSV")] + ([] if args.follow else [(args.batch_output, "batch output")])
+    for file_path, name in required_files:
         if not os.path.exists(file_path):
             print(f"Error: {name} file '{file_path}' not found.")
             return 1
@@ -440,7 +435,14 @@ def main():
     
     # Parse batch output
     try:
-        if args.parallel:
+        if args.follow:
+            parser_instance.parse_batch_output_follow(
+                args.batch_output,
+                args.output_dot,
+                snapshot_interval=args.snapshot_interval,
+                idle_timeout=args.idle_timeout
+            )
+        elif args.parallel:
             parser_instance.parse_batch_output_parallel(
                 args.batch_output,
                 num_workers=args.workers,
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Local cache of LLM responses, so that re-running the pipeline on the same or
+overlapping proteins does not send the same prompts to the GPU again.
+
+Entries are addressed by a hash of what determines a response: the model, the
+messages (or prompt), max_tokens, the seed, the iteration and the number of
+samples n. The iteration tells apart the unseeded samples of one prompt.
+Each entry is a JSON file under the cache directory:
+
+    <cache dir>/ab/ab12...ef.json
+
+so several processes, e.g. the vllm_batch.py ranks of a Polaris job, can share
+one cache on a shared filesystem. Entries are written atomically. A hit marks
+its entry as recently used. Once the cache grows past its maximum size, the least
+recently used entries are evicted down to 90% of it.
+
+Shared by the Sophia scripts and Polaris/vllm_batch.py, where it is a symlink.
+
+    python response_cache.py --cache-dir .response_cache              # entries and size
+    python response_cache.py --cache-dir .response_cache --max-gb 5   # evict down to 5 GB
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+DEFAULT_MAX_BYTES = 10 << 30
+EVICT_TO = 0.9
+
+
+def cache_key(model, messages, max_tokens, seed=None, iteration=None, n=None):
+    """Hex digest addressing the response of a request."""
+    fields = json.dumps([model, messages, max_tokens, seed, iteration, n], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(fields.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir (str): Directory of the cache, created if needed
+            max_bytes (int): Size above which the least recently used entries are evicted
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        # Other processes sharing the cache are only accounted for at the next eviction
+        self.size = sum(size for _, _, size in self.entries())
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """Cached value of key, or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self.stats["misses"] += 1
+            return None
+        try:
+            os.utime(path)  # recently used, evicted last
+        except OSError:
+            pass
+        self.stats["hits"] += 1
+        return value
+
+    def put(self, key, value):
+        """Store a JSON-serializable value under key."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.size += len(data)
+        self.stats["stores"] += 1
+        if self.size > self.max_bytes:
+            self.evict(self.max_bytes * EVICT_TO)
+
+    def entries(self):
+        """Yield (last use, path, bytes) of every entry."""
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+                yield stat.st_mtime, entry.path, stat.st_size
+
+    def evict(self, target_bytes):
+        """Remove the least recently used entries until the cache holds at most target_bytes."""
+        entries = sorted(self.entries())
+        self.size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.size <= target_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.stats["evictions"] += 1
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def summary(self):
+        return (f"Response cache: {self.stats['hits']:,} hits, {self.stats['misses']:,} misses "
+                f"({self.hit_rate():.1%} hit rate), {self.stats['stores']:,} stored, "
+                f"{self.stats['evictions']:,} evicted, {self.size / (1 << 20):.1f} MB in {self.cache_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the size of a response cache, or evict it down to a size")
+    parser.add_argument("--cache-dir", default=".response_cache", help="Response cache directory (default: .response_cache)")
+    parser.add_argument("--max-gb", type=float, help="Evict the least recently used entries down to this size")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.cache_dir):
+        print(f"Error: Cache directory '{args.cache_dir}' not found.")
+        return 1
+    cache = ResponseCache(args.cache_dir)
+    if args.max_gb is not None:
+        cache.evict(args.max_gb * (1 << 30))
+        print(f"Evicted {cache.stats['evictions']:,} entries")
+    entries = sum(1 for _ in cache.entries())
+    print(f"{entries:,} entries, {cache.size / (1 << 20):.1f} MB in {args.cache_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
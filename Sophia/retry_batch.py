@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Retry batch for the requests of a prompts JSONL that a batch run did not answer
+properly, instead of running the whole batch again.
+
+Scans the batch output files of the previous runs against the prompts file and
+writes a retry prompts file with the requests that are missing, failed, have an
+empty choice or were truncated at max_tokens. Truncated requests are retried with
+a larger max_tokens. The retry keeps the custom_ids of the original requests.
+
+With --merge-file, the output files are also merged into one batch output with a
+single record per custom_id, the best one: answered over truncated over empty over
+failed, and the most recent run for equal ones.
+
+    python retry_batch.py --prompts-file prompts.jsonl --output-files output.jsonl --retry-file retry.jsonl
+    python run_batch_async.py --input-file retry.jsonl --output-file retry_output.jsonl
+    python retry_batch.py --prompts-file prompts.jsonl --output-files output.jsonl retry_output.jsonl \\
+        --retry-file retry2.jsonl --merge-file merged_output.jsonl
+"""
+
+import argparse
+import json
+import os
+from collections import Counter
+
+from batch_format import RECORD_STATUSES, record_status, response_body
+
+STATUS_RANK = {status: rank for rank, status in enumerate(RECORD_STATUSES)}
+RESEED_OFFSET = 1000003  # an empty answer of a seeded request would come back empty with the same seed
+
+
+def choice_tokens(record):
+    """Mean completion tokens per choice of a record, the max_tokens it ran with for a truncated single choice."""
+    body = response_body(record) or {}
+    completion_tokens = (body.get('usage') or {}).get('completion_tokens') or 0
+    return completion_tokens // max(len(body.get('choices') or []), 1)
+
+
+def scan_outputs(output_files):
+    """
+    Best record of every custom_id over the batch output files, later files and
+    lines winning over earlier ones of the same status.
+    Returns {custom_id: (status, file index, line index, completion tokens per choice)}.
+    """
+    best = {}
+    for file_index, output_file in enumerate(output_files):
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for line_index, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # line left half written by an interrupted run
+                custom_id = record.get('custom_id')
+                if custom_id is None:
+                    continue
+                status = record_status(record)
+                previous = best.get(custom_id)
+                if previous is None or STATUS_RANK[status] >= STATUS_RANK[previous[0]]:
+                    best[custom_id] = (status, file_index, line_index, choice_tokens(record))
+    return best
+
+
+def write_retry_batch(prompts_file, best, retry_file, length_factor=2.0, max_tokens_limit=8192):
+    """
+    Write the requests of prompts_file that have no 'ok' record in best to retry_file.
+    Returns a Counter of the statuses of all requests, 'missing' for those without a record.
+    """
+    counts = Counter()
+    with open(prompts_file, 'r', encoding='utf-8') as f_in, open(retry_file, 'w', encoding='utf-8') as f_out:
+        for line in f_in:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status = best.get(request['custom_id'], ('missing',))[0]
+            counts[status] += 1
+            if status == 'ok':
+                continue
+            body = request['body']
+            if status == 'truncated' and body.get('max_tokens'):
+                # A retry that was truncated again ran with more than the prompts file asks for
+                max_tokens = max(body['max_tokens'], best[request['custom_id']][3])
+                body['max_tokens'] = min(max(int(max_tokens * length_factor), max_tokens + 1), max_tokens_limit)
+            elif status == 'empty' and body.get('seed') is not None:
+                body['seed'] += RESEED_OFFSET
+            f_out.write(json.dumps(request) + '\n')
+    return counts
+
+
+def merge_outputs(output_files, best, merge_file):
+    """Write the best record of every custom_id to merge_file. Returns the number of records written."""
+    chosen = set((file_index, line_index) for _, file_index, line_index, _ in best.values())
+    written = 0
+    with open(merge_file, 'w', encoding='utf-8') as f_out:
+        for file_index, output_file in enumerate(output_files):
+            with open(output_file, 'r', encoding='utf-8') as f_in:
+                for line_index, line in enumerate(f_in):
+                    if (file_index, line_index) in chosen:
+                        f_out.write(line if line.endswith('\n') else line + '\n')
+                        written += 1
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write a retry batch for the missing, failed, empty and truncated requests of a batch run"
+    )
+    parser.add_argument(
+        "--prompts-file",
+        default="protein_interaction_batch_prompts.jsonl",
+        help="Prompts JSONL of the batch (default: protein_interaction_batch_prompts.jsonl)"
+    )
+    parser.add_argument(
+        "--output-files",
+        nargs="+",
+        default=["protein_interaction_batch_output.jsonl"],
+        help="Batch output JSONL files of the previous runs, oldest first (default: protein_interaction_batch_output.jsonl)"
+    )
+    parser.add_argument(
+        "--retry-file",
+        default="protein_interaction_batch_retry.jsonl",
+        help="Retry prompts JSONL file path (default: protein_interaction_batch_retry.jsonl)"
+    )
+    parser.add_argument(
+        "--merge-file",
+        help="Also merge the output files into this batch output, one record per custom_id"
+    )
+    parser.add_argument(
+        "--length-factor",
+        type=float,
+        default=2.0,
+        help="Factor of max_tokens for the retry of truncated requests (default: 2.0)"
+    )
+    parser.add_argument(
+        "--max-tokens-limit",
+        type=int,
+        default=8192,
+        help="Upper bound of the increased max_tokens (default: 8192)"
+    )
+
+    args = parser.parse_args()
+
+    for path in [args.prompts_file] + args.output_files:
+        if not os.path.exists(path):
+            print(f"Error: Input file '{path}' not found.")
+            return 1
+    inputs = set(os.path.abspath(path) for path in [args.prompts_file] + args.output_files)
+    for path in (args.retry_file, args.merge_file):
+        if path and os.path.abspath(path) in inputs:
+            print(f"Error: '{path}' is also an input file.")
+            return 1
+
+    best = scan_outputs(args.output_files)
+    counts = write_retry_batch(args.prompts_file, best, args.retry_file, args.length_factor, args.max_tokens_limit)
+    total = sum(counts.values())
+    retried = total - counts['ok']
+    print(f"Requests: {total:,}, answered: {counts['ok']:,}, missing: {counts['missing']:,}, failed: {counts['failed']:,}, "
+          f"empty: {counts['empty']:,}, truncated: {counts['truncated']:,}")
+    print(f"Retry batch of {retried:,} requests ({retried / max(total, 1):.1%}) written to: {args.retry_file}")
+
+    if args.merge_file:
+        written = merge_outputs(args.output_files, best, args.merge_file)
+        print(f"Merged {written:,} records from {len(args.output_files)} output files into: {args.merge_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Asynchronous runner for the batch prompts of generate_batch_prompts.py.
+Sends every request of the prompts JSONL to an OpenAI-compatible server
+(e.g. `vllm serve`) and streams the responses to a batch output JSONL in the
+format written by `vllm run-batch`, which the parsers read.
+
+Requests are sent over a pool of keep-alive connections with at most
+--concurrency requests in flight. Connection errors, timeouts, 429 and 5xx
+responses are retried with exponential backoff. Responses are appended in
+completion order as soon as they arrive.
+
+With --cache-dir, requests answered before are written from the response
+cache without being sent, and new answers are added to it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+from batch_format import error_record, output_record, read_custom_ids, record_status, request_cache_key
+from response_cache import DEFAULT_MAX_BYTES, ResponseCache
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class BatchRunner:
+    def __init__(self, base_url, concurrency=64, max_retries=5, timeout=600, backoff=1.0, api_key=None, cache=None):
+        """
+        Args:
+            base_url (str): Server URL, e.g. http://localhost:8000
+            concurrency (int): Maximum requests in flight
+            max_retries (int): Retries of a request before it is written as an error
+            timeout (float): Seconds allowed for one request
+            backoff (float): Seconds before the first retry, doubled on every retry
+            api_key (str): Bearer token for the server, if it requires one
+            cache (ResponseCache): Cache answering repeated requests without sending them
+        """
+        self.base_url = base_url.rstrip('/')
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.backoff = backoff
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.cache = cache
+        self.stats = {"requests": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    async def send(self, session, request):
+        """Send one batch request, retrying transient failures. Returns its batch output record."""
+        custom_id = request["custom_id"]
+        url = self.base_url + request.get("url", "/v1/chat/completions")
+        message = None
+        status = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                # Full jitter, so the retries of a burst of failures do not come back together
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+            try:
+                async with session.post(url, json=request["body"], headers=self.headers) as response:
+                    status = response.status
+                    if status == 200:
+                        body = await response.json()
+                        usage = body.get("usage") or {}
+                        self.stats["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                        self.stats["completion_tokens"] += usage.get("completion_tokens", 0)
+                        return output_record(custom_id, body)
+                    message = (await response.text())[:1000]
+                    if status not in RETRY_STATUSES:
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                # ValueError: a 200 reply whose JSON body is malformed or cut off
+                status = None
+                message = f"{type(e).__name__}: {e}"
+        self.stats["errors"] += 1
+        return error_record(custom_id, message, status)
+
+    async def worker(self, session, queue, output):
+        while True:
+            request = await queue.get()
+            if request is None:
+                return
+            try:
+                key = request_cache_key(request) if self.cache else None
+                body = self.cache.get(key) if self.cache else None
+                if body is not None:
+                    record = output_record(request["custom_id"], body)
+                else:
+                    record = await self.send(session, request)
+                    # Empty answers are not cached, their retry would get them again
+                    if self.cache and record_status(record) in ('ok', 'truncated'):
+                        self.cache.put(key, record["response"]["body"])
+            except Exception as e:
+                # A dead worker would lose its request and, once all are dead, block run() on the full queue
+                self.stats["errors"] += 1
+                record = error_record(request.get("custom_id"), f"{type(e).__name__}: {e}")
+            output.write(json.dumps(record) + '\n')
+            # Flush every response, readers follow the file while the batch runs
+            output.flush()
+            self.stats["requests"] += 1
+            if self.stats["requests"] % 1000 == 0:
+                print(f"Completed {self.stats['requests']:,} requests, {self.stats['errors']:,} errors")
+
+    async def run(self, requests, output):
+        """Send the requests, an iterable read lazily, writing each response to the output file."""
+        queue = asyncio.Queue(maxsize=2 * self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            workers = [asyncio.create_task(self.worker(session, queue, output)) for _ in range(self.concurrency)]
+            for request in requests:
+                await queue.put(request)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+
+
+def read_requests(prompts_file, skip_ids=frozenset()):
+    """Yield the requests of a prompts JSONL file, except those in skip_ids."""
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if request["custom_id"] not in skip_ids:
+                yield request
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send batch prompts to an OpenAI-compatible server and write the batch output JSONL"
+    )
+    parser.add_argument(
+        "--input-file",
+        default="protein_interaction_batch_prompts.jsonl",
+        help="Prompts JSONL from generate_batch_prompts.py (default: protein_interaction_batch_prompts.jsonl)"
+    )
+    parser.add_argument(
+        "--output-file",
+        default="protein_interaction_batch_output.jsonl",
+        help="Batch output JSONL file path (default: protein_interaction_batch_output.jsonl)"
+    )
+    parser.add_argument(
+        "--base-url",
+        default="http://localhost:8000",
+        help="URL of the OpenAI-compatible server (default: http://localhost:8000)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=64,
+        help="Maximum requests in flight (default: 64)"
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=5,
+        help="Retries of a failed request before it is written as an error (default: 5)"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds allowed for one request (default: 600)"
+    )
+    parser.add_argument(
+        "--api-key",
+        default=os.environ.get("OPENAI_API_KEY"),
+        help="API key of the server (default: $OPENAI_API_KEY)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Append to the output file, skipping the requests it already answers"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Response cache directory, requests found in it are not sent (default: no cache)"
+    )
+    parser.add_argument(
+        "--cache-max-gb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1 << 30),
+        help=f"Size of the response cache before the least recently used entries are evicted (default: {DEFAULT_MAX_BYTES / (1 << 30):g})"
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"Error: Input file '{args.input_file}' not found.")
+        return 1
+
+    skip_ids = read_custom_ids(args.output_file) if args.resume else set()
+    if skip_ids:
+        print(f"Resuming: {len(skip_ids):,} requests already answered in {args.output_file}")
+
+    cache = ResponseCache(args.cache_dir, int(args.cache_max_gb * (1 << 30))) if args.cache_dir else None
+    runner = BatchRunner(args.base_url, args.concurrency, args.max_retries, args.timeout, api_key=args.api_key, cache=cache)
+    start_time = time.time()
+    with open(args.output_file, 'a' if args.resume else 'w', encoding='utf-8') as output:
+        asyncio.run(runner.run(read_requests(args.input_file, skip_ids), output))
+    elapsed = max(time.time() - start_time, 1e-6)
+
+    stats = runner.stats
+    print(f"Completed {stats['requests']:,} requests in {elapsed:.2f}s "
+          f"({stats['requests'] / elapsed:.1f} requests/sec, {stats['completion_tokens'] / elapsed:.1f} completion tokens/sec)")
+    print(f"Errors: {stats['errors']:,}, retries: {stats['retries']:,}")
+    if cache:
+        print(cache.summary())
+    print(f"Output written to: {args.output_file}")
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    exit(main())
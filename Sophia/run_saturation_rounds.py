@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Multi-round driver that stops querying a protein once its iterations stop finding
+new interaction partners, instead of running a fixed number of iterations for all.
+
+Each round generates the next iterations of the proteins still active, as
+generate_batch_prompts.py does, sends them to an OpenAI-compatible server with
+the async runner and parses the answers as parse_llm_output_parallel.py does. A
+protein saturates when a round adds fewer than --min-new-partners partners to
+those of its previous iterations, or when the Jaccard similarity of its partners
+before and after the round reaches --jaccard, for --patience rounds in a row.
+Rounds stop when all the proteins saturated or reached --max-iterations.
+
+All the rounds are appended to one batch output JSONL, with the usual custom_ids,
+so the parsers read it as any other batch output.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import time
+
+import pandas as pd
+
+from completion_stats import AdaptiveMaxTokens, load_max_tokens
+from generate_batch_prompts import iter_request_lines, request_templates
+from parse_llm_output_parallel import process_batch_lines
+from run_batch_async import BatchRunner
+
+
+class SaturationTracker:
+    """Partners found so far for each protein, and whether its iterations still find new ones."""
+
+    def __init__(self, proteins, min_iterations=2, min_new_partners=1, jaccard=None, patience=1):
+        """
+        Args:
+            proteins (list): Names of the query proteins
+            min_iterations (int): Iterations of a protein before it can saturate
+            min_new_partners (int): New partners a round must add for the protein to stay active
+            jaccard (float): Also saturate when the Jaccard similarity of the partners before and after the round reaches this
+            patience (int): Rounds in a row without enough growth before the protein saturates
+        """
+        self.names = {protein.upper(): protein for protein in proteins}
+        self.partners = {protein: set() for protein in self.names}
+        self.iterations = dict.fromkeys(self.names, 0)
+        self.stale_rounds = dict.fromkeys(self.names, 0)
+        self.saturated_round = {}
+        self.min_iterations = min_iterations
+        self.min_new_partners = min_new_partners
+        self.jaccard = jaccard
+        self.patience = patience
+
+    def active(self):
+        """Names of the proteins still gaining partners."""
+        return [self.names[protein] for protein in self.names if protein not in self.saturated_round]
+
+    def update(self, round_number, round_interactions):
+        """
+        Add the (query protein, iteration, partners) of a round, and saturate the proteins that
+        did not grow. Proteins without an answered iteration in the round are left as they were.
+        Returns the number of new partners found by the round.
+        """
+        round_partners = {}
+        round_iterations = {}
+        for query_protein, iteration, partners in round_interactions:
+            if query_protein not in self.partners:
+                continue
+            round_partners.setdefault(query_protein, set()).update(partners)
+            round_iterations.setdefault(query_protein, set()).add(iteration)
+
+        total_new = 0
+        for protein, partners in round_partners.items():
+            before = self.partners[protein]
+            new_partners = partners - before
+            total_new += len(new_partners)
+            after = before | new_partners
+            self.partners[protein] = after
+            self.iterations[protein] += len(round_iterations[protein])
+            # The partners before the round are a subset of those after it
+            similarity = len(before) / len(after) if after else 1.0
+            grew = len(new_partners) >= self.min_new_partners and (self.jaccard is None or similarity < self.jaccard)
+            self.stale_rounds[protein] = 0 if grew else self.stale_rounds[protein] + 1
+            if self.iterations[protein] >= self.min_iterations and self.stale_rounds[protein] >= self.patience:
+                self.saturated_round.setdefault(protein, round_number)
+        return total_new
+
+
+def read_proteins(proteins_csv, max_proteins=None):
+    """Query proteins of the proteins CSV, as generate_batch_prompts.py reads them."""
+    df = pd.read_csv(proteins_csv)
+    if 'search_words' not in df.columns:
+        raise ValueError(f"Expected column 'search_words' not found in {proteins_csv}")
+    if max_proteins:
+        df = df.head(max_proteins)
+    return [name for name in df['search_words'].dropna().astype(str).str.strip() if name]
+
+
+def round_requests(proteins, args, first_iteration, iterations, adaptive=None):
+    """Requests of the iterations first_iteration to first_iteration + iterations - 1 of the proteins."""
+    seed = None if args.seed is None else args.seed + first_iteration - 1
+    templates = request_templates(args.model, args.max_tokens, iterations, args.n_sampling, seed)
+    for lines, _ in iter_request_lines(proteins, templates, args.pack, adaptive, first_iteration):
+        for line in lines:
+            yield json.loads(line)
+
+
+def read_new_lines(path, offset):
+    """Lines appended to a file since offset, and the new offset."""
+    with open(path, 'r', encoding='utf-8') as f:
+        f.seek(offset)
+        lines = f.readlines()
+        return lines, f.tell()
+
+
+def write_summary(summary_file, tracker, max_iterations):
+    with open(summary_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['protein', 'iterations', 'partners', 'saturated_round', 'iterations_saved'])
+        for protein, name in tracker.names.items():
+            writer.writerow([name, tracker.iterations[protein], len(tracker.partners[protein]),
+                             tracker.saturated_round.get(protein, ''), max_iterations - tracker.iterations[protein]])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query proteins in rounds of iterations until their interaction partners saturate"
+    )
+    parser.add_argument("--input-file", default="data/proteins.csv", help="Path to the proteins CSV file (default: data/proteins.csv)")
+    parser.add_argument("--output-file", default="protein_interaction_batch_output.jsonl", help="Batch output JSONL of all the rounds (default: protein_interaction_batch_output.jsonl)")
+    parser.add_argument("--max-proteins", type=int, help="Maximum number of proteins to process (for testing)")
+    parser.add_argument("--max-iterations", type=int, default=10, help="Iterations of a protein that never saturates (default: 10)")
+    parser.add_argument("--iterations-per-round", type=int, default=1, help="Iterations of every active protein per round (default: 1)")
+    parser.add_argument("--min-iterations", type=int, default=2, help="Iterations of a protein before it can saturate (default: 2)")
+    parser.add_argument("--min-new-partners", type=int, default=1, help="New partners a round must find for a protein to stay active (default: 1)")
+    parser.add_argument("--jaccard", type=float, help="Also saturate a protein when the Jaccard similarity of its partners before and after a round reaches this, e.g. 0.9")
+    parser.add_argument("--patience", type=int, default=1, help="Rounds in a row without growth before a protein saturates (default: 1)")
+    parser.add_argument("--summary-file", help="CSV of the iterations, partners and saturation round of every protein")
+    # Requests, as for generate_batch_prompts.py
+    parser.add_argument("--model", default="meta-llama/Meta-Llama-3.1-8B-Instruct", help="Model name to use for batch requests")
+    parser.add_argument("--max-tokens", type=int, default=1000, help="Maximum tokens per response (default: 1000)")
+    parser.add_argument("--max-tokens-file", help="Per-protein max_tokens fitted by completion_stats.py, capped at --max-tokens")
+    parser.add_argument("--n-sampling", action="store_true", help="Sample the iterations of a round on the server (\"n\": iterations per round)")
+    parser.add_argument("--seed", type=int, help="Seed the requests with seed + iteration (default: unseeded)")
+    parser.add_argument("--pack", type=int, default=1, help="Ask about this many proteins per request (default: 1)")
+    # Server, as for run_batch_async.py
+    parser.add_argument("--base-url", default="http://localhost:8000", help="URL of the OpenAI-compatible server (default: http://localhost:8000)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight (default: 64)")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries of a failed request before it is written as an error (default: 5)")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed for one request (default: 600)")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="API key of the server (default: $OPENAI_API_KEY)")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"Error: Input file '{args.input_file}' not found.")
+        return 1
+    if min(args.max_iterations, args.iterations_per_round, args.pack) < 1:
+        print("Error: --max-iterations, --iterations-per-round and --pack must be at least 1")
+        return 1
+
+    try:
+        proteins = read_proteins(args.input_file, args.max_proteins)
+    except Exception as e:
+        print(f"Error reading CSV file: {e}")
+        return 1
+    if args.pack > 1 and any('-' in name or '+' in name for name in proteins):
+        print("Error: --pack cannot be used with protein names containing '-' or '+'")
+        return 1
+    adaptive = AdaptiveMaxTokens(load_max_tokens(args.max_tokens_file), args.max_tokens) if args.max_tokens_file else None
+
+    proteins_set = set(name.upper() for name in proteins)
+    tracker = SaturationTracker(proteins, args.min_iterations, args.min_new_partners, args.jaccard, args.patience)
+    runner = BatchRunner(args.base_url, args.concurrency, args.max_retries, args.timeout, api_key=args.api_key)
+    print(f"Loaded {len(proteins)} proteins from {args.input_file}")
+
+    start_time = time.time()
+    requests_sent = 0
+    protein_iterations = 0
+    offset = 0
+    first_iteration = 1
+    round_number = 0
+    open(args.output_file, 'w').close()
+    while first_iteration <= args.max_iterations:
+        active = tracker.active()
+        if not active:
+            break
+        round_number += 1
+        iterations = min(args.iterations_per_round, args.max_iterations - first_iteration + 1)
+        requests_before = runner.stats["requests"]
+        with open(args.output_file, 'a', encoding='utf-8') as output:
+            asyncio.run(runner.run(round_requests(active, args, first_iteration, iterations, adaptive), output))
+        requests_sent += runner.stats["requests"] - requests_before
+        protein_iterations += len(active) * iterations
+
+        lines, offset = read_new_lines(args.output_file, offset)
+        new_partners = tracker.update(round_number, process_batch_lines(enumerate(lines, 1), proteins_set))
+        print(f"Round {round_number}: iterations {first_iteration}-{first_iteration + iterations - 1} of {len(active):,} proteins, "
+              f"{runner.stats['requests'] - requests_before:,} requests, {new_partners:,} new partners, "
+              f"{len(active) - len(tracker.active()):,} proteins saturated")
+        first_iteration += iterations
+
+    # Baseline: the same requests with --iterations max_iterations for every protein
+    groups = math.ceil(len(proteins) / args.pack)
+    baseline_requests = groups * (1 if args.n_sampling else args.max_iterations)
+    baseline_iterations = len(proteins) * args.max_iterations
+    elapsed = max(time.time() - start_time, 1e-6)
+    print(f"Completed {round_number} rounds in {elapsed:.2f}s, {runner.stats['errors']:,} errors")
+    print(f"Protein iterations: {protein_iterations:,} instead of {baseline_iterations:,} "
+          f"({1 - protein_iterations / max(baseline_iterations, 1):.1%} fewer)")
+    saved = 1 - requests_sent / max(baseline_requests, 1)
+    print(f"Requests: {requests_sent:,} instead of {baseline_requests:,} with {args.max_iterations} iterations per protein "
+          f"({abs(saved):.1%} {'fewer' if saved >= 0 else 'more'})")
+    print(f"Proteins saturated: {len(tracker.saturated_round):,} of {len(proteins):,}")
+    print(f"Output written to: {args.output_file}")
+    if args.summary_file:
+        write_summary(args.summary_file, tracker, args.max_iterations)
+        print(f"Summary written to: {args.summary_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -13,10 +13,14 @@ import os
 
 
 class FakeLLMOutputGenerator:
-    def __init__(self, proteins_csv_path):
-        """Initialize with protein dataset."""
+    def __init__(self, proteins_csv_path, known_partners=None):
+        """
+        Initialize with protein dataset. With known_partners, the interactions of a protein
+        are drawn from a fixed set of that many proteins, so repeated iterations saturate.
+        """
         self.proteins_df = pd.read_csv(proteins_csv_path)
         self.all_proteins = self.proteins_df['search_words'].tolist()
+        self.known_partners = known_partners
         
         # Common protein interaction templates
         self.interaction_templates = [
@@ -47,6 +51,11 @@ class FakeLLMOutputGenerator:
         
         # Select random proteins for interactions (excluding self)
         available_proteins = [p for p in self.all_proteins if p != query_protein]
+        if self.known_partners:
+            # The same partners for every iteration of the protein
+            available_proteins = random.Random(query_protein).sample(
+                available_proteins, min(self.known_partners, len(available_proteins))
+            )
         selected_proteins = random.sample(
             available_proteins, 
             min(num_interactions, len(available_proteins))
@@ -69,13 +78,23 @@ class FakeLLMOutputGenerator:
         
         return content
     
-    def generate_batch_response(self, custom_id, query_protein, model_name="meta-llama/Meta-Llama-3.1-8B-Instruct"):
-        """Generate a single batch response in vLLM format."""
-        content = self.generate_protein_interactions(query_protein)
+    def generate_packed_interactions(self, query_proteins):
+        """Generate the answer of a packed request, a "### PROTEIN" section per query protein."""
+        return "\n\n".join(f"### {protein}\n" + self.generate_protein_interactions(protein) for protein in query_proteins)
+    
+    def generate_batch_response(self, custom_id, query_protein, model_name="meta-llama/Meta-Llama-3.1-8B-Instruct", n=1):
+        """
+        Generate a single batch response in vLLM format, with n choices as for a request sampled n times.
+        A list of query proteins gives the answer of a packed request.
+        """
+        if isinstance(query_protein, list):
+            contents = [self.generate_packed_interactions(query_protein) for _ in range(n)]
+        else:
+            contents = [self.generate_protein_interactions(query_protein) for _ in range(n)]
         
         # Calculate approximate token counts
         prompt_tokens = random.randint(150, 200)
-        completion_tokens = len(content.split()) * 1.3  # Rough token estimate
+        completion_tokens = sum(len(content.split()) for content in contents) * 1.3  # Rough token estimate
         total_tokens = prompt_tokens + completion_tokens
         
         response = {
@@ -88,7 +107,7 @@ class FakeLLMOutputGenerator:
                 "model": model_name,
                 "choices": [
                     {
-                        "index": 0,
+                        "index": index,
                         "message": {
                             "role": "assistant",
                             "content": content
@@ -97,6 +116,7 @@ class FakeLLMOutputGenerator:
                         "finish_reason": "stop",
                         "stop_reason": None
                     }
+                    for index, content in enumerate(contents)
                 ],
                 "usage": {
                     "prompt_tokens": int(prompt_tokens),
@@ -109,18 +129,30 @@ class FakeLLMOutputGenerator:
         
         return response
     
-    def generate_batch_file(self, output_file, num_proteins=50, iterations_per_protein=3):
-        """Generate a complete batch output file with multiple proteins and iterations."""
+    def generate_batch_file(self, output_file, num_proteins=50, iterations_per_protein=3, n_sampling=False, pack=1):
+        """
+        Generate a complete batch output file with multiple proteins and iterations.
+        With n_sampling, each protein has one response holding all its iterations as choices.
+        With pack > 1, each response answers pack proteins, as generate_batch_prompts.py --pack asks.
+        """
         
         # Select random proteins for testing
         test_proteins = random.sample(self.all_proteins, min(num_proteins, len(self.all_proteins)))
+        if pack > 1:
+            test_proteins = [test_proteins[i:i + pack] for i in range(0, len(test_proteins), pack)]
         
         responses = []
         request_counter = 1
         
         for protein in test_proteins:
+            id_prefix = f"proteins-{'+'.join(protein)}" if pack > 1 else f"protein-{protein}"
+            if n_sampling:
+                custom_id = f"{id_prefix}-iter-1-n-{iterations_per_protein}-req-{request_counter}"
+                responses.append(self.generate_batch_response(custom_id, protein, n=iterations_per_protein))
+                request_counter += 1
+                continue
             for iteration in range(iterations_per_protein):
-                custom_id = f"protein-{protein}-iter-{iteration+1}-req-{request_counter}"
+                custom_id = f"{id_prefix}-iter-{iteration+1}-req-{request_counter}"
                 
                 response = self.generate_batch_response(custom_id, protein)
                 responses.append(response)
@@ -164,6 +196,17 @@ def main():
         default=3,
         help="Number of iterations per protein (default: 3)"
     )
+    parser.add_argument(
+        "--n-sampling",
+        action="store_true",
+        help="One response per protein with a choice per iteration, as for generate_batch_prompts.py --n-sampling"
+    )
+    parser.add_argument(
+        "--pack",
+        type=int,
+        default=1,
+        help="Proteins answered per response, as for generate_batch_prompts.py --pack (default: 1)"
+    )
     parser.add_argument(
         "--model",
         default="meta-llama/Meta-Llama-3.1-8B-Instruct",
@@ -186,7 +229,9 @@ def main():
         generator.generate_batch_file(
             args.output_file,
             num_proteins=args.num_proteins,
-            iterations_per_protein=args.iterations
+            iterations_per_protein=args.iterations,
+            n_sampling=args.n_sampling,
+            pack=args.pack
         )
         
         # Show sample content
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark of packed multi-protein prompts (generate_batch_prompts.py --pack).
+For each pack size, reports the requests and estimated prompt tokens of the
+batch, and the parse throughput of packed fake responses.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SOPHIA_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SOPHIA_DIR)
+
+from generate_batch_prompts import estimate_tokens  # noqa: E402
+from parse_llm_output_parallel import ProteinInteractionParserParallel  # noqa: E402
+
+
+def prompt_stats(prompts_file):
+    """Requests and estimated prompt tokens of a prompts JSONL file."""
+    requests = 0
+    prompt_tokens = 0
+    with open(prompts_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            request = json.loads(line)
+            requests += 1
+            prompt_tokens += sum(estimate_tokens(message["content"]) for message in request["body"]["messages"])
+    return requests, prompt_tokens
+
+
+def time_parse(batch_file, proteins_csv):
+    """Parse a batch output with the parallel parser in serial mode. Returns (seconds, protein iterations parsed)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        parser = ProteinInteractionParserParallel(proteins_csv, "", "")
+        start_time = time.time()
+        parser.parse_batch_output_serial(batch_file)
+        elapsed = time.time() - start_time
+    return elapsed, len(parser.iteration_partners)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark packed multi-protein prompts")
+    parser.add_argument("--proteins-csv", default="data/proteins.csv", help="Path to proteins.csv file (default: data/proteins.csv)")
+    parser.add_argument("--num-proteins", type=int, default=1000, help="Proteins in the batch (default: 1000)")
+    parser.add_argument("--iterations", type=int, default=3, help="Iterations per protein (default: 3)")
+    parser.add_argument("--packs", default="1,2,4,8", help="Pack sizes to compare (default: 1,2,4,8)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.proteins_csv):
+        print(f"Error: Proteins file '{args.proteins_csv}' not found.")
+        return 1
+
+    print("📦 PACKED PROMPT BENCHMARK")
+    print("=" * 50)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pack in [int(size) for size in args.packs.split(",")]:
+            prompts_file = os.path.join(tmp_dir, f"prompts_{pack}.jsonl")
+            batch_file = os.path.join(tmp_dir, f"responses_{pack}.jsonl")
+            subprocess.run([sys.executable, os.path.join(SOPHIA_DIR, "generate_batch_prompts.py"),
+                            "--input-file", args.proteins_csv, "--output-file", prompts_file,
+                            "--max-proteins", str(args.num_proteins), "--iterations", str(args.iterations),
+                            "--pack", str(pack)], check=True, capture_output=True)
+            subprocess.run([sys.executable, os.path.join(SOPHIA_DIR, "test", "generate_fake_outputs.py"),
+                            "--proteins-csv", args.proteins_csv, "--output-file", batch_file,
+                            "--num-proteins", str(args.num_proteins), "--iterations", str(args.iterations),
+                            "--pack", str(pack)], check=True, capture_output=True)
+            requests, prompt_tokens = prompt_stats(prompts_file)
+            parse_time, protein_iterations = time_parse(batch_file, args.proteins_csv)
+            results.append((pack, requests, prompt_tokens, parse_time, protein_iterations))
+            print(f"Pack {pack}: {requests:,} requests, ~{prompt_tokens:,} prompt tokens, "
+                  f"{protein_iterations:,} protein iterations parsed in {parse_time:.3f}s")
+
+    baseline_requests, baseline_tokens = results[0][1], results[0][2]
+    print("\n" + "=" * 78)
+    print(f"{'Pack':<6} {'Requests':<10} {'Prompt tok':<12} {'Saved':<8} {'Parse (s)':<10} {'Protein iters/s':<16}")
+    print("-" * 78)
+    for pack, requests, prompt_tokens, parse_time, protein_iterations in results:
+        saved = 1 - prompt_tokens / baseline_tokens if baseline_tokens else 0
+        print(f"{pack:<6} {requests:<10,} {prompt_tokens:<12,} {saved:<8.0%} {parse_time:<10.3f} "
+              f"{protein_iterations / max(parse_time, 1e-9):<16,.0f}")
+    print(f"\n💡 Requests relative to pack {results[0][0]}: " +
+          ", ".join(f"pack {pack}: {requests / baseline_requests:.2f}x" for pack, requests, *_ in results[1:]))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Stub of an OpenAI-compatible vLLM server for offline throughput tests of run_batch_async.py.
+Answers POST /v1/chat/completions with fake protein interaction responses from
+generate_fake_outputs.py, after a configurable latency and token rate.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate_fake_outputs import FakeLLMOutputGenerator  # noqa: E402
+
+QUERY_PATTERN = re.compile(r'interact with (\S+?)\.')
+PACKED_QUERY_PATTERN = re.compile(r'interact with it: (.+?)\. ')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as a real server
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        config = self.server.config
+        if self.path != "/v1/chat/completions":
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        if random.random() < config.error_rate:
+            self.send_json(503, {"error": {"message": "Injected failure"}})
+            return
+        user_message = request["messages"][-1]["content"]
+        packed = PACKED_QUERY_PATTERN.search(user_message)
+        match = QUERY_PATTERN.search(user_message)
+        query_protein = packed.group(1).split(", ") if packed else (match.group(1) if match else "TP53")
+        generate = self.server.generator.generate_packed_interactions if packed else self.server.generator.generate_protein_interactions
+        # n choices share the prefill and are decoded together
+        contents = [generate(query_protein) for _ in range(request.get("n") or 1)]
+        prompt_tokens = int(sum(len(message["content"].split()) for message in request["messages"]) * 1.3)
+        # Cut answers longer than max_tokens, as the server does
+        max_words = int((request.get("max_tokens") or 1 << 30) / 1.3)
+        finish_reasons = ["length" if len(content.split()) > max_words else "stop" for content in contents]
+        contents = [" ".join(content.split(" ")[:max_words]) if reason == "length" else content
+                    for content, reason in zip(contents, finish_reasons)]
+        choice_tokens = [request["max_tokens"] if reason == "length" else int(len(content.split()) * 1.3)
+                         for content, reason in zip(contents, finish_reasons)]
+        completion_tokens = sum(choice_tokens)
+        # Prefill and decode time of a single request on the server
+        time.sleep(config.latency + prompt_tokens / config.prefill_tokens_per_sec + max(choice_tokens) / config.tokens_per_sec)
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [
+                {
+                    "index": index,
+                    "message": {"role": "assistant", "content": content},
+                    "logprobs": None,
+                    "finish_reason": finish_reason,
+                    "stop_reason": None
+                }
+                for index, (content, finish_reason) in enumerate(zip(contents, finish_reasons))
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "completion_tokens": completion_tokens
+            }
+        })
+
+    def log_message(self, format, *args):
+        pass  # one line per request would dominate the test output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible server for offline tests of run_batch_async.py")
+    parser.add_argument("--proteins-csv", default="data/proteins.csv", help="Path to proteins.csv file (default: data/proteins.csv)")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on (default: 8000)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Fixed seconds per request (default: 0.05)")
+    parser.add_argument("--tokens-per-sec", type=float, default=1000, help="Completion tokens generated per second and request (default: 1000)")
+    parser.add_argument("--prefill-tokens-per-sec", type=float, default=50000, help="Prompt tokens prefilled per second and request (default: 50000)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 503 (default: 0)")
+    parser.add_argument("--known-partners", type=int, help="Draw the partners of a protein from a fixed set of this size, so iterations saturate (default: all proteins)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.proteins_csv):
+        print(f"Error: Proteins file '{args.proteins_csv}' not found.")
+        return 1
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    server.config = args
+    server.generator = FakeLLMOutputGenerator(args.proteins_csv, args.known_partners)
+    print(f"Stub server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
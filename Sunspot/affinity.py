@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Topology-aware CPU bind lists and CCL worker affinities for packing several
+model instances (Balsam jobs) on one node.
+
+A node topology is a list of domains (sockets, or NUMA nodes), each a list of
+physical cores, each core the list of its hardware threads with the primary
+thread first. The first cores of every domain are left to the OS. The remaining
+cores of a domain are split into equal blocks, one per rank placed on it, so no
+block straddles two domains. Each rank uses the first cores of its block for its
+CCL workers and binds to the next ones, with their hyperthread siblings.
+
+With the Sunspot topology (2 sockets of 52 cores, 2 threads per core), 3 jobs of
+4 ranks reproduce the groups hand-written for define_jobs.py:
+    python3 affinity.py --packing 3 --ranks-per-node 4
+
+To capture the topology of a compute node, run on it:
+    python3 affinity.py --dump node_topology.json
+"""
+
+import argparse
+import glob
+import json
+import os
+
+
+def synthetic_topology(domains, cores_per_domain, threads_per_core=2):
+    """
+    Topology with the usual Linux numbering: the primary threads of all cores
+    first, then the second threads of all cores, and so on.
+    """
+    total_cores = domains * cores_per_domain
+    return [[[core + thread * total_cores for thread in range(threads_per_core)]
+             for core in range(domain * cores_per_domain, (domain + 1) * cores_per_domain)]
+            for domain in range(domains)]
+
+
+def sunspot_topology():
+    return synthetic_topology(2, 52, 2)
+
+
+def parse_cpu_list(cpu_list):
+    """Parse a /sys cpu list such as '0-3,8,10-11'."""
+    cpus = []
+    for part in cpu_list.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def read_sys_topology(sys_cpu_path='/sys/devices/system/cpu', sys_node_path='/sys/devices/system/node'):
+    """
+    Read the topology of this node from /sys. The domains are the NUMA nodes
+    when they are exposed, and the sockets otherwise.
+    """
+    cores = {}  # (package, core id) -> hardware threads
+    packages = {}
+    for cpu_dir in glob.glob(os.path.join(sys_cpu_path, 'cpu[0-9]*')):
+        topology_dir = os.path.join(cpu_dir, 'topology')
+        if not os.path.isdir(topology_dir):
+            continue  # offline cpu
+        cpu = int(os.path.basename(cpu_dir)[3:])
+        with open(os.path.join(topology_dir, 'physical_package_id')) as f:
+            package = int(f.read())
+        with open(os.path.join(topology_dir, 'core_id')) as f:
+            core_id = int(f.read())
+        cores.setdefault((package, core_id), []).append(cpu)
+        packages[cpu] = package
+    domain_cpus = {}
+    for node_dir in glob.glob(os.path.join(sys_node_path, 'node[0-9]*')):
+        with open(os.path.join(node_dir, 'cpulist')) as f:
+            cpus = parse_cpu_list(f.read())
+        if cpus:
+            domain_cpus[int(os.path.basename(node_dir)[4:])] = set(cpus)
+    if not domain_cpus:
+        for cpu, package in packages.items():
+            domain_cpus.setdefault(package, set()).add(cpu)
+    domains = []
+    for domain in sorted(domain_cpus):
+        domains.append(sorted(sorted(core) for core in cores.values() if min(core) in domain_cpus[domain]))
+    return domains
+
+
+def load_topology(topology_file):
+    with open(topology_file, 'r') as f:
+        return json.load(f)['domains']
+
+
+def save_topology(topology_file, domains):
+    with open(topology_file, 'w') as f:
+        json.dump({'domains': domains}, f)
+
+
+def format_cpu_list(cpus):
+    """Format cpu ids as ranges, e.g. [2, 3, 4, 9] -> '2-4,9'."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f'{first}-{last}' if last > first else f'{first}' for first, last in ranges)
+
+
+def rank_slots(domains, num_ranks, cores_per_rank=3, ccl_workers_per_rank=1, reserved_cores=1):
+    """
+    Place num_ranks ranks on the domains, as evenly as possible and domain by domain.
+    Returns a (CCL worker cores, bound hardware threads) pair per rank.
+    """
+    if num_ranks < 1:
+        raise ValueError("At least one rank is needed")
+    ranks_per_domain = -(-num_ranks // len(domains))
+    slots = []
+    for domain in domains:
+        usable = domain[reserved_cores:]
+        stride = len(usable) // ranks_per_domain
+        if stride < ccl_workers_per_rank + cores_per_rank:
+            raise ValueError(f"{ranks_per_domain} ranks of {ccl_workers_per_rank} CCL worker and {cores_per_rank} cores "
+                             f"do not fit in the {len(usable)} usable cores of a domain")
+        for i in range(ranks_per_domain):
+            block = usable[i * stride:(i + 1) * stride]
+            ccl_cores = [core[0] for core in block[:ccl_workers_per_rank]]
+            bound = block[ccl_workers_per_rank:ccl_workers_per_rank + cores_per_rank]
+            # Primary threads first, then their siblings
+            threads = [core[position] for position in range(max(len(core) for core in bound))
+                       for core in bound if position < len(core)]
+            slots.append((ccl_cores, threads))
+    return slots[:num_ranks]
+
+
+def affinity_groups(domains, packing_count, ranks_per_node, cores_per_rank=3, ccl_workers_per_rank=1, reserved_cores=1):
+    """
+    Non-overlapping affinities for packing_count jobs of ranks_per_node ranks on a node.
+    Returns the CCL worker groups and cpu-bind groups, one per packed job: a CCL group is
+    the list of CCL worker cores of the job's ranks, a cpu-bind group the cpu list of each rank.
+    """
+    slots = rank_slots(domains, packing_count * ranks_per_node, cores_per_rank, ccl_workers_per_rank, reserved_cores)
+    ccl_groups = []
+    cpu_bind_groups = []
+    for job in range(packing_count):
+        job_slots = slots[job * ranks_per_node:(job + 1) * ranks_per_node]
+        ccl_groups.append([core for ccl_cores, threads in job_slots for core in ccl_cores])
+        cpu_bind_groups.append([format_cpu_list(threads) for ccl_cores, threads in job_slots])
+    return ccl_groups, cpu_bind_groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate CPU bind lists and CCL worker affinities for packed jobs')
+    parser.add_argument('--topology', default=None, help='Topology JSON file (default: Sunspot, 2 sockets of 52 cores)')
+    parser.add_argument('--dump', default=None, help='Write the topology of this node, read from /sys, to this JSON file and exit')
+    parser.add_argument('--packing', type=int, default=3, help='Jobs packed per node (default: 3)')
+    parser.add_argument('--ranks-per-node', type=int, default=4, help='Ranks of each job (default: 4)')
+    parser.add_argument('--cores-per-rank', type=int, default=3, help='Cores bound to each rank (default: 3)')
+    args = parser.parse_args()
+
+    if args.dump:
+        domains = read_sys_topology()
+        save_topology(args.dump, domains)
+        print(f"Wrote {len(domains)} domains with {sum(len(domain) for domain in domains)} cores to {args.dump}")
+        return 0
+    domains = load_topology(args.topology) if args.topology else sunspot_topology()
+    ccl_groups, cpu_bind_groups = affinity_groups(domains, args.packing, args.ranks_per_node, args.cores_per_rank)
+    for ccl_group, cpu_bind_group in zip(ccl_groups, cpu_bind_groups):
+        print(f"-env CCL_WORKER_AFFINITY {','.join(map(str, ccl_group))} --cpu-bind list:{':'.join(cpu_bind_group)}")
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
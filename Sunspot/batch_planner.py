@@ -0,0 +1 @@
+../Polaris/batch_planner.py
\ No newline at end of file
@@ -6,12 +6,19 @@ import multiprocessing
 from multiprocessing import Manager
 import pandas as pd
 import shutil
+from datetime import timedelta
 
 total_app_start = time.time()
 
 llama_site_name = "LlamaDemo"
 llama_site = Site.objects.get(llama_site_name)
-queried_llama_job_ids = []
+LLAMA_JOB_STATES = ["CREATED","STAGED_IN","PREPROCESSED","RUNNING","JOB_FINISHED","RESTART_READY"]
+ACTIVE_LLAMA_JOB_STATES = ["CREATED","STAGED_IN","PREPROCESSED","RUNNING","RUN_DONE","POSTPROCESSED","RESTART_READY"]
+DISCOVERY_INTERVAL = 30 # seconds between queries for new Llama jobs
+DISCOVERY_OVERLAP = timedelta(seconds=5) # re-query this much before the watermark to tolerate clock skew
+queried_llama_job_ids = set()
+last_job_update = None # watermark: newest last_update among the queried Llama jobs
+hedge_loser_dirs = set() # output directories of the jobs deleted by straggler_monitor.py after losing a hedge
 proteins_to_find = {}
 app_path = os.getcwd()
 proteins_file_path = os.path.join(app_path,"proteins.csv")
@@ -27,23 +34,47 @@ total_prot_count = 0
 
 output_path = '/home/alien/Documents/code/mount_remote_system/data' #change
 dot_file = '/home/alien/Documents/code/protein-graph-visualization-main/src/visg/static/data/interactions_full_run.dot' #change
+summary_path = os.path.join(output_path, '_summary') # deltas written on the site by summarize_job_outputs.py
 #proteins_to_find = {folder: next(protein_batches) for folder in folders}
 #output_path = '/Users/adityatanikanti/Codes/ten-iteration-per-protein/vLLMBashAppOutputFullten'
 #dot_file = 'interactions_full_run.dot'
 
 def proteins_to_process():
-    llama_jobs_ready_for_polling = Job.objects.filter(site_id=llama_site.id, 
-                                                    state=["CREATED","STAGED_IN","PREPROCESSED","RUNNING","JOB_FINISHED","RESTART_READY"])
-    for j in llama_jobs_ready_for_polling:
+    """
+    Return the output directories and proteins of the Llama jobs not seen before.
+    Only jobs created or changed since the watermark of the previous call are fetched.
+    The directories of the jobs that lost a hedge are added to hedge_loser_dirs.
+    """
+    global last_job_update
+    filters = {"site_id": llama_site.id, "state": LLAMA_JOB_STATES}
+    if last_job_update is not None:
+        filters["last_update_after"] = last_job_update - DISCOVERY_OVERLAP
+    new_proteins_to_find = {}
+    for j in Job.objects.filter(**filters):
+            if last_job_update is None or j.last_update > last_job_update:
+                last_job_update = j.last_update
+            if 'hedge_loser' in j.tags:
+                # Tagged on the winner, saving it moves its last_update past the watermark
+                hedge_loser_dirs.add(os.path.join(output_path, os.path.basename(j.tags['hedge_loser'])))
             if j.id not in queried_llama_job_ids:
+                queried_llama_job_ids.add(j.id)
+                if 'protein_list' not in j.get_parameters():
+                    continue # LlamaQueueApp jobs pull proteins from a queue; only the site summarizer sees them
                 print("Creating new polling job batch")
                 protein_list = j.get_parameters()['protein_list'].split(",")
                 directory = os.path.join(llama_site.path,
                                         "data",
                                         j.workdir)
                 new_dir = os.path.join(output_path,directory.split("/")[-1])
-                proteins_to_find[new_dir] = protein_list
-    return proteins_to_find
+                new_proteins_to_find[new_dir] = protein_list
+    proteins_to_find.update(new_proteins_to_find)
+    return new_proteins_to_find
+
+def llama_jobs_active():
+    """
+    Check whether any Llama job of the campaign can still produce output
+    """
+    return Job.objects.filter(site_id=llama_site.id, state=ACTIVE_LLAMA_JOB_STATES).count() > 0
 
 def move_current_dot_to_backup():
     directory_for_previous_iterations = os.path.dirname(dot_file)
@@ -109,15 +140,30 @@ def validate_and_generate_dot(protein1, protein2):
     # return (interaction, master_dot[edge]) 
     return new_content
 
-def find_interactions(directory, proteins, known_proteins, interactions_dict):
+def read_rotated_job_outputs(directory):
+    """
+    Read the job.out.N files kept by LlamaBashApp from the runs before a restart
+    """
+    content = ''
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('job.out.'):
+            with open(os.path.join(directory, filename), 'r') as file:
+                content += file.read()
+    return content
+
+def find_interactions(directory, proteins, known_proteins, interactions_dict, loser_dirs):
     (f"Checking directory: {directory}")  # Debugging 
     job_file = os.path.join(directory, 'job.out')
     proteins_to_find = set(proteins)  # Set of proteins to find interactions for.
     total_prot_count = 0
     while proteins_to_find:
+        if directory in loser_dirs:
+            # Deleted after losing a hedge, the directory of the winner has the remaining proteins
+            print(f"Stopped watching {directory}, its job lost a hedge")
+            return
         if os.path.exists(job_file):
             with open(job_file, 'r') as file:
-                content = file.read()
+                content = read_rotated_job_outputs(directory) + file.read()
                 proteins_found = set()  # Keep track of proteins found in this iteration.
                 for protein in proteins_to_find:
                     # print("Looking for protein:",protein)
@@ -173,23 +219,114 @@ def find_interactions(directory, proteins, known_proteins, interactions_dict):
 
         time.sleep(5)  # Wait for some time before checking again to reduce resource usage.
 
-def main():
-    # directories_with_proteins and known_proteins should be defined as before
+def read_latest_seq():
+    """
+    Read the sequence number of the newest delta published by the site, 0 if none yet
+    """
+    try:
+        with open(os.path.join(summary_path, 'LATEST'), 'r') as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
 
+def apply_deltas(last_seq, interactions_dict):
+    """
+    Fetch only the delta files published after last_seq and add their edges to the dot file.
+    Returns the newest applied sequence number and the proteins covered by the applied deltas.
+    """
+    latest_seq = read_latest_seq()
+    new_interactions = []
+    proteins_covered = set()
+    for seq in range(last_seq + 1, latest_seq + 1):
+        with open(os.path.join(summary_path, f'delta_{seq:08d}.tsv'), 'r') as file:
+            for line in file:
+                protein, known_protein = line.rstrip('\n').split('\t')
+                proteins_covered.add(protein)
+                if known_protein:
+                    interaction = validate_and_generate_dot(protein, known_protein)
+                else:
+                    interaction = f"{protein} -> {{}};\n"
+                if interaction not in interactions_dict:
+                    interactions_dict[interaction] = True
+                    new_interactions.append(interaction)
+    if new_interactions:
+        with open(dot_file, 'r') as file:
+            content = file.read()
+        if content and content[-1] == '}':
+            content = content[:-1] + ''.join(new_interactions) + '}'
+            print(f"Adding {len(new_interactions)} interactions to dot file from deltas {last_seq + 1}-{latest_seq}")
+            with open(dot_file, 'w') as file:
+                file.write(content)
+    return latest_seq, proteins_covered
+
+def follow_deltas():
+    """
+    Apply the site's deltas while discovering new Llama jobs, until every discovered
+    protein has been summarized and no Llama job is left running, or no Llama job is
+    left running and no delta was published for a discovery interval. The proteins of
+    failed jobs and hedge losers are never summarized, those are printed.
+    Returns the applied interactions.
+    """
+    interactions_dict = {}
+    expected_proteins = set()
+    summarized_proteins = set()
+    last_seq = 0
+    last_discovery = 0
+    last_delta_time = time.time()
+    while True:
+        if time.time() - last_discovery > DISCOVERY_INTERVAL:
+            for proteins in proteins_to_process().values():
+                expected_proteins.update(proteins)
+            last_discovery = time.time()
+        seq, proteins_covered = apply_deltas(last_seq, interactions_dict)
+        if seq != last_seq:
+            last_seq = seq
+            last_delta_time = time.time()
+        summarized_proteins |= proteins_covered
+        if expected_proteins <= summarized_proteins and not llama_jobs_active():
+            break
+        if time.time() - last_delta_time > DISCOVERY_INTERVAL and not llama_jobs_active():
+            never_summarized = sorted(expected_proteins - summarized_proteins)
+            print(f"No Llama job active and no new delta for {DISCOVERY_INTERVAL}s, "
+                  f"{len(never_summarized)} proteins never summarized: {', '.join(never_summarized)}")
+            break
+        time.sleep(5)  # Wait for the site to publish the next delta.
+    return interactions_dict
+
+def crawl_job_outputs():
+    """
+    Read the job.out files over the mount, handing every newly discovered job directory to a worker
+    """
     manager = Manager()
     interactions_dict = manager.dict() 
+    loser_dirs = manager.dict() # hedge_loser_dirs shared with the workers
     pool = multiprocessing.Pool(processes=multiprocessing.cpu_count())
-    proteins_to_find = proteins_to_process()
-    move_current_dot_to_backup()
-    for directory, proteins in proteins_to_find.items():
-        print(directory,">",proteins)
-        result=pool.apply_async(find_interactions, args=([directory, proteins, known_proteins, interactions_dict]))
+    results = []
+    while True:
+        new_proteins_to_find = proteins_to_process()
+        loser_dirs.update(dict.fromkeys(hedge_loser_dirs, True))
+        for directory, proteins in new_proteins_to_find.items():
+            print(directory,">",proteins)
+            results.append(pool.apply_async(find_interactions, args=([directory, proteins, known_proteins, interactions_dict, loser_dirs])))
+        if all(result.ready() for result in results) and not llama_jobs_active():
+            break
+        time.sleep(DISCOVERY_INTERVAL)
+    for result in results:
         result.get()
     pool.close()
     pool.join()
+
+def main():
+    # directories_with_proteins and known_proteins should be defined as before
+
+    move_current_dot_to_backup()
+    if os.path.exists(os.path.join(summary_path, 'LATEST')):
+        # The site runs summarize_job_outputs.py, so only fetch the deltas
+        follow_deltas()
+    else:
+        crawl_job_outputs()
     print(f"Total time to finish processing {time.time() - total_app_start:.3f} secs")
 
 if __name__ == "__main__":
     main()
 
-
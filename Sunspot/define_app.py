@@ -6,65 +6,65 @@ site_name = "LlamaDemo"
 
 class LlamaBashApp(ApplicationDefinition):
     site = site_name
-    def flatten(self, lst):
-        """
-        Recursively flatten a nested list.
-        """
-        flat_list = []
-        for item in lst:
-            if isinstance(item, list):
-                flat_list.extend(self.flatten(item))
-            else:
-                flat_list.append(item)
-        return flat_list
-
-    def nested_lists_to_string(self,nested_list):
+    manifest_file = 'completed_proteins.txt'
+
+    def completed_proteins(self):
         """
-        Convert a nested list into a single string with spaces between items.
+        Proteins with a complete ** START X ** .. ** END X ** section in job.out or in the
+        job.out.N files of previous runs, plus those recorded in the completion manifest
         """
-        flat_list = self.flatten(nested_list)
-        return ' '.join(map(str, flat_list))
-    
-    def fetch_between_markers(self, lines, protein):
+        completed = set()
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'r') as f:
+                completed.update(line.strip() for line in f if line.strip())
+        for filename in os.listdir('.'):
+            if filename == 'job.out' or filename.startswith('job.out.'):
+                with open(filename, 'r', encoding='utf8', errors='ignore') as f:
+                    content = f.read()
+                completed.update(re.findall(r'\*\* START (\S+) \*\*.*?\*\* END \1 \*\*', content, re.DOTALL))
+        return completed
+
+    def write_manifest(self, completed):
         """
-        Look for protein between start and end
+        Record the completed proteins in the job's workdir
         """
-        pattern = r"\*\* START " + protein + r" \*\*(.*?)\*\* END " + protein + r" \*\*"
-        matches = re.findall(pattern, lines, re.DOTALL)
-        if matches:
-            return protein
-        return None
-
-    
-    def read_output_log(self,protein):
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            f.write(''.join(protein + '\n' for protein in sorted(completed)))
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+
+    def rotate_job_output(self):
         """
-        Read output log file from protein directory
+        Keep the output of this run as job.out.N, since the restarted run writes a new job.out
         """
-        with open('./job.out',"r") as f:
-            lines = f.readlines()
-            lines = self.nested_lists_to_string(lines)
-            found_protein = self.fetch_between_markers(lines, protein)
-        return found_protein
-            
+        if os.path.exists('./job.out'):
+            n = 1
+            while os.path.exists(f'./job.out.{n}'):
+                n += 1
+            os.rename('./job.out', f'./job.out.{n}')
 
     def return_job_data(self):
         """
-        Captures output and returns to job data
+        Captures output and returns to job data.
+        Restarts the job with only the proteins whose sections are still missing.
         """
         #targets = self.job.tags['target']
-        protein_list = self.job.get_parameters()['protein_list'].split(",")
-        if protein_list:
-            found_proteins_list = []
-            for prot in protein_list:
-                found_protein = self.read_output_log(prot)
-                if found_protein:
-                    found_proteins_list.append(found_protein)
-            if len(found_proteins_list) == len(protein_list):
-                self.job.state = "JOB_FINISHED"
-                self.job.save()
-        self.job.state = "RESTART_READY"
+        parameters = self.job.get_parameters()
+        protein_list = [prot for prot in parameters['protein_list'].split(",") if prot]
+        completed = self.completed_proteins()
+        self.write_manifest(completed)
+        missing_proteins = [prot for prot in protein_list if prot not in completed]
+        if missing_proteins:
+            print(f"Restarting with the {len(missing_proteins)} of {len(protein_list)} proteins still missing")
+            self.rotate_job_output()
+            self.job.parameters = {**parameters, 'protein_list': ','.join(missing_proteins)}
+            self.job.state = "RESTART_READY"
+        else:
+            self.job.state = "POSTPROCESSED"
         self.job.save()
 
+    def postprocess(self):
+        self.return_job_data()
+
     def handle_error(self):
         print("Starting Handle Error block")
         self.return_job_data()
@@ -80,5 +80,21 @@ class LlamaBashApp(ApplicationDefinition):
     -m /gila/Aurora_deployment/llama-2-hf/Llama-2-70b-chat-hf \
     --benchmark --num-iter 1 --num-warmup 1 --ipex --input-tokens=1024 --max-new-tokens=1024 --prompt {{prompt}} --protein-list {{protein_list}} && sleep 5"
 
+
+class LlamaQueueApp(ApplicationDefinition):
+    """
+    One job per node slot; every job pulls proteins from the shared protein_queue.py queue until it is drained.
+    """
+    site = site_name
+
+    def shell_preamble(self):
+        return f'source /soft/datascience/conda-2023-01-31/miniconda3/bin/activate && conda activate /gila/Aurora_deployment/conda_env_llm/balsam_llama_env && source /gila/Aurora_deployment/70B-acc_fix_for_ppi/set_application_env.sh'
+
+    command_template = "-env CCL_WORKER_AFFINITY {{CCL_GROUP}} -env MASTER_PORT {{MASTER_PORT}} --cpu-bind list:{{CPU_BIND_GROUP}} python3 -u /gila/Aurora_deployment/70B-acc_fix_for_ppi/queue_generation.py --queue-dir {{queue_dir}} -- \
+    python3 -u /gila/Aurora_deployment/70B-acc_fix_for_ppi/intel-extension-for-transformers/examples/huggingface/pytorch/text-generation/inference/run_generation_with_deepspeed.py \
+    -m /gila/Aurora_deployment/llama-2-hf/Llama-2-70b-chat-hf \
+    --benchmark --num-iter 1 --num-warmup 1 --ipex --input-tokens=1024 --max-new-tokens=1024 --prompt {{prompt}} && sleep 5"
+
 LlamaBashApp.sync()
+LlamaQueueApp.sync()
 
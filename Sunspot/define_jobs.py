@@ -3,25 +3,33 @@ from balsam.api import Job, Site, BatchJob
 import os
 import pandas as pd
 import time
+from batch_planner import ProteinCostModel, plan_batches
+from job_scheduler import new_schedule_id, schedule_lpt, schedule_tags
+from protein_queue import ProteinQueue
+from job_submitter import StreamingSubmitter
+from affinity import affinity_groups, load_topology, sunspot_topology
 
 total_app_start = time.time()
 
 site_name = "LlamaDemo"
 app_path = os.getcwd()
 proteins_file_path = os.path.join(app_path,"proteins.csv")
+HISTORY_PATH = None # stats CSV or job output directory of a previous run; None keeps fixed batches of 100 proteins
+TARGET_JOB_SECONDS = 60*60 # estimated time each planned job should take, within the 80 minute wall time
+MODEL_INIT_SECONDS = 10*60 # model initialisation paid once by every job
+NUM_NODES = 3 #CHANGE THIS to the num_nodes of the BatchJob
+NODE_PACKING_COUNT = 1 #change this to set number of jobs in parallel on same node; set to 3 once fixed
+QUEUE_DIR = None #CHANGE THIS to a directory shared by the compute nodes to pull proteins from a work-stealing queue
+QUEUE_UNIT_SIZE = 50 # proteins claimed at a time; the model is reloaded for every unit
+SUBMIT_WINDOW = None # maximum jobs in flight, the next batches are submitted as jobs finish; None creates every job up front
+CURSOR_FILE = os.path.join(app_path,"submit_cursor.json") # a streaming submission resumes from here
 
-# Split the values into groups
-CCL_WORKER_GROUPS = [
-    [1, 9, 17, 25],
-    [33, 41, 53, 61],
-    [69, 77, 85, 93]
-]
+RANKS_PER_NODE = 4
+TOPOLOGY_FILE = None # node topology from `python3 affinity.py --dump node_topology.json` on a compute node; None uses the Sunspot layout
 
-CPU_BIND_GROUPS = [
-    ["2-4", "106-108:10-12", "114-116:18-20", "122-124:26-28", "130-132"],
-    ["34-36", "138-140:42-44", "146-148:54-56", "158-160:62-64", "166-168"],
-    ["70-72", "174-176:78-80", "182-184:86-88", "190-192:94-96", "198-200"]
-]
+# Non-overlapping CCL worker cores and per-rank cpu-bind lists for each of the jobs packed on a node
+CCL_WORKER_GROUPS, CPU_BIND_GROUPS = affinity_groups(load_topology(TOPOLOGY_FILE) if TOPOLOGY_FILE else sunspot_topology(),
+                                                     NODE_PACKING_COUNT, RANKS_PER_NODE)
 
 
 class JobDefine():
@@ -29,55 +37,98 @@ class JobDefine():
         self.prompt = f"You are playing the role of a helpful assistant. We are interested in protein interactions.  Based on the documents you have been trained with, can you provide any information on which proteins might interact with"
     
 
-    def get_word_batches(self, df, batch_size=5):
+    def get_word_batches(self, df, batch_size=5, cost_model=None):
         """
         Yield batches of words from the dataframe as comma-separated strings along with cyclic permutations of CCL_WORKER_AFFINITY and cpu-bind values.
+        Batches are yielded longest first, as scheduled by schedule_lpt over NUM_NODES*NODE_PACKING_COUNT slots.
 
         Parameters:
         - df: DataFrame containing the words.
         - column_name: Name of the column containing the words.
         - batch_size: Size of each batch (default: 5).
+        - cost_model: Optional ProteinCostModel; when given, batches are sized to TARGET_JOB_SECONDS instead of batch_size.
 
         Returns:
-        - Iterator yielding the batch index, comma-separated word batches, CCL_WORKER_AFFINITY, and cpu-bind values.
+        - Iterator yielding the batch index, comma-separated word batches, CCL_WORKER_AFFINITY, cpu-bind values, estimated seconds and slot.
         """
         total_rows = df.shape[0]
         group_len = len(CCL_WORKER_GROUPS)
+        if cost_model is not None:
+            batches = [batch for batch, estimated_seconds in plan_batches(df['search_words'].tolist(), cost_model, TARGET_JOB_SECONDS, MODEL_INIT_SECONDS)]
+        else:
+            cost_model = ProteinCostModel(prompt=self.prompt)
+            batches = [df.iloc[start:start + batch_size]['search_words'].tolist() for start in range(0, total_rows, batch_size)]
+        scheduled, self.predicted_makespan = schedule_lpt([(batch, cost_model.estimate_batch(batch, MODEL_INIT_SECONDS)) for batch in batches],
+                                                          NUM_NODES*NODE_PACKING_COUNT)
         
-        for index, start in enumerate(range(0, total_rows, batch_size)):
-            end = start + batch_size
-            batch = df.iloc[start:end]['search_words'].tolist()
-            
+        for index, (batch, estimated_seconds, slot) in enumerate(scheduled):
             ccl_group = CCL_WORKER_GROUPS[index % group_len]
             cpu_bind_group = CPU_BIND_GROUPS[index % group_len]
             
-            yield index, ','.join(batch), ccl_group, cpu_bind_group
+            yield index, ','.join(batch), ccl_group, cpu_bind_group, estimated_seconds, slot
+
+    def define_queue_jobs(self, df):
+        """
+        Queue all the proteins and create one job per node slot; each job claims
+        units from the queue until it is drained, so the load balances itself across nodes.
+        """
+        num_units = ProteinQueue(QUEUE_DIR).create(df['search_words'].tolist(), QUEUE_UNIT_SIZE)
+        print(f"Queued {df.shape[0]} proteins in {num_units} units in {QUEUE_DIR}")
+        group_len = len(CCL_WORKER_GROUPS)
+        jobs = [Job(app_id="LlamaQueueApp",
+            site_name=site_name,
+            workdir=f'LlamaBashAppOutput/queue_{n}',
+            parameters={"prompt": f"'{self.prompt}'", "MASTER_PORT": 29600+n, "queue_dir":QUEUE_DIR, "CCL_GROUP":','.join(map(str, CCL_WORKER_GROUPS[n % group_len])), "CPU_BIND_GROUP":':'.join(CPU_BIND_GROUPS[n % group_len])},
+            num_nodes=1,
+            ranks_per_node=RANKS_PER_NODE,
+            gpus_per_rank=1,
+            tags={"queue":QUEUE_DIR,"run":"demo"},
+            node_packing_count = NODE_PACKING_COUNT
+        )for n in range(NUM_NODES*NODE_PACKING_COUNT)]
+        return Job.objects.bulk_create(jobs)
 
     def define_job(self):
         df = pd.read_csv(proteins_file_path)
         # df.drop(0, inplace=True)
         df = df.loc[0:299] #change this to run all; comment it out to run everything
-        jobs = [Job(app_id="LlamaBashApp",
+        if QUEUE_DIR:
+            return self.define_queue_jobs(df)
+        cost_model = ProteinCostModel.from_history(HISTORY_PATH, self.prompt) if HISTORY_PATH else None
+        batches = list(self.get_word_batches(df,100,cost_model)) #Runs in batches of 100 proteins
+        self.schedule_id = new_schedule_id()
+        if SUBMIT_WINDOW:
+            submitter = StreamingSubmitter(self.make_job, batches, SUBMIT_WINDOW, CURSOR_FILE)
+            # A resumed submission keeps the schedule id of its plan
+            self.schedule_id = submitter.plan_digest[:12]
+        print(f"Schedule {self.schedule_id}: {len(batches)} jobs, predicted makespan {self.predicted_makespan/60:.1f} min")
+        print(f"Compare with the achieved makespan later: python3 job_scheduler.py --site {site_name} --schedule {self.schedule_id}")
+        if SUBMIT_WINDOW:
+            return submitter.run()
+        jobs = [self.make_job(n, item) for n, item in enumerate(batches)]
+        #for n,word in enumerate(df['search_words'])]
+        jobs = Job.objects.bulk_create(jobs)
+        return jobs
+
+    def make_job(self, n, item):
+        n, batch, ccl, cpu_bind, est_sec, slot = item
+        return Job(app_id="LlamaBashApp",
             site_name=site_name,
             workdir=f'LlamaBashAppOutput/{n}',
-            parameters={"prompt": f"'{self.prompt}'", "MASTER_PORT": 29600+n, "protein_list":batch, "CCL_GROUP":','.join(map(str, ccl)), "CPU_BIND_GROUP":','.join(cpu_bind)},
+            parameters={"prompt": f"'{self.prompt}'", "MASTER_PORT": 29600+n, "protein_list":batch, "CCL_GROUP":','.join(map(str, ccl)), "CPU_BIND_GROUP":':'.join(cpu_bind)},
             num_nodes=1,
-            ranks_per_node=4,
+            ranks_per_node=RANKS_PER_NODE,
             gpus_per_rank=1,
             wall_time_min=80,
-            tags={"target":batch,"run":"demo"},
-            node_packing_count = 1 #change this to set number of jobs in parallel on same node; set to 3 once fixed
-        )for n, batch, ccl, cpu_bind in self.get_word_batches(df,100)] #Runs in batches of 100 proteins
-        #for n,word in enumerate(df['search_words'])]
-        jobs = Job.objects.bulk_create(jobs)
-        return jobs
+            tags={"target":batch,"run":"demo",**schedule_tags(self.schedule_id, est_sec, slot)},
+            node_packing_count = NODE_PACKING_COUNT
+        )
 
 jobdefine = JobDefine()
 jobs = jobdefine.define_job()
 site = Site.objects.get(site_name)
 #BatchJob.objects.create(
 #    site_id=site.id,
-#    num_nodes=3,
+#    num_nodes=NUM_NODES,
 #    wall_time_min=120,
 #    job_mode="mpi",
 #    project="Aurora_deployment",
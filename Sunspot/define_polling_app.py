@@ -1,4 +1,5 @@
 from balsam.api import ApplicationDefinition, BatchJob, Job, Site
+import hashlib
 import os
 import time
 import pandas as pd
@@ -26,83 +27,104 @@ if not os.path.exists(dot_file_path):
         file.write('digraph G {\n}')
 
 
+POLL_BATCH_SIZE = 100 # proteins handled by a single polling job
+MAX_POLL_RETRIES = 3 # resubmissions for proteins still missing after a polling job times out
+
+
 class BatchPollingApp(ApplicationDefinition):
     site = "BatchPollingApp"
-    def flatten(self, lst):
-        """
-        Recursively flatten a nested list.
-        """
-        flat_list = []
-        for item in lst:
-            if isinstance(item, list):
-                flat_list.extend(self.flatten(item))
-            else:
-                flat_list.append(item)
-        return flat_list
-
-    def nested_lists_to_string(self,nested_list):
+
+    def index_sections(self, directory, proteins):
         """
-        Convert a nested list into a single string with spaces between items.
+        Walk the directory once and index the ** START {protein} ** .. ** END {protein} ** section of every requested protein.
+        Each section spans the first START to the last END marker of the protein within a file.
         """
-        flat_list = self.flatten(nested_list)
-        return ' '.join(map(str, flat_list))
+        wanted = set(proteins)
+        sections = {}
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                with open(filepath, 'r',encoding='utf8', errors='ignore') as f:
+                    content = f.read()
+                if '** START ' not in content:
+                    continue
+                starts = {}
+                ends = {}
+                for marker in re.finditer(r'\*\* (START|END) (\S+) \*\*', content):
+                    kind, protein = marker.groups()
+                    if protein not in wanted or protein in sections:
+                        continue
+                    if kind == 'START':
+                        starts.setdefault(protein, marker.start())
+                    else:
+                        ends[protein] = marker.end()
+                for protein, start in starts.items():
+                    end = ends.get(protein, -1)
+                    if end > start:
+                        sections[protein] = content[start:end]
+        return sections
     
     def handle_error(self):
         self.job.state = "RESTART_READY"
         self.job.save()
 
-    def run(self, directory, protein, timeout=20*60):
+    def run(self, directory, proteins, proteins_file, timeout=20*60, poll_interval=30):
         """
-            Monitors and extracts content between ** START {pattern} ** and ** END {pattern} ** from all files in a directory.
+            Monitors and extracts content between ** START {protein} ** and ** END {protein} ** for a batch of proteins,
+            and reduces each section to the known proteins it mentions before returning.
             Parameters:
                 directory (str): The path of the directory to monitor and search in.
-                pattern (str): The pattern to search between.
-                timeout (int, optional): Time in seconds to monitor the directory. Defaults to 15*60 seconds (15 minutes).
+                proteins (list or str): The proteins to search for, as a list or a comma-separated string.
+                proteins_file (str): The path of proteins.csv on the site, listing the known proteins.
+                timeout (int, optional): Time in seconds to monitor the directory. Defaults to 20*60 seconds (20 minutes).
+                poll_interval (int, optional): Seconds to wait between indexing passes. Defaults to 30 seconds.
             Returns:
-                list: A list of strings, where each string is the content between ** START {pattern} ** and ** END {pattern} **.
-                    Returns an empty list if the pattern is not found within the timeout.
+                dict: 'interactions' maps each found protein to the list of proteins it interacts with,
+                    'digests' maps each found protein to the SHA-1 of its section and
+                    'missing' lists the proteins not found within the timeout, to be retried by the client.
         """
-        print("Polling at", directory, protein, timeout)
+        if isinstance(proteins, str):
+            proteins = proteins.split(",")
+        print("Polling at", directory, len(proteins), "proteins", timeout)
         end_time = time.time() + timeout
-        #result = {'interacting_proteins':None,
-        # #           'output_logs':None}
-        results = []
-        # while time.time() < end_time:
-        #     # Walk through the directory
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                with open(filepath, 'r',encoding='utf8', errors='ignore') as f:
-                    lines = f.readlines()
-                    #lines = self.fetch_between_markers(lines, protein)
-                    lines = self.nested_lists_to_string(lines)
-                    pattern = r'\*\* START ' + re.escape(protein) + r' \*\*.*\*\* END ' + re.escape(protein) + r' \*\*'
-                    match = re.search(pattern, lines, re.DOTALL)
-                    #match = re.search(r'START.*END', lines, re.DOTALL)
-                    if match:
-                        between_markers = match.group()
-                        print("between markers>>",between_markers)
-                        if len(between_markers)>0:
-                            results = between_markers
-                            #results = unicode(results, errors='ignore')
-                            return results.encode('utf-8')
-        self.job.state = "RUN_ERROR"
-        self.job.save()                                          
-                #results.append(filepath)
-        return results
+        sections = {}
+        missing = list(proteins)
+        while missing:
+            sections.update(self.index_sections(directory, missing))
+            missing = [protein for protein in proteins if protein not in sections]
+            if not missing or time.time() + poll_interval > end_time:
+                break
+            time.sleep(poll_interval)
+        print(f"Found {len(sections)} of {len(proteins)} proteins, {len(missing)} missing")
+        # Imported on the site, protein_matching.py has to be on its PYTHONPATH
+        from protein_matching import find_partners, load_protein_index
+        positions, regex_proteins = load_protein_index(proteins_file)
+        interactions = {}
+        digests = {}
+        for protein, section in sections.items():
+            interactions[protein] = find_partners(protein, section, positions, regex_proteins)
+            digests[protein] = hashlib.sha1(section.encode('utf-8')).hexdigest()
+        return {'interactions': interactions, 'digests': digests, 'missing': missing}
+
+def submit_polling_jobs(proteins, attempt=0):
+    """
+    Submit one polling job per batch of POLL_BATCH_SIZE proteins.
+    """
+    return [
+        BatchPollingApp.submit(
+            workdir=f'BatchPollingAppOutput/attempt_{attempt}/{n}',
+            directory="/gila/Aurora_deployment/atanikanti/LLM_service/balsam_service_ppi_llm_70B/balsam-llama-sunspot-site/data/LlamaBashAppOutput", #CHANGE THIS
+            proteins = proteins[start:start + POLL_BATCH_SIZE],
+            proteins_file="/gila/Aurora_deployment/atanikanti/LLM_service/balsam_service_ppi_llm_70B/proteins.csv", #CHANGE THIS
+            timeout=60,
+            tags={"batch":str(n), "attempt":str(attempt)},
+        )
+        for n, start in enumerate(range(0, len(proteins), POLL_BATCH_SIZE))
+    ]
 
 BatchPollingApp.sync()
 df = pd.read_csv(proteins_file_path)
-jobs = [
-    BatchPollingApp.submit(
-        workdir=f'BatchPollingAppOutput/{protein}',
-        directory="/gila/Aurora_deployment/atanikanti/LLM_service/balsam_service_ppi_llm_70B/balsam-llama-sunspot-site/data/LlamaBashAppOutput", #CHANGE THIS
-        protein = protein,
-        timeout=60,
-        tags={"target":protein},
-    )
-    for n,protein in enumerate(df['search_words'].loc[0:999])
-]
+jobs = submit_polling_jobs(df['search_words'].loc[0:999].tolist())
 
 
 
@@ -171,28 +193,10 @@ def validate_and_generate_dot(protein1, protein2, edge):
         with open(dot_file_path, 'w') as file:
             file.write(new_content)
 
-def find_filtered_proteins(protein,output):
+def record_interactions(protein, filtered_proteins):
     """
-    Finds all the proteins that interact with target
+    Append the interactions found for a protein on the site to interactions.txt and the dot file
     """
-    filtered_proteins = []
-
-    # Loop through the words in the DataFrame
-    if output:
-        for word in df['search_words']:
-            if protein != word:
-                word_match = re.search(r'\b' + re.escape(word) + r'\b', output)
-                if word_match:
-                    filtered_proteins.append(word)
-    return filtered_proteins
-
-job_start_time = time.time()
-count_prots = 0
-for job in Job.objects.as_completed(jobs):
-    protein = job.tags['target']
-    output = job.result()
-    output = output.decode('utf-8')
-    filtered_proteins = find_filtered_proteins(protein,output)
     with open("interactions.txt", "a") as f:
         if filtered_proteins:
             for prot in filtered_proteins:
@@ -207,9 +211,32 @@ for job in Job.objects.as_completed(jobs):
               data = f"{edge}\n"
               f.write(data)
               f.flush()  # Force writing the data to the file immediately
-    print(f"Total time for {protein} to finish processing {time.time() - job_start_time:.3f} secs")
-    job_start_time = time.time()
-    count_prots = count_prots + 1
-print(f"Total time for a total of {count_prots} proteins to finish processing {time.time() - total_app_start:.3f} secs")
-    
 
+job_start_time = time.time()
+count_prots = 0
+attempt = 0
+recorded_digests = {}
+while jobs:
+    retry_proteins = []
+    for job in Job.objects.as_completed(jobs):
+        result = job.result()
+        for protein, filtered_proteins in result['interactions'].items():
+            # Skip sections already recorded with identical content
+            if recorded_digests.get(protein) == result['digests'][protein]:
+                continue
+            recorded_digests[protein] = result['digests'][protein]
+            record_interactions(protein, filtered_proteins)
+            count_prots = count_prots + 1
+        retry_proteins.extend(result['missing'])
+        print(f"Total time for batch {job.tags['batch']} (attempt {job.tags['attempt']}) with {len(result['interactions'])} proteins to finish processing {time.time() - job_start_time:.3f} secs")
+        job_start_time = time.time()
+    attempt = attempt + 1
+    jobs = []
+    if retry_proteins and attempt <= MAX_POLL_RETRIES:
+        print(f"Retrying {len(retry_proteins)} missing proteins, attempt {attempt}")
+        jobs = submit_polling_jobs(retry_proteins, attempt)
+    else:
+        for protein in retry_proteins:
+            print(f"No output found for {protein}")
+            record_interactions(protein, [])
+print(f"Total time for a total of {count_prots} proteins to finish processing {time.time() - total_app_start:.3f} secs")
@@ -0,0 +1 @@
+../Polaris/job_scheduler.py
\ No newline at end of file
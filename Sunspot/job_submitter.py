@@ -0,0 +1 @@
+../Polaris/job_submitter.py
\ No newline at end of file
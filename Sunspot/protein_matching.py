@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Matching of the known proteins in the LLM answers, shared by the site-side
+summarize_job_outputs.py and the BatchPollingApp of define_polling_app.py.
+
+A known protein is mentioned when it appears as a whole word, as a
+\\b-delimited regex would find it. Names made only of word characters joined
+by '-' or '.' are matched by looking up the tokens of the answer, so the
+answer is scanned once instead of once per known protein. The other names
+fall back to a regex.
+"""
+
+import csv
+import re
+
+TOKEN_PATTERN = re.compile(r'\w+(?:[-.]\w+)*')
+
+
+def load_protein_index(proteins_csv_path):
+    """
+    Index the known proteins of proteins.csv.
+    Returns ({name: position} of the token-matched names, [(position, name)] of the regex-matched ones),
+    the position being the row of the name in proteins.csv.
+    """
+    with open(proteins_csv_path, 'r') as f:
+        known_proteins = [row['search_words'].strip() for row in csv.DictReader(f) if row['search_words'].strip()]
+    positions = {}
+    regex_proteins = []
+    for position, word in enumerate(known_proteins):
+        if TOKEN_PATTERN.fullmatch(word):
+            positions.setdefault(word, position)
+        else:
+            regex_proteins.append((position, word))
+    return positions, regex_proteins
+
+
+def find_partners(protein, text, positions, regex_proteins):
+    """
+    Return the known proteins mentioned in text as whole words, excluding the protein itself,
+    in the order of proteins.csv.
+    """
+    found = set()
+    for token in TOKEN_PATTERN.finditer(text):
+        parts = re.split(r'([-.])', token.group())
+        # Any run of consecutive words in a token, with its separators, is \b-delimited
+        for first in range(0, len(parts), 2):
+            for last in range(first, len(parts), 2):
+                candidate = ''.join(parts[first:last + 1])
+                if candidate in positions:
+                    found.add((positions[candidate], candidate))
+    for position, word in regex_proteins:
+        if re.search(r'\b' + re.escape(word) + r'\b', text):
+            found.add((position, word))
+    return [word for position, word in sorted(found) if word != protein]
@@ -0,0 +1 @@
+../Polaris/protein_queue.py
\ No newline at end of file
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Run the Sunspot generation command on work units pulled from a protein_queue.py queue.
+
+Launched on every rank of a LlamaQueueApp job, in place of the generation command:
+    python3 -u queue_generation.py --queue-dir /path/to/queue -- python3 -u run_generation_with_deepspeed.py ... --prompt '...'
+
+All the ranks of a job must generate the same proteins, so rank 0 claims each unit
+and hands it to the other ranks through numbered assignment files in the job's
+working directory. Every rank then runs the generation command with the unit as
+--protein-list. An empty assignment means the queue is drained. Rank 0 renews the
+lease on the unit while the command runs and completes the unit once it succeeds.
+
+The generation script loads the model on every run, so units should be much
+larger here than on Polaris, where vllm_batch.py pulls units in-process.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from protein_queue import ProteinQueue
+
+ASSIGN_DIR = 'queue_assign'
+LAUNCH_SKEW = 60  # assignment files older than the launch are left over from a previous run of the job
+POLL_INTERVAL = 5
+
+
+def rank_id():
+    return int(os.environ.get('PMI_RANK', os.environ.get('PALS_RANKID', 0)))
+
+
+def assignment_file(seq):
+    return os.path.join(ASSIGN_DIR, f'{seq:05d}')
+
+
+def publish_assignment(seq, unit, proteins):
+    tmp_path = assignment_file(seq) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(''.join(line + '\n' for line in ([unit] + proteins if unit else [])))
+    os.replace(tmp_path, assignment_file(seq))
+
+
+def wait_for_assignment(seq, launch_time):
+    """Wait for rank 0 to publish the seq-th unit. Returns (unit, proteins), with unit None once drained."""
+    path = assignment_file(seq)
+    while True:
+        try:
+            if os.path.getmtime(path) >= launch_time - LAUNCH_SKEW:
+                with open(path, 'r') as f:
+                    lines = [line.strip() for line in f if line.strip()]
+                return (lines[0], lines[1:]) if lines else (None, [])
+        except FileNotFoundError:
+            pass
+        time.sleep(POLL_INTERVAL)
+
+
+def main():
+    launch_time = time.time()
+    parser = argparse.ArgumentParser(description='Run the generation command on units of a work-stealing protein queue')
+    parser.add_argument('--queue-dir', required=True, help='Queue directory created by protein_queue.py')
+    parser.add_argument('--owner', default=None, help='Name of this job in the queue (default: host and MASTER_PORT)')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='Generation command, after --')
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+
+    queue = ProteinQueue(args.queue_dir)
+    owner = args.owner or f"{socket.gethostname()}-{os.environ.get('MASTER_PORT', os.getppid())}"
+    rank = rank_id()
+    if rank == 0:
+        os.makedirs(ASSIGN_DIR, exist_ok=True)
+        for name in os.listdir(ASSIGN_DIR):
+            os.remove(os.path.join(ASSIGN_DIR, name))
+        units = queue.units(owner)
+
+    seq = 0
+    while True:
+        if rank == 0:
+            unit, proteins = next(units, (None, []))
+            publish_assignment(seq, unit, proteins)
+        else:
+            unit, proteins = wait_for_assignment(seq, launch_time)
+        if unit is None:
+            break
+        print(f"Rank {rank}: generating {unit} with {len(proteins)} proteins", flush=True)
+        if rank == 0:
+            with queue.leased(unit, owner):
+                returncode = subprocess.call(command + ['--protein-list', ','.join(proteins)])
+        else:
+            returncode = subprocess.call(command + ['--protein-list', ','.join(proteins)])
+        if returncode != 0:
+            # The unit stays claimed; it is requeued for another job once its lease expires
+            print(f"Rank {rank}: generation of {unit} failed with exit code {returncode}", flush=True)
+            return returncode
+        if rank == 0 and not queue.complete(unit, owner):
+            print(f"Lease on {unit} expired before it completed; it was requeued", flush=True)
+        seq += 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
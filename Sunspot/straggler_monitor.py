@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Straggler detection and hedged re-execution for the LlamaBashApp jobs.
+
+Run it on Sunspot next to the Balsam site while the jobs run. It follows the
+progress of every running job from the ** END X ** markers in its job.out. A
+job is a straggler when, past the model initialisation, it completes proteins
+much slower than the median job, or it will not finish within its wall time
+at its current rate. Once the BatchJob has a slot that no waiting job will
+take, a hedge job is created for only the proteins the straggler has not
+finished yet. Whichever of the two finishes those proteins first wins and the
+other one is deleted. The winner is tagged with the workdir of the loser
+(hedge_loser), so that build_dot_file.py stops watching the deleted job.
+"""
+
+import argparse
+import os
+import re
+import statistics
+import time
+from datetime import datetime, timezone
+from balsam.api import Job, Site, EventLog
+
+site_name = "LlamaDemo"
+END_PATTERN = re.compile(rb'\*\* END (\S+) \*\*')
+WAITING_STATES = ["CREATED", "AWAITING_PARENTS", "READY", "STAGED_IN", "PREPROCESSED", "RESTART_READY"]
+MODEL_INIT_SECONDS = 10*60 # no progress is expected while the model loads
+SLOW_FACTOR = 0.5 # slower than this fraction of the median rate is a straggler
+HEDGE_PORT_OFFSET = 1000 # hedges use MASTER_PORT + offset so they never clash with the original
+
+
+def seconds_since(timestamp):
+    now = datetime.now(timezone.utc) if timestamp.tzinfo else datetime.now()
+    return (now - timestamp).total_seconds()
+
+
+class StragglerMonitor:
+    def __init__(self, site_name, num_slots, data_path=None, app_id="LlamaBashApp", dry_run=False):
+        self.site = Site.objects.get(site_name)
+        self.data_path = data_path or os.path.join(self.site.path, "data")
+        self.num_slots = num_slots
+        self.app_id = app_id
+        self.dry_run = dry_run
+        self.offsets = {}  # job.out path -> bytes read
+        self.finished = {}  # job.out path -> proteins with an END marker
+        self.hedges = {}  # original job id -> hedge job
+
+    def finished_proteins(self, job):
+        """Read the END markers appended to the job.out of a job since the last poll."""
+        path = os.path.join(self.data_path, str(job.workdir), "job.out")
+        finished = self.finished.setdefault(path, set())
+        try:
+            if os.path.getsize(path) < self.offsets.get(path, 0):
+                # job.out was rotated by a restart, the proteins finished before stay counted
+                self.offsets[path] = 0
+            with open(path, "rb") as f:
+                f.seek(self.offsets.get(path, 0))
+                content = f.read()
+        except FileNotFoundError:
+            return finished
+        # Only consume up to the last complete line, a marker may still be half written
+        consumed = content.rfind(b"\n") + 1
+        finished.update(match.group(1).decode("utf-8", errors="ignore") for match in END_PATTERN.finditer(content[:consumed]))
+        self.offsets[path] = self.offsets.get(path, 0) + consumed
+        return finished
+
+    def protein_list(self, job):
+        return [protein for protein in job.get_parameters()["protein_list"].split(",") if protein]
+
+    def running_jobs(self):
+        """Return the running jobs of the app with the seconds since they started running."""
+        jobs = list(Job.objects.filter(site_id=self.site.id, app_id=self.app_id, state="RUNNING"))
+        started = {}
+        if jobs:
+            for event in EventLog.objects.filter(job_id=[job.id for job in jobs], to_state="RUNNING"):
+                started[event.job_id] = event.timestamp  # the events come oldest first, keep the latest start
+        return [(job, seconds_since(started[job.id])) for job in jobs if job.id in started]
+
+    def find_stragglers(self, running):
+        """Return the running original jobs that are stragglers, with their remaining proteins."""
+        progress = []
+        for job, elapsed in running:
+            if "hedge_of" in job.tags or job.id in self.hedges or elapsed < MODEL_INIT_SECONDS:
+                continue
+            proteins = self.protein_list(job)
+            remaining = [protein for protein in proteins if protein not in self.finished_proteins(job)]
+            rate = (len(proteins) - len(remaining)) / (elapsed - MODEL_INIT_SECONDS + 1)
+            progress.append((job, elapsed, remaining, rate))
+        if not progress:
+            return []
+        median_rate = statistics.median(rate for job, elapsed, remaining, rate in progress)
+        stragglers = []
+        for job, elapsed, remaining, rate in progress:
+            if not remaining:
+                continue
+            wall_seconds = (job.wall_time_min or 0) * 60
+            too_slow = rate < SLOW_FACTOR * median_rate
+            late = wall_seconds and (rate == 0 or elapsed + len(remaining) / rate > wall_seconds)
+            if too_slow or late:
+                print(f"Job {job.id} is straggling: {rate * 60:.2f} proteins/min (median {median_rate * 60:.2f}), "
+                      f"{len(remaining)} proteins left")
+                stragglers.append((job, remaining))
+        # Hedge the jobs with the most work left first
+        return sorted(stragglers, key=lambda item: len(item[1]), reverse=True)
+
+    def idle_slots(self, running):
+        """Slots of the BatchJob that no waiting job will take."""
+        waiting = Job.objects.filter(site_id=self.site.id, state=WAITING_STATES).count()
+        return self.num_slots - len(running) - waiting
+
+    def create_hedge(self, job, remaining):
+        parameters = dict(job.get_parameters())
+        parameters["protein_list"] = ",".join(remaining)
+        parameters["MASTER_PORT"] = int(parameters["MASTER_PORT"]) + HEDGE_PORT_OFFSET
+        hedge = Job(app_id=job.app_id,
+            site_name=self.site.name,
+            workdir=f"{job.workdir}_hedge",
+            parameters=parameters,
+            num_nodes=job.num_nodes,
+            ranks_per_node=job.ranks_per_node,
+            gpus_per_rank=job.gpus_per_rank,
+            wall_time_min=job.wall_time_min,
+            tags={**job.tags, "target": parameters["protein_list"], "hedge_of": str(job.id)},
+            node_packing_count=job.node_packing_count
+        )
+        hedge.save()
+        print(f"Created hedge job {hedge.id} for the {len(remaining)} remaining proteins of job {job.id}")
+        return hedge
+
+    def resolve_hedges(self):
+        """
+        Delete the loser of every hedged pair once either job has finished the hedged proteins,
+        after tagging the winner with the workdir of the loser for build_dot_file.py.
+        """
+        for job_id, hedge in list(self.hedges.items()):
+            originals = Job.objects.filter(id=job_id)
+            hedges = Job.objects.filter(id=hedge.id)
+            if not originals or not hedges:
+                # One of them was removed by hand
+                del self.hedges[job_id]
+                continue
+            original, hedge = originals[0], hedges[0]
+            hedged_proteins = set(self.protein_list(hedge))
+            if hedged_proteins <= self.finished_proteins(original):
+                winner, loser = original, hedge
+            elif hedged_proteins <= self.finished_proteins(hedge):
+                winner, loser = hedge, original
+            else:
+                continue
+            print(f"Job {winner.id} finished the hedged proteins first, deleting job {loser.id}")
+            winner.tags = {**winner.tags, "hedge_loser": str(loser.workdir)}
+            winner.save()
+            loser.delete()
+            del self.hedges[job_id]
+
+    def poll(self):
+        self.resolve_hedges()
+        running = self.running_jobs()
+        free = self.idle_slots(running)
+        for job, remaining in self.find_stragglers(running):
+            if free <= 0:
+                break
+            if self.dry_run:
+                print(f"Would hedge job {job.id} with {len(remaining)} proteins")
+            else:
+                self.hedges[job.id] = self.create_hedge(job, remaining)
+            free -= 1
+
+    def recover_hedges(self):
+        """Pick up the hedges created by a previous run of the monitor."""
+        for hedge in Job.objects.filter(site_id=self.site.id, app_id=self.app_id):
+            if "hedge_of" in hedge.tags:
+                self.hedges[int(hedge.tags["hedge_of"])] = hedge
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hedge straggling LlamaBashApp jobs on idle BatchJob slots')
+    parser.add_argument('--site', default=site_name, help=f'Balsam site name (default: {site_name})')
+    parser.add_argument('--slots', type=int, required=True, help='num_nodes x node_packing_count of the BatchJob')
+    parser.add_argument('--data-path', default=None, help='Data directory of the site (default: <site path>/data)')
+    parser.add_argument('--interval', type=float, default=60, help='Seconds between polls (default: 60)')
+    parser.add_argument('--dry-run', action='store_true', help='Report the stragglers without creating hedges')
+    args = parser.parse_args()
+
+    monitor = StragglerMonitor(args.site, args.slots, args.data_path, dry_run=args.dry_run)
+    monitor.recover_hedges()
+    while True:
+        monitor.poll()
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    exit(main())
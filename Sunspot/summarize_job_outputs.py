@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Site-side summarizer for the LlamaBashApp job outputs.
+
+Run it on Sunspot next to the Balsam site. It watches every job.out under the
+LlamaBashAppOutput directory, extracts the interactions of each newly completed
+** START X ** .. ** END X ** section and appends them as a small numbered delta
+file to a summary directory. build_dot_file.py on the laptop then only fetches
+the deltas it has not applied yet instead of re-reading job.out over sshfs.
+
+Summary directory layout:
+    LATEST              - sequence number of the newest delta file
+    delta_00000001.tsv  - one "protein<TAB>partner" line per new edge; an empty
+                          partner means the protein has no interactions
+    state.json          - byte offsets already consumed per job.out
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+from protein_matching import find_partners, load_protein_index
+
+SECTION_PATTERN = re.compile(rb'\*\* START (\S+) \*\*(.*?)\*\* END \1 \*\*', re.DOTALL)
+
+
+class JobOutputSummarizer:
+    def __init__(self, output_path, summary_path, proteins_csv_path):
+        self.output_path = os.path.abspath(output_path)
+        self.summary_path = os.path.abspath(summary_path)
+        self.state_file = os.path.join(self.summary_path, 'state.json')
+        self.latest_file = os.path.join(self.summary_path, 'LATEST')
+        self.positions, self.regex_proteins = load_protein_index(proteins_csv_path)
+        os.makedirs(self.summary_path, exist_ok=True)
+
+        self.seq = 0
+        self.offsets = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+            self.seq = state['seq']
+            self.offsets = state['offsets']
+        # Rebuild the emitted edges from the site-local deltas so a restart never re-emits them
+        self.emitted = set()
+        for seq in range(1, self.seq + 1):
+            with open(self.delta_file(seq), 'r') as f:
+                for line in f:
+                    self.emitted.add(tuple(line.rstrip('\n').split('\t')))
+
+    def delta_file(self, seq):
+        return os.path.join(self.summary_path, f'delta_{seq:08d}.tsv')
+
+    def job_outputs(self):
+        """
+        Yield the job.out of every job directory, and the job.out.N files that
+        LlamaBashApp keeps from runs before a restart, relative to the output path.
+        """
+        for entry in os.scandir(self.output_path):
+            if entry.is_dir() and os.path.join(self.output_path, entry.name) != self.summary_path:
+                for filename in sorted(os.listdir(entry.path)):
+                    if filename == 'job.out' or filename.startswith('job.out.'):
+                        yield os.path.join(entry.name, filename)
+
+    def read_new_edges(self, job_file):
+        """
+        Extract the edges of the sections completed since the last consumed offset.
+        The offset only moves past complete sections, so a section still being
+        written is picked up in full on a later pass.
+        """
+        path = os.path.join(self.output_path, job_file)
+        offset = self.offsets.get(job_file, 0)
+        if os.path.getsize(path) < offset:
+            # job.out was rotated or truncated by a restart
+            offset = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            content = f.read()
+        edges = []
+        consumed = 0
+        for match in SECTION_PATTERN.finditer(content):
+            protein = match.group(1).decode('utf-8', errors='ignore')
+            section = match.group(2).decode('utf-8', errors='ignore')
+            partners = find_partners(protein, section, self.positions, self.regex_proteins)
+            edges.extend((protein, partner) for partner in partners or [''])
+            consumed = match.end()
+        self.offsets[job_file] = offset + consumed
+        return edges
+
+    def write_atomic(self, path, content):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def summarize(self):
+        """
+        Scan all job outputs once and publish the new edges as the next delta.
+        Returns the number of new edges.
+        """
+        new_edges = []
+        for job_file in self.job_outputs():
+            for edge in self.read_new_edges(job_file):
+                if edge not in self.emitted:
+                    self.emitted.add(edge)
+                    new_edges.append(edge)
+        if new_edges:
+            self.seq += 1
+            self.write_atomic(self.delta_file(self.seq), ''.join(f'{p1}\t{p2}\n' for p1, p2 in new_edges))
+        # The state is written before LATEST so a crash never publishes a delta twice
+        self.write_atomic(self.state_file, json.dumps({'seq': self.seq, 'offsets': self.offsets}))
+        self.write_atomic(self.latest_file, f'{self.seq}\n')
+        return len(new_edges)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize LlamaBashApp job outputs into append-only edge deltas')
+    parser.add_argument('--output-path', required=True, help='LlamaBashAppOutput directory of the site')
+    parser.add_argument('--proteins-csv', default='proteins.csv', help='Proteins CSV file')
+    parser.add_argument('--summary-path', default=None, help='Directory for the deltas (default: <output-path>/_summary)')
+    parser.add_argument('--interval', type=float, default=5, help='Seconds between scans (default: 5)')
+    parser.add_argument('--once', action='store_true', help='Scan once and exit')
+    args = parser.parse_args()
+
+    summary_path = args.summary_path or os.path.join(args.output_path, '_summary')
+    summarizer = JobOutputSummarizer(args.output_path, summary_path, args.proteins_csv)
+    while True:
+        scan_start = time.time()
+        new_edges = summarizer.summarize()
+        if new_edges:
+            print(f"Published delta {summarizer.seq} with {new_edges} new edges in {time.time() - scan_start:.3f} secs")
+        if args.once:
+            break
+        time.sleep(args.interval)
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
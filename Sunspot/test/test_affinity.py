@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Unit tests of the CPU/CCL affinity generator against synthetic node topologies.
+
+Usage:
+    python Sunspot/test/test_affinity.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from affinity import (affinity_groups, format_cpu_list, parse_cpu_list, rank_slots,  # noqa: E402
+                      read_sys_topology, sunspot_topology, synthetic_topology)
+
+# The groups hand-written for Sunspot/define_jobs.py before they were generated
+HAND_WRITTEN_CCL_WORKER_GROUPS = [
+    [1, 9, 17, 25],
+    [33, 41, 53, 61],
+    [69, 77, 85, 93]
+]
+HAND_WRITTEN_CPU_BIND_GROUPS = [
+    ["2-4", "106-108:10-12", "114-116:18-20", "122-124:26-28", "130-132"],
+    ["34-36", "138-140:42-44", "146-148:54-56", "158-160:62-64", "166-168"],
+    ["70-72", "174-176:78-80", "182-184:86-88", "190-192:94-96", "198-200"]
+]
+
+
+def write_sys_tree(root, domains, numa=True):
+    """Write the /sys/devices/system/{cpu,node} files describing a topology."""
+    cpu_path = os.path.join(root, 'cpu')
+    node_path = os.path.join(root, 'node')
+    for domain_id, domain in enumerate(domains):
+        for core_id, core in enumerate(domain):
+            for cpu in core:
+                topology_dir = os.path.join(cpu_path, f'cpu{cpu}', 'topology')
+                os.makedirs(topology_dir)
+                with open(os.path.join(topology_dir, 'physical_package_id'), 'w') as f:
+                    f.write(f'{domain_id}\n')
+                with open(os.path.join(topology_dir, 'core_id'), 'w') as f:
+                    f.write(f'{core_id}\n')
+        if numa:
+            os.makedirs(os.path.join(node_path, f'node{domain_id}'))
+            with open(os.path.join(node_path, f'node{domain_id}', 'cpulist'), 'w') as f:
+                f.write(format_cpu_list([cpu for core in domain for cpu in core]) + '\n')
+    # Not a cpu directory
+    os.makedirs(os.path.join(cpu_path, 'cpufreq'))
+    return cpu_path, node_path
+
+
+class TestAffinity(unittest.TestCase):
+    def test_reproduces_hand_written_sunspot_groups(self):
+        ccl_groups, cpu_bind_groups = affinity_groups(sunspot_topology(), 3, 4)
+        self.assertEqual(ccl_groups, HAND_WRITTEN_CCL_WORKER_GROUPS)
+        # define_jobs.py joined the hand-written lists with ',', ranks are separated by ':'
+        self.assertEqual([':'.join(group) for group in cpu_bind_groups],
+                         [','.join(group) for group in HAND_WRITTEN_CPU_BIND_GROUPS])
+
+    def test_groups_never_overlap(self):
+        topologies = [synthetic_topology(2, 52, 2), synthetic_topology(1, 64, 1),
+                      synthetic_topology(4, 16, 2), synthetic_topology(8, 12, 4)]
+        for domains in topologies:
+            for packing_count in (1, 2, 3, 4):
+                for ranks_per_node in (1, 2, 4):
+                    try:
+                        slots = rank_slots(domains, packing_count * ranks_per_node, cores_per_rank=2)
+                    except ValueError:
+                        continue  # does not fit on this topology
+                    used = [cpu for ccl_cores, threads in slots for cpu in ccl_cores + threads]
+                    self.assertEqual(len(used), len(set(used)), (len(domains), packing_count, ranks_per_node))
+                    self.assertEqual(len(slots), packing_count * ranks_per_node)
+
+    def test_blocks_stay_in_one_domain_and_skip_reserved_cores(self):
+        domains = synthetic_topology(2, 52, 2)
+        domain_of = {cpu: index for index, domain in enumerate(domains) for core in domain for cpu in core}
+        reserved = set(domain[0][0] for domain in domains)
+        for ccl_cores, threads in rank_slots(domains, 12):
+            self.assertEqual(len(set(domain_of[cpu] for cpu in ccl_cores + threads)), 1)
+            self.assertFalse(reserved & set(ccl_cores + threads))
+
+    def test_bound_threads_include_siblings(self):
+        ccl_cores, threads = rank_slots(synthetic_topology(1, 8, 2), 1, cores_per_rank=2)[0]
+        self.assertEqual(ccl_cores, [1])
+        self.assertEqual(threads, [2, 3, 10, 11])
+
+    def test_too_many_ranks_raise(self):
+        with self.assertRaises(ValueError):
+            affinity_groups(synthetic_topology(1, 8, 2), 3, 4)
+
+    def test_cpu_list_round_trip(self):
+        self.assertEqual(format_cpu_list([9, 2, 3, 4, 11, 12]), '2-4,9,11-12')
+        self.assertEqual(parse_cpu_list('2-4,9,11-12\n'), [2, 3, 4, 9, 11, 12])
+
+    def test_read_sys_topology(self):
+        domains = synthetic_topology(2, 6, 2)
+        for numa in (True, False):
+            with tempfile.TemporaryDirectory() as root:
+                cpu_path, node_path = write_sys_tree(root, domains, numa)
+                self.assertEqual(read_sys_topology(cpu_path, node_path), domains)
+
+
+if __name__ == '__main__':
+    unittest.main()
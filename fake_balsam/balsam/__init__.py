@@ -0,0 +1 @@
+"""Offline stand-in for the Balsam client, see balsam.api."""
@@ -0,0 +1,473 @@
+"""
+In-process stand-in for balsam.api backed by a local SQLite store.
+
+Implements the parts of the Balsam client used by the scripts in this repo
+(Job, Site, BatchJob, ApplicationDefinition, site_config) so their client-side
+orchestration overhead can be measured offline. Creating a BatchJob starts a
+fake launcher thread that walks the site's jobs through the Balsam states with
+configurable latencies and runs Python applications in-process.
+
+Latencies are set with configure() or the environment variables
+    FAKE_BALSAM_API_LATENCY  - seconds added to every API round trip (default: 0)
+    FAKE_BALSAM_STAGE_SEC    - seconds spent in each pre/post-processing state (default: 0)
+    FAKE_BALSAM_RUN_SEC      - seconds a shell application stays RUNNING (default: 0)
+    FAKE_BALSAM_POLL_SEC     - polling interval of as_completed and the launcher (default: 0.05)
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+settings = {
+    "api_latency": float(os.environ.get("FAKE_BALSAM_API_LATENCY", 0)),
+    "stage_sec": float(os.environ.get("FAKE_BALSAM_STAGE_SEC", 0)),
+    "run_sec": float(os.environ.get("FAKE_BALSAM_RUN_SEC", 0)),
+    "poll_sec": float(os.environ.get("FAKE_BALSAM_POLL_SEC", 0.05)),
+    "run_apps": True,  # run ApplicationDefinition.run in-process; otherwise use result_factories
+}
+# app name -> callable(parameters) returning the job result when run_apps is False
+result_factories = {}
+# API method name -> [calls, seconds]
+api_stats = {}
+
+JOB_FIELDS = ("workdir", "tags", "num_nodes", "ranks_per_node", "threads_per_rank", "threads_per_core",
+              "gpus_per_rank", "node_packing_count", "wall_time_min", "launch_params", "parent_ids")
+FINAL_STATES = ("JOB_FINISHED", "FAILED")
+# state -> next state reached by the launcher after stage_sec
+STAGED_TRANSITIONS = {
+    "CREATED": "STAGED_IN",
+    "STAGED_IN": "PREPROCESSED",
+    "RUN_DONE": "POSTPROCESSED",
+    "POSTPROCESSED": "JOB_FINISHED",
+    "RUN_ERROR": "FAILED",
+    "RUN_TIMEOUT": "RESTART_READY",
+}
+
+_lock = threading.RLock()
+_db = None
+_apps = {}
+_launcher = None
+
+
+def configure(**kwargs):
+    """Override entries of settings, e.g. configure(api_latency=0.05, run_sec=1)."""
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown fake balsam settings: {sorted(unknown)}")
+    settings.update(kwargs)
+
+
+def reset():
+    """Stop the launcher and start over with an empty store."""
+    global _db, _launcher
+    if _launcher is not None:
+        _launcher.stop()
+        _launcher = None
+    with _lock:
+        if _db is not None:
+            _db.close()
+        _db = None
+    api_stats.clear()
+
+
+def _connection():
+    global _db
+    with _lock:
+        if _db is None:
+            _db = sqlite3.connect(os.environ.get("FAKE_BALSAM_DB", ":memory:"), check_same_thread=False)
+            _db.executescript("""
+                CREATE TABLE IF NOT EXISTS sites (id INTEGER PRIMARY KEY, name TEXT UNIQUE, path TEXT);
+                CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, app_id TEXT, site_id INTEGER, state TEXT,
+                    workdir TEXT, parameters TEXT, tags TEXT, spec TEXT, result BLOB,
+                    created REAL, last_update REAL, batch_job_id INTEGER);
+                CREATE INDEX IF NOT EXISTS jobs_site_state ON jobs (site_id, state);
+                CREATE TABLE IF NOT EXISTS batch_jobs (id INTEGER PRIMARY KEY, site_id INTEGER, spec TEXT);
+                CREATE TABLE IF NOT EXISTS events (job_id INTEGER, from_state TEXT, to_state TEXT, timestamp REAL);
+            """)
+        return _db
+
+
+def _api_call(name):
+    """Account one API round trip and pay the configured latency."""
+    stats = api_stats.setdefault(name, [0, 0.0])
+    stats[0] += 1
+    if settings["api_latency"]:
+        time.sleep(settings["api_latency"])
+        stats[1] += settings["api_latency"]
+
+
+def _set_state(job_id, from_state, to_state, now=None):
+    now = now or time.time()
+    db = _connection()
+    db.execute("UPDATE jobs SET state=?, last_update=? WHERE id=?", (to_state, now, job_id))
+    db.execute("INSERT INTO events VALUES (?, ?, ?, ?)", (job_id, from_state, to_state, now))
+
+
+class site_config:
+    data_path = os.path.join(os.getcwd(), "data")
+
+
+class Site:
+    def __init__(self, id, name, path):
+        self.id = id
+        self.name = name
+        self.path = path
+
+    class objects:
+        @staticmethod
+        def get(name=None, id=None):
+            """Return the site, creating it under ./<name> the first time it is asked for."""
+            _api_call("Site.get")
+            with _lock:
+                db = _connection()
+                if id is not None:
+                    row = db.execute("SELECT id, name, path FROM sites WHERE id=?", (id,)).fetchone()
+                else:
+                    row = db.execute("SELECT id, name, path FROM sites WHERE name=?", (name,)).fetchone()
+                    if row is None:
+                        path = os.path.join(os.getcwd(), name)
+                        cursor = db.execute("INSERT INTO sites (name, path) VALUES (?, ?)", (name, path))
+                        row = (cursor.lastrowid, name, path)
+                db.commit()
+            if row is None:
+                raise LookupError(f"No site with id {id}")
+            return Site(*row)
+
+
+def _site_id(site_name):
+    with _lock:
+        row = _connection().execute("SELECT id FROM sites WHERE name=?", (site_name,)).fetchone()
+    if row is not None:
+        return row[0]
+    return Site.objects.get(site_name).id
+
+
+class JobQuery(list):
+    """List of jobs returned by Job.objects.filter."""
+
+    def count(self):
+        return len(self)
+
+    def delete(self):
+        for job in self:
+            job.delete()
+
+
+class Job:
+    def __init__(self, workdir=None, app_id=None, parameters=None, site_name=None, **kwargs):
+        self.id = None
+        self.app_id = app_id
+        self.site_id = kwargs.pop("site_id", None)
+        if self.site_id is None and site_name is not None:
+            self.site_id = _site_id(site_name)
+        self.workdir = workdir
+        self.parameters = dict(parameters or {})
+        self.tags = dict(kwargs.pop("tags", None) or {})
+        self.spec = kwargs
+        self.state = "CREATED"
+        self.created = None
+        self.last_update = None
+        self.batch_job_id = None
+
+    def __repr__(self):
+        return f"Job(id={self.id}, app_id={self.app_id}, workdir={self.workdir}, state={self.state})"
+
+    @classmethod
+    def _from_row(cls, row):
+        job = cls.__new__(cls)
+        (job.id, job.app_id, job.site_id, job.state, job.workdir, parameters, tags, spec,
+         _, created, last_update, job.batch_job_id) = row
+        job.parameters = json.loads(parameters)
+        job.tags = json.loads(tags)
+        job.spec = json.loads(spec)
+        job.created = datetime.fromtimestamp(created)
+        job.last_update = datetime.fromtimestamp(last_update)
+        return job
+
+    def __getattr__(self, name):
+        spec = self.__dict__.get("spec", {})
+        if name in spec:
+            return spec[name]
+        raise AttributeError(name)
+
+    def get_parameters(self):
+        return self.parameters
+
+    def resolve_workdir(self, data_path):
+        return os.path.join(data_path, self.workdir)
+
+    def _insert(self, db, now):
+        cursor = db.execute(
+            "INSERT INTO jobs (app_id, site_id, state, workdir, parameters, tags, spec, created, last_update)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (self.app_id, self.site_id, self.state, self.workdir, json.dumps(self.parameters),
+             json.dumps(self.tags), json.dumps(self.spec), now, now))
+        self.id = cursor.lastrowid
+        db.execute("INSERT INTO events VALUES (?, ?, ?, ?)", (self.id, None, self.state, now))
+        self.created = self.last_update = datetime.fromtimestamp(now)
+
+    def save(self):
+        _api_call("Job.save")
+        now = time.time()
+        with _lock:
+            db = _connection()
+            if self.id is None:
+                self._insert(db, now)
+            else:
+                row = db.execute("SELECT state FROM jobs WHERE id=?", (self.id,)).fetchone()
+                # Every update bumps last_update, as the onupdate of the Balsam server tables
+                db.execute("UPDATE jobs SET parameters=?, tags=?, workdir=?, last_update=? WHERE id=?",
+                           (json.dumps(self.parameters), json.dumps(self.tags), self.workdir, now, self.id))
+                if row[0] != self.state:
+                    _set_state(self.id, row[0], self.state, now)
+                self.last_update = datetime.fromtimestamp(now)
+            db.commit()
+
+    def refresh_from_db(self):
+        _api_call("Job.refresh_from_db")
+        with _lock:
+            row = _connection().execute("SELECT * FROM jobs WHERE id=?", (self.id,)).fetchone()
+        self.__dict__.update(Job._from_row(row).__dict__)
+
+    def delete(self):
+        _api_call("Job.delete")
+        with _lock:
+            db = _connection()
+            db.execute("DELETE FROM jobs WHERE id=?", (self.id,))
+            db.commit()
+
+    def result(self):
+        _api_call("Job.result")
+        with _lock:
+            row = _connection().execute("SELECT result FROM jobs WHERE id=?", (self.id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return pickle.loads(row[0])
+
+    class objects:
+        @staticmethod
+        def create(**kwargs):
+            job = Job(**kwargs)
+            job.save()
+            return job
+
+        @staticmethod
+        def bulk_create(jobs):
+            _api_call("Job.bulk_create")
+            now = time.time()
+            with _lock:
+                db = _connection()
+                for job in jobs:
+                    job._insert(db, now)
+                db.commit()
+            return list(jobs)
+
+        @staticmethod
+        def filter(id=None, site_id=None, app_id=None, state=None, tags=None, workdir__contains=None,
+                   last_update_after=None, last_update_before=None, batch_job_id=None):
+            _api_call("Job.filter")
+            clauses = []
+            values = []
+            for column, value in (("id", id), ("site_id", site_id), ("app_id", app_id),
+                                  ("state", state), ("batch_job_id", batch_job_id)):
+                if value is None:
+                    continue
+                value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+                clauses.append(f"{column} IN ({','.join('?' * len(value))})")
+                values.extend(value)
+            if workdir__contains is not None:
+                clauses.append("workdir LIKE ?")
+                values.append(f"%{workdir__contains}%")
+            if last_update_after is not None:
+                clauses.append("last_update > ?")
+                values.append(last_update_after.timestamp())
+            if last_update_before is not None:
+                clauses.append("last_update < ?")
+                values.append(last_update_before.timestamp())
+            query = "SELECT * FROM jobs"
+            if clauses:
+                query += " WHERE " + " AND ".join(clauses)
+            with _lock:
+                rows = _connection().execute(query + " ORDER BY id", values).fetchall()
+            jobs = JobQuery(Job._from_row(row) for row in rows)
+            if tags:
+                jobs = JobQuery(job for job in jobs if all(job.tags.get(k) == v for k, v in tags.items()))
+            return jobs
+
+        @staticmethod
+        def get(id):
+            jobs = Job.objects.filter(id=id)
+            if not jobs:
+                raise LookupError(f"No job with id {id}")
+            return jobs[0]
+
+        @staticmethod
+        def as_completed(jobs, timeout=None):
+            """Yield the jobs as they reach a final state, polling the store."""
+            pending = {job.id: job for job in jobs}
+            start = time.time()
+            while pending:
+                for job in Job.objects.filter(id=list(pending), state=list(FINAL_STATES)):
+                    pending.pop(job.id)
+                    yield job
+                if pending:
+                    if timeout is not None and time.time() - start > timeout:
+                        raise TimeoutError(f"{len(pending)} jobs did not complete within {timeout} sec")
+                    time.sleep(settings["poll_sec"])
+
+
+class EventLog:
+    def __init__(self, job_id, from_state, to_state, timestamp):
+        self.job_id = job_id
+        self.from_state = from_state
+        self.to_state = to_state
+        self.timestamp = datetime.fromtimestamp(timestamp)
+
+    class objects:
+        @staticmethod
+        def filter(job_id=None, to_state=None, from_state=None):
+            _api_call("EventLog.filter")
+            clauses = []
+            values = []
+            for column, value in (("job_id", job_id), ("to_state", to_state), ("from_state", from_state)):
+                if value is None:
+                    continue
+                value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+                clauses.append(f"{column} IN ({','.join('?' * len(value))})")
+                values.extend(value)
+            query = "SELECT job_id, from_state, to_state, timestamp FROM events"
+            if clauses:
+                query += " WHERE " + " AND ".join(clauses)
+            with _lock:
+                rows = _connection().execute(query + " ORDER BY timestamp", values).fetchall()
+            return [EventLog(*row) for row in rows]
+
+
+class BatchJob:
+    def __init__(self, id, site_id, **spec):
+        self.id = id
+        self.site_id = site_id
+        self.spec = spec
+
+    class objects:
+        @staticmethod
+        def create(site_id, **spec):
+            """Record the batch job and start launching the site's jobs on its slots."""
+            global _launcher
+            _api_call("BatchJob.create")
+            with _lock:
+                db = _connection()
+                cursor = db.execute("INSERT INTO batch_jobs (site_id, spec) VALUES (?, ?)",
+                                    (site_id, json.dumps(spec, default=str)))
+                db.commit()
+                if _launcher is None:
+                    _launcher = _Launcher()
+                    _launcher.start()
+                _launcher.add_slots(site_id, spec.get("num_nodes", 1), spec.get("filter_tags") or {})
+            return BatchJob(cursor.lastrowid, site_id, **spec)
+
+
+class ApplicationDefinition:
+    site = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _apps[cls.__name__] = cls
+
+    @classmethod
+    def sync(cls):
+        _api_call("ApplicationDefinition.sync")
+        _apps[cls.__name__] = cls
+
+    @classmethod
+    def submit(cls, workdir, **kwargs):
+        job_kwargs = {key: kwargs.pop(key) for key in list(kwargs) if key in JOB_FIELDS}
+        job = Job(workdir=workdir, app_id=cls.__name__, parameters=kwargs, site_name=cls.site, **job_kwargs)
+        job.save()
+        return job
+
+
+class _Launcher(threading.Thread):
+    """
+    Advances jobs through the Balsam states. Each node of a batch job offers
+    node_packing_count slots to the jobs of its site matching the filter tags.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.nodes = []  # (site_id, filter_tags)
+        self.running = {}  # job id -> (finish time, site_id)
+        self.stopped = threading.Event()
+
+    def add_slots(self, site_id, num_nodes, filter_tags):
+        self.nodes.extend([(site_id, filter_tags)] * num_nodes)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def free_slots(self, site_id, job):
+        """Count the node slots the job could still be packed into."""
+        packing = max(int(job.spec.get("node_packing_count", 1)), 1)
+        nodes = sum(1 for node_site, filter_tags in self.nodes
+                    if node_site == site_id and all(job.tags.get(k) == v for k, v in filter_tags.items()))
+        busy = sum(1 for _, running_site in self.running.values() if running_site == site_id)
+        return nodes * packing - busy
+
+    def run_app(self, job):
+        """Run a Python application in-process and store its result."""
+        app = _apps.get(job.app_id)
+        if app is None or not hasattr(app, "run"):
+            return "RUN_DONE"
+        if settings["run_apps"]:
+            instance = app()
+            instance.job = job
+            try:
+                result = instance.run(**job.parameters)
+            except Exception as e:
+                print(f"Fake launcher: job {job.id} raised {e!r}")
+                return "RUN_ERROR"
+        else:
+            result = result_factories[job.app_id](job.parameters)
+        with _lock:
+            _connection().execute("UPDATE jobs SET result=? WHERE id=?", (pickle.dumps(result), job.id))
+        return "RUN_DONE"
+
+    def step(self):
+        now = time.time()
+        with _lock:
+            db = _connection()
+            site_ids = sorted(set(site_id for site_id, _ in self.nodes))
+            rows = db.execute(
+                f"SELECT * FROM jobs WHERE site_id IN ({','.join('?' * len(site_ids))})"
+                " AND state NOT IN ('JOB_FINISHED', 'FAILED') ORDER BY id", site_ids).fetchall()
+        jobs = [Job._from_row(row) for row in rows]
+        # Free the slots of jobs deleted while running
+        live_ids = set(job.id for job in jobs)
+        for job_id in [job_id for job_id in self.running if job_id not in live_ids]:
+            del self.running[job_id]
+        for job in jobs:
+            waited = now - job.last_update.timestamp()
+            if job.state in STAGED_TRANSITIONS and waited >= settings["stage_sec"]:
+                with _lock:
+                    _set_state(job.id, job.state, STAGED_TRANSITIONS[job.state], now)
+            elif job.state in ("PREPROCESSED", "RESTART_READY") and self.free_slots(job.site_id, job) > 0:
+                self.running[job.id] = (now + settings["run_sec"], job.site_id)
+                with _lock:
+                    _set_state(job.id, job.state, "RUNNING", now)
+            elif job.state == "RUNNING" and job.id in self.running and self.running[job.id][0] <= now:
+                del self.running[job.id]
+                to_state = self.run_app(job)
+                with _lock:
+                    _set_state(job.id, "RUNNING", to_state)
+        with _lock:
+            db.commit()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.step()
+            time.sleep(settings["poll_sec"])
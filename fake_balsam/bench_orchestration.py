@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark the client-side orchestration overhead of the Balsam scripts offline.
+
+Runs the scripts against the in-process fake balsam.api in this directory, in a
+temporary working directory holding synthetic proteins.csv, big_table.csv and
+string.csv files, and reports jobs/sec submitted, results/sec consumed and
+filter queries/sec.
+
+Usage:
+    python fake_balsam/bench_orchestration.py --proteins 2000 --api-latency 0.02
+"""
+
+import argparse
+import os
+import random
+import runpy
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import pandas  # noqa: E402,F401  (imported up front so the scripts' timings exclude it)
+from balsam import api  # noqa: E402  (the fake, not the real client)
+
+
+def create_csv_files(directory, num_proteins, seed=0):
+    """Write synthetic proteins.csv, big_table.csv and string.csv files."""
+    rng = random.Random(seed)
+    proteins = [f"P{i:05d}" for i in range(num_proteins)]
+    with open(os.path.join(directory, "proteins.csv"), "w") as f:
+        f.write("search_words\n" + "\n".join(proteins) + "\n")
+    for name in ("big_table.csv", "string.csv"):
+        with open(os.path.join(directory, name), "w") as f:
+            f.write("col1,col2,score\n")
+            for _ in range(num_proteins * 5):
+                f.write(f"{rng.choice(proteins)},{rng.choice(proteins)},{rng.randint(1, 999)}\n")
+    return proteins
+
+
+def run_script(path, run_name="__main__"):
+    """
+    Run a script with its output captured, returning its globals and the elapsed time.
+    Like `python script.py`, the script's directory is searched first for its imports.
+    """
+    sys.path.insert(0, os.path.dirname(path))
+    start = time.time()
+    try:
+        with redirect_stdout(StringIO()):
+            script_globals = runpy.run_path(path, run_name=run_name)
+    finally:
+        sys.path.remove(os.path.dirname(path))
+    return script_globals, time.time() - start
+
+
+def timed_results():
+    """Wrap Job.result to record when each result is consumed."""
+    timestamps = []
+    original_result = api.Job.result
+
+    def result(self):
+        value = original_result(self)
+        timestamps.append(time.time())
+        return value
+
+    api.Job.result = result
+    return timestamps, original_result
+
+
+def bench_define_jobs(site_dir):
+    """jobs/sec submitted by define_jobs.py of a site."""
+    api.reset()
+    _, elapsed = run_script(os.path.join(REPO_DIR, site_dir, "define_jobs.py"))
+    num_jobs = len(api.Job.objects.filter())
+    return {"jobs": num_jobs, "seconds": elapsed, "jobs/sec": num_jobs / elapsed}
+
+
+def bench_polling(proteins, partners_per_protein=10, seed=0):
+    """jobs/sec submitted and results/sec consumed by Sunspot/define_polling_app.py."""
+    rng = random.Random(seed)
+    api.reset()
+    api.configure(run_apps=False)
+
+    def polling_result(parameters):
+        interactions = {p: rng.sample(proteins, partners_per_protein) for p in parameters["proteins"]}
+        return {"interactions": interactions, "digests": {p: p for p in interactions}, "missing": []}
+
+    api.result_factories["BatchPollingApp"] = polling_result
+    timestamps, original_result = timed_results()
+    try:
+        _, elapsed = run_script(os.path.join(REPO_DIR, "Sunspot", "define_polling_app.py"))
+    finally:
+        api.Job.result = original_result
+        api.configure(run_apps=True)
+    jobs = api.Job.objects.filter()
+    created = [job.created.timestamp() for job in jobs]
+    submit_seconds = max(created) - min(created) or 1e-9
+    consume_seconds = (timestamps[-1] - timestamps[0]) if len(timestamps) > 1 else 1e-9
+    return {
+        "jobs": len(jobs),
+        "seconds": elapsed,
+        "jobs/sec": len(jobs) / submit_seconds,
+        "results/sec": len(timestamps) / consume_seconds,
+    }
+
+
+def bench_discovery(proteins, batch_size=100, rounds=20, updates_per_round=5):
+    """Filter queries/sec and jobs discovered by Sunspot/build_dot_file.proteins_to_process()."""
+    api.reset()
+    site = api.Site.objects.get("LlamaDemo")
+    batches = [proteins[i:i + batch_size] for i in range(0, len(proteins), batch_size)]
+    jobs = api.Job.objects.bulk_create([
+        api.Job(app_id="LlamaBashApp", site_name=site.name, workdir=f"LlamaBashAppOutput/{n}",
+                parameters={"protein_list": ",".join(batch)})
+        for n, batch in enumerate(batches)
+    ])
+    script_globals, _ = run_script(os.path.join(REPO_DIR, "Sunspot", "build_dot_file.py"), run_name="bench")
+    proteins_to_process = script_globals["proteins_to_process"]
+    start = time.time()
+    with redirect_stdout(StringIO()):
+        discovered = len(proteins_to_process())
+        first_query = time.time() - start
+        for _ in range(rounds):
+            for job in random.sample(jobs, min(updates_per_round, len(jobs))):
+                job.state = "RUNNING"
+                job.save()
+            discovered += len(proteins_to_process())
+    elapsed = time.time() - start
+    return {
+        "jobs": len(jobs),
+        "discovered": discovered,
+        "first query sec": first_query,
+        "queries/sec": (rounds + 1) / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Balsam client orchestration against the fake balsam.api")
+    parser.add_argument("--proteins", type=int, default=1000, help="Number of synthetic proteins (default: 1000)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds per simulated API round trip")
+    parser.add_argument("--stage-sec", type=float, default=0.0, help="Seconds spent in each staging state")
+    parser.add_argument("--run-sec", type=float, default=0.0, help="Seconds each job stays RUNNING")
+    parser.add_argument("--scenarios", default="polaris_jobs,sunspot_jobs,polling,discovery",
+                        help="Comma-separated scenarios to run")
+    args = parser.parse_args()
+
+    api.configure(api_latency=args.api_latency, stage_sec=args.stage_sec, run_sec=args.run_sec)
+    scenarios = args.scenarios.split(",")
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            proteins = create_csv_files(work_dir, args.proteins)
+            if "polaris_jobs" in scenarios:
+                results["polaris_jobs"] = bench_define_jobs("Polaris")
+            if "sunspot_jobs" in scenarios:
+                results["sunspot_jobs"] = bench_define_jobs("Sunspot")
+            if "polling" in scenarios:
+                results["polling"] = bench_polling(proteins)
+            if "discovery" in scenarios:
+                results["discovery"] = bench_discovery(proteins)
+            api.reset()
+        finally:
+            os.chdir(cwd)
+
+    print(f"ORCHESTRATION BENCHMARK ({args.proteins:,} proteins, {args.api_latency}s API latency)")
+    print("=" * 60)
+    for scenario, metrics in results.items():
+        print(scenario)
+        for metric, value in metrics.items():
+            print(f"  {metric:<16} {value:,.3f}" if isinstance(value, float) else f"  {metric:<16} {value:,}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())